@@ -0,0 +1 @@
+# Módulos de soporte del Sistema de Cotización Automatizada Transporte Rio Lavayen
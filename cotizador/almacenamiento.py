@@ -0,0 +1,105 @@
+# Escrituras de cotizaciones en Supabase (tablas y Storage).
+# Estas funciones no usan Streamlit: lanzan ErrorAlmacenamiento y el que las
+# llama decide cómo mostrar el error.
+
+import base64
+import os
+import zlib
+
+from cotizador.documentos import VERSION_PLANTILLA, renderizar_documento
+from cotizador.metricas import medir
+
+BUCKET_COTIZACIONES = "cotizaciones"
+
+# Qué se guarda en 'cotizaciones_html' por cotización:
+#   completo:   el HTML tal cual (html_cotizacion)
+#   comprimido: el HTML con zlib, en base64 (html_comprimido)
+#   compacto:   solo el documento (JSON) y version_plantilla; el HTML y el PDF
+#               se vuelven a generar a pedido (ver cotizador.documentos_guardados)
+MODOS_ALMACENAMIENTO = ("completo", "comprimido", "compacto")
+MODO_ALMACENAMIENTO = os.environ.get("COTIZADOR_ALMACENAMIENTO", "completo")
+
+
+class ErrorAlmacenamiento(Exception):
+    pass
+
+
+def comprimir_html(html):
+    return base64.b64encode(zlib.compress(html.encode("utf-8"), 9)).decode("ascii")
+
+
+def descomprimir_html(comprimido):
+    return zlib.decompress(base64.b64decode(comprimido)).decode("utf-8")
+
+
+# Función para armar la fila de 'cotizaciones_html' según el modo de almacenamiento.
+# Sin documento (p. ej. una cotización recuperada de la caché local) el modo
+# compacto guarda el HTML comprimido. Fuera del modo completo (que mantiene la
+# fila original) todas las filas llevan las mismas columnas, con null en las que
+# no usa: PostgREST exige claves iguales en un upsert por lotes y así un upsert
+# también limpia el formato anterior.
+def fila_html(cotizacion_id, html_cotizacion, documento=None, modo=None):
+    modo = modo or MODO_ALMACENAMIENTO
+    if modo not in MODOS_ALMACENAMIENTO:
+        raise ValueError(f"Modo de almacenamiento desconocido: {modo}")
+    if modo == "completo":
+        return {"id": cotizacion_id, "html_cotizacion": html_cotizacion}
+    fila = {"id": cotizacion_id, "html_cotizacion": None, "html_comprimido": None,
+            "documento": None, "version_plantilla": None}
+    if modo == "compacto" and documento is not None:
+        fila.update(documento=documento, version_plantilla=VERSION_PLANTILLA)
+    else:
+        fila["html_comprimido"] = comprimir_html(html_cotizacion)
+    return fila
+
+
+# Función para obtener el HTML de una fila de 'cotizaciones_html' en cualquiera
+# de los modos; None si la fila no tiene contenido
+def html_desde_fila(fila):
+    if fila.get("html_cotizacion"):
+        return fila["html_cotizacion"]
+    if fila.get("html_comprimido"):
+        return descomprimir_html(fila["html_comprimido"])
+    if fila.get("documento"):
+        return renderizar_documento(fila["id"], fila["documento"], fila.get("version_plantilla") or VERSION_PLANTILLA)
+    return None
+
+
+# Función para armar las filas de cada tabla para una cotización
+def filas_cotizacion(cotizacion_id, datos_cotizacion, html_cotizacion, documento=None):
+    return {
+        'cotizaciones': datos_cotizacion,
+        'cotizaciones_html': fila_html(cotizacion_id, html_cotizacion, documento),
+    }
+
+
+# Función para insertar (upsert por id) un lote de filas en una tabla
+@medir("supabase_guardado")
+def upsert_filas(supabase, tabla, filas):
+    response = supabase.table(tabla).upsert(filas, on_conflict="id").execute()
+    if hasattr(response, 'error') and response.error:
+        raise ErrorAlmacenamiento(f"Error en {tabla}: {response.error}")
+
+
+# Función para guardar la cotización en las tablas 'cotizaciones' y 'cotizaciones_html'.
+# Usa upsert por id para que un reintento no falle por clave duplicada.
+def guardar_cotizacion(supabase, cotizacion_id, datos_cotizacion, html_cotizacion, documento=None):
+    for tabla, fila in filas_cotizacion(cotizacion_id, datos_cotizacion, html_cotizacion, documento).items():
+        upsert_filas(supabase, tabla, fila)
+
+
+# Función para armar la URL pública de un archivo del Storage
+def url_publica(url_supabase, nombre_archivo, bucket_name=BUCKET_COTIZACIONES):
+    return f"{url_supabase}/storage/v1/object/public/{bucket_name}/{nombre_archivo}"
+
+
+# Función para subir un PDF (bytes) al Storage; devuelve la URL pública
+@medir("supabase_subida")
+def subir_pdf(supabase, url_supabase, nombre_archivo, pdf_bytes, bucket_name=BUCKET_COTIZACIONES):
+    try:
+        supabase.storage.from_(bucket_name).upload(nombre_archivo, pdf_bytes)
+    except Exception as e:
+        # Si el archivo ya existe (p. ej. un reintento), la URL es la misma
+        if "resource already exists" not in str(e) and "Duplicate" not in str(e):
+            raise ErrorAlmacenamiento(f"Error al subir el PDF: {e}") from e
+    return url_publica(url_supabase, nombre_archivo, bucket_name)
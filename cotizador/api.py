@@ -0,0 +1,433 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from aiohttp import web
+
+from cotizador.cache_cotizaciones import VALIDEZ_SEGUNDOS
+from cotizador.configuracion import cargar_secretos
+from cotizador.contexto import crear_contexto
+from cotizador.lote import cotizar_lote
+from cotizador.metricas import registro
+from cotizador.pdf import ErrorPDF
+from cotizador.precios import calcular_costo, rango_carga
+from cotizador.ruteo import ErrorRuteo, ResultadoDistancia
+from cotizador.trabajos import PipelineSaturado
+
+# API HTTP (asyncio) de cotizaciones, paralela a la UI de Streamlit.
+# Usa el mismo contexto que la app (tarifas, caché de distancias, cliente ORS,
+# outbox y pipeline de PDF); todo lo bloqueante corre en un pool de hilos.
+#
+#   python -m cotizador.api --host 0.0.0.0 --puerto 8000
+#
+#   POST /quote          cotiza y registra un envío (reutiliza la misma cotización por 24 hs);
+#                        sin "deposito" elige el depósito más cercano por ruta; "id_zona" es
+#                        obligatorio solo para localidades repetidas en varias zonas
+#   POST /quotes/batch   cotiza un lote de envíos (sin registrarlos)
+#   GET  /quote/{id}     estado de una cotización
+#   GET  /quote/{id}/html, /quote/{id}/pdf   documento (se vuelve a generar si se guardó compacto)
+#   GET  /quote/{id}/verificacion   estado y monto (con caché); GET /v/{token} lo mismo desde el QR firmado
+#   GET  /localidades?q=texto              búsqueda por prefijo / aproximada
+#   GET  /localidades/cercana?lat=..&lon=..  localidad más cercana
+#   GET  /metrics        métricas en formato Prometheus
+
+logger = logging.getLogger(__name__)
+
+MAX_ENVIOS_LOTE = 100_000
+
+CLAVE_CONTEXTO = web.AppKey("contexto", object)
+CLAVE_POOL = web.AppKey("pool", ThreadPoolExecutor)
+
+
+class ErrorSolicitud(Exception):
+    def __init__(self, mensaje, estado=400):
+        super().__init__(mensaje)
+        self.estado = estado
+
+
+def _error(mensaje, estado):
+    return web.json_response({"error": mensaje}, status=estado)
+
+
+async def _en_pool(request, funcion, *args):
+    return await asyncio.get_running_loop().run_in_executor(request.app[CLAVE_POOL], funcion, *args)
+
+
+async def _leer_json(request):
+    try:
+        return await request.json()
+    except ValueError as e:
+        raise ErrorSolicitud("El cuerpo debe ser JSON") from e
+
+
+# Función para parsear un cuerpo JSON crudo (para cuerpos grandes, dentro del pool)
+def _parsear_json(datos):
+    try:
+        return json.loads(datos)
+    except ValueError as e:
+        raise ErrorSolicitud("El cuerpo debe ser JSON") from e
+
+
+def _a_bool(valor):
+    if isinstance(valor, str):
+        return valor.strip().lower() in {"1", "true", "si", "sí", "s", "yes"}
+    return bool(valor)
+
+
+# Función para validar y normalizar el pedido de una cotización
+def validar_envio(contexto, tarifas, cuerpo):
+    if not isinstance(cuerpo, dict):
+        raise ErrorSolicitud("El cuerpo debe ser un objeto JSON")
+
+    # Sin depósito (o "auto") se elige el más conveniente para el destino
+    deposito = cuerpo.get("deposito") or "auto"
+    deposito_info = contexto.depositos_por_nombre.get(deposito)
+    if deposito_info is None and deposito != "auto":
+        raise ErrorSolicitud("Depósito desconocido")
+
+    # id_zona solo hace falta para localidades que se repiten en varias zonas
+    nombre = str(cuerpo.get("localidad", ""))
+    zona_pedida = cuerpo.get("id_zona")
+    destino_info = tarifas.buscar_localidad(nombre, zona_pedida)
+    if destino_info is None:
+        if zona_pedida in (None, "") and len(tarifas.localidades_con_nombre(nombre)) > 1:
+            raise ErrorSolicitud("Localidad repetida en varias zonas: indique id_zona")
+        raise ErrorSolicitud("Localidad no encontrada")
+
+    peso = cuerpo.get("tipo_carga")
+    id_zona = destino_info['ID_Zona']
+    if not peso or tarifas.tarifa(id_zona, peso) is None:
+        raise ErrorSolicitud("Tipo de carga inválido para la zona de destino")
+
+    rango = rango_carga(peso)
+    try:
+        cantidad_pedida = cuerpo.get("cantidad", rango["min"])
+        cantidad = int(float(cantidad_pedida))
+        if cantidad != float(cantidad_pedida):
+            raise ValueError("La cantidad debe ser un número entero")
+        valor_mercaderia = float(cuerpo.get("valor_declarado") or 0)
+    except (TypeError, ValueError, OverflowError) as e:
+        raise ErrorSolicitud("Cantidad o valor declarado inválidos") from e
+    if cantidad < rango["min"] or (rango["max"] is not None and cantidad > rango["max"]):
+        raise ErrorSolicitud(f"La cantidad debe estar entre {rango['min']} y {rango['max'] or 'sin límite'}")
+    # Mismo criterio que la UI (min_value=0); nan/inf darían un costo NaN o infinito
+    if not math.isfinite(valor_mercaderia) or valor_mercaderia < 0:
+        raise ErrorSolicitud("El valor declarado debe ser un número mayor o igual a 0")
+
+    return {
+        "deposito_info": deposito_info,
+        "destino_info": destino_info,
+        "id_zona": id_zona,
+        "peso": peso,
+        "cantidad": cantidad,
+        "incluir_iva": _a_bool(cuerpo.get("incluir_iva", False)),
+        "desea_facturar": _a_bool(cuerpo.get("desea_facturar", False)),
+        "valor_mercaderia": valor_mercaderia,
+    }
+
+
+async def crear_cotizacion(request):
+    contexto = request.app[CLAVE_CONTEXTO]
+    tarifas = contexto.tarifas
+    envio = validar_envio(contexto, tarifas, await _leer_json(request))
+    deposito_info = envio["deposito_info"]
+    destino_info = envio["destino_info"]
+
+    alternativas = None
+    if deposito_info is None:
+        opciones = await _en_pool(
+            request, contexto.rankear_depositos, destino_info["Latitud"], destino_info["Longitud"]
+        )
+        deposito_info = opciones[0].deposito
+        resultado = ResultadoDistancia(opciones[0].distancia_km, opciones[0].aproximada)
+        alternativas = [
+            {"deposito": opcion.deposito["Nombre"], "distancia_km": opcion.distancia_km,
+             "distancia_aproximada": opcion.aproximada}
+            for opcion in opciones[1:]
+        ]
+    else:
+        try:
+            resultado = await _en_pool(
+                request, contexto.distancia,
+                deposito_info["Latitud"], deposito_info["Longitud"], destino_info["Latitud"], destino_info["Longitud"],
+            )
+        except ErrorRuteo as e:
+            raise ErrorSolicitud(str(e), estado=502) from e
+
+    costo_final = calcular_costo(
+        tarifas, envio["id_zona"], envio["peso"], destino_info["Localidad"],
+        envio["incluir_iva"], envio["cantidad"], envio["valor_mercaderia"],
+    )
+    if not costo_final or not math.isfinite(costo_final) or costo_final <= 0:
+        raise ErrorSolicitud("No se pudo calcular el costo", estado=422)
+
+    try:
+        trabajo, reutilizada = await _en_pool(
+            request, contexto.generar_cotizacion,
+            deposito_info, envio["id_zona"], destino_info["Localidad"], envio["peso"], resultado.km,
+            costo_final, envio["incluir_iva"], envio["desea_facturar"], envio["cantidad"], envio["valor_mercaderia"],
+        )
+    except ValueError as e:
+        raise ErrorSolicitud(str(e), estado=500) from e
+    except PipelineSaturado as e:
+        raise ErrorSolicitud(str(e), estado=503) from e
+
+    return web.json_response({
+        **trabajo.datos_cotizacion,
+        "id_zona": envio["id_zona"],
+        "tipo_carga": envio["peso"],
+        "distancia_aproximada": resultado.aproximada,
+        "tarifas_version": tarifas.version,
+        "reutilizada": reutilizada,
+        **({"alternativas": alternativas} if alternativas is not None else {}),
+        "valida_hasta": datetime.fromtimestamp(trabajo.creado + VALIDEZ_SEGUNDOS).isoformat(timespec="minutes"),
+        "estado_url": f"/quote/{trabajo.cotizacion_id}",
+    }, status=200 if reutilizada else 201)
+
+
+def _a_json(valor):
+    if hasattr(valor, "item"):
+        valor = valor.item()
+    if isinstance(valor, float) and math.isnan(valor):
+        return None
+    return valor
+
+
+def _es_numerico(valor):
+    if valor is None or (isinstance(valor, (int, float)) and not isinstance(valor, bool)):
+        return True
+    if isinstance(valor, str):
+        try:
+            float(valor or 0)
+        except ValueError:
+            return False
+        return True
+    return False
+
+
+# Función para cotizar un lote desde el cuerpo crudo de la solicitud (bloqueante: corre en el
+# pool, con el parseo y el armado de la respuesta); devuelve el JSON de la respuesta
+def procesar_lote(contexto, datos):
+    cuerpo = _parsear_json(datos)
+    envios = cuerpo.get("envios") if isinstance(cuerpo, dict) else cuerpo
+    if not isinstance(envios, list) or not envios:
+        raise ErrorSolicitud("Se espera una lista 'envios'")
+    if len(envios) > MAX_ENVIOS_LOTE:
+        raise ErrorSolicitud(f"Máximo {MAX_ENVIOS_LOTE} envíos por lote", estado=413)
+
+    for i, envio in enumerate(envios):
+        if not isinstance(envio, dict):
+            raise ErrorSolicitud(f"envios[{i}] debe ser un objeto")
+        for columna in ("cantidad", "valor_declarado"):
+            if not _es_numerico(envio.get(columna)):
+                raise ErrorSolicitud(f"envios[{i}].{columna} debe ser numérico")
+
+    columnas = {
+        columna: [envio.get(columna, "") for envio in envios]
+        for columna in ("deposito", "localidad", "tipo_carga", "cantidad", "incluir_iva", "valor_declarado", "id_zona")
+    }
+    for columna in ("cantidad", "valor_declarado", "id_zona"):
+        columnas[columna] = ["" if valor is None else str(valor) for valor in columnas[columna]]
+    columnas["incluir_iva"] = ["si" if _a_bool(valor) else "no" for valor in columnas["incluir_iva"]]
+
+    tarifas = contexto.tarifas
+    resultado = cotizar_lote(columnas, tarifas, contexto.depositos, contexto.cache_distancias)
+    nombres = list(resultado)
+    filas = []
+    for valores in zip(*(resultado[nombre] for nombre in nombres)):
+        fila = {nombre: _a_json(valor) for nombre, valor in zip(nombres, valores)}
+        fila["error"] = fila["error"] or None
+        filas.append(fila)
+    return json.dumps({"tarifas_version": tarifas.version, "cotizaciones": filas})
+
+
+async def cotizar_lote_api(request):
+    datos = await request.read()
+    texto = await _en_pool(request, procesar_lote, request.app[CLAVE_CONTEXTO], datos)
+    return web.Response(text=texto, content_type="application/json")
+
+
+# Función para consultar una cotización en Supabase (bloqueante)
+def buscar_cotizacion_supabase(supabase, cotizacion_id):
+    response = supabase.table('cotizaciones').select('*').eq('id', cotizacion_id).limit(1).execute()
+    return response.data[0] if response.data else None
+
+
+async def obtener_cotizacion(request):
+    contexto = request.app[CLAVE_CONTEXTO]
+    cotizacion_id = request.match_info["id"]
+
+    trabajo = contexto.pipeline.obtener(cotizacion_id)
+    if trabajo is not None:
+        return web.json_response({
+            **trabajo.datos_cotizacion,
+            "etapas": trabajo.estado(),
+            "errores": trabajo.errores(),
+            "pdf_url": trabajo.url_publica,
+        })
+
+    try:
+        datos = await _en_pool(request, buscar_cotizacion_supabase, contexto.supabase, cotizacion_id)
+    except Exception as e:
+        logger.warning("No se pudo consultar la cotización %s: %s", cotizacion_id, e)
+        return _error("No se pudo consultar la cotización", 503)
+    if datos is None:
+        return _error("Cotización no encontrada", 404)
+    return web.json_response(datos)
+
+
+# HTML de una cotización: el del pipeline si todavía está en memoria, si no el guardado
+def _html_cotizacion(contexto, cotizacion_id):
+    trabajo = contexto.pipeline.obtener(cotizacion_id)
+    if trabajo is not None:
+        return trabajo.html_cotizacion
+    return contexto.documentos.html(cotizacion_id)
+
+
+async def obtener_html(request):
+    cotizacion_id = request.match_info["id"]
+    try:
+        html = await _en_pool(request, _html_cotizacion, request.app[CLAVE_CONTEXTO], cotizacion_id)
+    except Exception as e:
+        logger.warning("No se pudo obtener el HTML de %s: %s", cotizacion_id, e)
+        return _error("No se pudo consultar la cotización", 503)
+    if html is None:
+        return _error("Cotización no encontrada", 404)
+    return web.Response(text=html, content_type="text/html", charset="utf-8")
+
+
+async def obtener_pdf(request):
+    contexto = request.app[CLAVE_CONTEXTO]
+    cotizacion_id = request.match_info["id"]
+    trabajo = contexto.pipeline.obtener(cotizacion_id)
+    try:
+        if trabajo is not None and trabajo.pdf_bytes is not None:
+            pdf_bytes = trabajo.pdf_bytes
+        else:
+            pdf_bytes = await _en_pool(request, contexto.documentos.pdf, cotizacion_id)
+    except ErrorPDF as e:
+        return _error(str(e), 500)
+    except Exception as e:
+        logger.warning("No se pudo obtener el PDF de %s: %s", cotizacion_id, e)
+        return _error("No se pudo consultar la cotización", 503)
+    if pdf_bytes is None:
+        return _error("Cotización no encontrada", 404)
+    return web.Response(body=pdf_bytes, content_type="application/pdf", headers={
+        "Content-Disposition": f'inline; filename="{cotizacion_id}.pdf"',
+    })
+
+
+async def _verificar(request, cotizacion_id):
+    try:
+        resultado = await _en_pool(request, request.app[CLAVE_CONTEXTO].verificador.consultar, cotizacion_id)
+    except Exception as e:
+        logger.warning("No se pudo verificar la cotización %s: %s", cotizacion_id, e)
+        return _error("No se pudo consultar la cotización", 503)
+    if resultado is None:
+        return _error("Cotización no encontrada", 404)
+    return web.json_response(resultado)
+
+
+async def verificar_cotizacion(request):
+    return await _verificar(request, request.match_info["id"])
+
+
+# Verificación desde el enlace firmado del QR
+async def verificar_token(request):
+    contexto = request.app[CLAVE_CONTEXTO]
+    if contexto.verificacion is None:
+        return _error("Verificación no configurada", 404)
+    cotizacion_id = contexto.leer_token_verificacion(request.match_info["token"])
+    if cotizacion_id is None:
+        return _error("Enlace de verificación inválido", 403)
+    return await _verificar(request, cotizacion_id)
+
+
+async def buscar_localidades(request):
+    buscador = request.app[CLAVE_CONTEXTO].tarifas.buscador
+    try:
+        limite = min(int(request.query.get("limite", 10)), 100)
+    except ValueError as e:
+        raise ErrorSolicitud("limite inválido") from e
+    return web.json_response({"localidades": buscador.buscar(request.query.get("q", ""), limite=limite)})
+
+
+async def localidad_cercana(request):
+    buscador = request.app[CLAVE_CONTEXTO].tarifas.buscador
+    try:
+        lat, lon = float(request.query["lat"]), float(request.query["lon"])
+    except (KeyError, ValueError) as e:
+        raise ErrorSolicitud("Se esperan lat y lon") from e
+    cercana = buscador.mas_cercana(lat, lon)
+    if cercana is None:
+        return _error("Sin localidades", 404)
+    return web.json_response({"localidad": cercana[0], "distancia_km": round(cercana[1], 3)})
+
+
+async def salud(request):
+    contexto = request.app[CLAVE_CONTEXTO]
+    return web.json_response({"estado": "ok", "tarifas_version": contexto.tarifas.version})
+
+
+# Métricas en formato Prometheus (las mismas que el sidecar de COTIZADOR_METRICAS_PUERTO)
+async def metricas(request):
+    return web.Response(text=registro.exportar_prometheus(), content_type="text/plain", charset="utf-8")
+
+
+@web.middleware
+async def manejar_errores(request, handler):
+    inicio = time.perf_counter()
+    ruta = request.match_info.route.resource.canonical if request.match_info.route.resource else "desconocida"
+    try:
+        return await handler(request)
+    except ErrorSolicitud as e:
+        return _error(str(e), e.estado)
+    finally:
+        registro.observar("api_segundos", time.perf_counter() - inicio, ruta=ruta, metodo=request.method)
+
+
+async def _cerrar(app):
+    contexto = app[CLAVE_CONTEXTO]
+    contexto.pipeline.cerrar()
+    contexto.outbox.detener()
+    app[CLAVE_POOL].shutdown(wait=False)
+
+
+# Función para armar la aplicación aiohttp
+def crear_app(contexto, hilos=32):
+    app = web.Application(middlewares=[manejar_errores], client_max_size=50 * 1024 * 1024)
+    app[CLAVE_CONTEXTO] = contexto
+    app[CLAVE_POOL] = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="api")
+    app.router.add_post("/quote", crear_cotizacion)
+    app.router.add_post("/quotes/batch", cotizar_lote_api)
+    app.router.add_get("/quote/{id}", obtener_cotizacion)
+    app.router.add_get("/quote/{id}/html", obtener_html)
+    app.router.add_get("/quote/{id}/pdf", obtener_pdf)
+    app.router.add_get("/quote/{id}/verificacion", verificar_cotizacion)
+    app.router.add_get("/v/{token}", verificar_token)
+    app.router.add_get("/localidades", buscar_localidades)
+    app.router.add_get("/localidades/cercana", localidad_cercana)
+    app.router.add_get("/salud", salud)
+    app.router.add_get("/metrics", metricas)
+    app.on_cleanup.append(_cerrar)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API HTTP de cotizaciones")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--puerto", type=int, default=8000)
+    parser.add_argument("--hilos", type=int, default=32, help="Hilos para ORS, QR/HTML y Supabase")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(crear_app(crear_contexto(cargar_secretos()), hilos=args.hilos), host=args.host, port=args.puerto)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from cotizador import ors_simulado, supabase_simulado
+from cotizador.almacenamiento import guardar_cotizacion, subir_pdf
+from cotizador.cache_cotizaciones import CacheCotizaciones
+from cotizador.cache_distancias import CacheDistancias
+from cotizador.contexto import ContextoApp
+from cotizador.documentos import generar_html_cotizacion, generar_qr
+from cotizador.pdf import ErrorPDF, convertir_html_a_pdf
+from cotizador.precios import calcular_costo
+from cotizador.ruteo import ClienteORS
+from cotizador.tarifas import compilar_snapshot
+from cotizador.trabajos import PipelineCotizacion
+
+# Benchmarks reproducibles del camino de una cotización, etapa por etapa y de
+# punta a punta, contra el ORS y el Supabase simulados (en el mismo proceso,
+# sin red) y con cachés en un directorio temporal.
+#
+#   python -m cotizador.benchmark -o benchmark.json
+#   python -m cotizador.benchmark --base benchmark.json --umbral 0.25 --umbral-etapa pdf=0.5
+#
+# El resultado es un JSON con mediana, p95 y mínimo por etapa. Con --base se
+# compara la mediana de cada etapa contra la de otra corrida (p. ej. la del
+# commit anterior) y el proceso termina con código 1 si alguna empeoró más que
+# su umbral. Diferencias menores a --margen-ms se ignoran (ruido).
+
+VERSION_FORMATO = 1
+
+UMBRAL_RELATIVO = 0.25
+MARGEN_MS = 0.05
+
+DEPOSITO = "CASA CENTRAL SAN PEDRO DE JUJUY"
+ID_ZONA = 2
+LOCALIDAD = "TILCARA"
+TIPO_CARGA = "DE 21 KG A 100 KG"
+
+
+def _percentil(muestras, p):
+    ordenadas = sorted(muestras)
+    return ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * p))]
+
+
+# Función para medir una etapa: `calentamiento` llamadas sin medir y después `repeticiones` medidas.
+# etapa(i) recibe el número de iteración para poder variar la entrada (p. ej. forzar fallos de caché).
+def medir_etapa(etapa, repeticiones, calentamiento=3):
+    for i in range(calentamiento):
+        etapa(-1 - i)
+    tiempos = []
+    for i in range(repeticiones):
+        inicio = time.perf_counter_ns()
+        etapa(i)
+        tiempos.append((time.perf_counter_ns() - inicio) / 1e6)
+    return {
+        "repeticiones": repeticiones,
+        "mediana_ms": round(statistics.median(tiempos), 4),
+        "p95_ms": round(_percentil(tiempos, 0.95), 4),
+        "min_ms": round(min(tiempos), 4),
+        "media_ms": round(statistics.fmean(tiempos), 4),
+    }
+
+
+class Entorno:
+    def __init__(self, directorio):
+        from supabase import create_client
+
+        self.directorio = directorio
+        self.ors = ors_simulado.iniciar_servidor_simulado()
+        self.supabase_servidor = supabase_simulado.iniciar_servidor_simulado()
+        self.supabase = create_client(self.supabase_servidor.url_base, "benchmark")
+
+        self.cache_distancias = CacheDistancias(os.path.join(directorio, "distancias.db"), ruta_json_legado=None)
+        self.cache_cotizaciones = CacheCotizaciones(os.path.join(directorio, "cotizaciones.db"))
+        self.pipeline = PipelineCotizacion(
+            self.supabase, self.supabase_servidor.url_base, al_subir=self.cache_cotizaciones.registrar_url
+        )
+        self.contexto = ContextoApp(
+            supabase=self.supabase, ruteo=ClienteORS("benchmark", url_base=self.ors.url_base),
+            pipeline=self.pipeline, cache_distancias=self.cache_distancias,
+            cache_cotizaciones=self.cache_cotizaciones,
+        )
+        self.tarifas = self.contexto.tarifas
+        self.deposito = self.contexto.depositos_por_nombre[DEPOSITO]
+        self.localidad = self.tarifas.localidad(ID_ZONA, LOCALIDAD)
+        self.id_zona = self.localidad["ID_Zona"]
+
+    # Destino distinto en cada iteración (~100 m de corrimiento): siempre un fallo de caché
+    def destino(self, i):
+        return self.localidad["Latitud"] + (i + 10) * 0.001, self.localidad["Longitud"]
+
+    def cerrar(self):
+        self.pipeline.cerrar()
+        self.contexto.ruteo.cerrar()
+        self.cache_distancias.cerrar()
+        self.cache_cotizaciones.cerrar()
+        self.ors.shutdown()
+        self.supabase_servidor.shutdown()
+
+
+# Función para correr todas las etapas; devuelve {etapa: resultado}
+def correr_benchmarks(repeticiones=50, etapas=None):
+    directorio = tempfile.mkdtemp(prefix="cotizador-benchmark-")
+    entorno = Entorno(directorio)
+    origen = (entorno.deposito["Latitud"], entorno.deposito["Longitud"])
+    destino_fijo = (entorno.localidad["Latitud"], entorno.localidad["Longitud"])
+    entorno.contexto.distancia(*origen, *destino_fijo)
+    costo_final = calcular_costo(entorno.tarifas, entorno.id_zona, TIPO_CARGA, LOCALIDAD, True, 30, 150000)
+    html = generar_html_cotizacion(
+        entorno.deposito, entorno.id_zona, LOCALIDAD, TIPO_CARGA, 100.0, costo_final,
+        True, False, str(uuid.uuid4()), 30, 150000,
+    )
+
+    def arranque_json(i):
+        compilar_snapshot()
+        with open("Depositos.json", "r") as f:
+            json.load(f)
+
+    def distancia_acierto(i):
+        entorno.contexto.distancia(*origen, *destino_fijo)
+
+    def distancia_fallo(i):
+        entorno.contexto.distancia(*origen, *entorno.destino(i + 100_000))
+
+    def costo(i):
+        calcular_costo(entorno.tarifas, entorno.id_zona, TIPO_CARGA, LOCALIDAD, True, 30 + i % 50, 150000)
+
+    def qr(i):
+        generar_qr(f"ID Cotización: {i}\nMonto: ${costo_final:,.2f}\nDestino: {LOCALIDAD}")
+
+    def html_cotizacion(i):
+        generar_html_cotizacion(
+            entorno.deposito, entorno.id_zona, LOCALIDAD, TIPO_CARGA, 100.0, costo_final,
+            True, False, str(uuid.uuid4()), 30, 150000,
+        )
+
+    def pdf(i):
+        convertir_html_a_pdf(html)
+
+    datos = {
+        "deposito": DEPOSITO, "zona": entorno.tarifas.nombre_zona(entorno.id_zona), "localidad": LOCALIDAD,
+        "peso": 2.0, "distancia": 100.0, "costo_final": costo_final, "seguro_carga": 1200.0,
+        "incluir_iva": True, "desea_facturar": False, "cantidad": 30, "valor_mercaderia": 150000.0,
+    }
+
+    def supabase_guardado(i):
+        cotizacion_id = str(uuid.uuid4())
+        guardar_cotizacion(entorno.supabase, cotizacion_id, dict(datos, id=cotizacion_id), html)
+
+    pdf_bytes = b"%PDF-1.4 benchmark" + b"0" * 40_000
+
+    def supabase_subida(i):
+        subir_pdf(entorno.supabase, entorno.supabase_servidor.url_base, f"{uuid.uuid4()}.pdf", pdf_bytes)
+
+    # Punta a punta como en la app: distancia (fallo de caché -> ORS), costo,
+    # HTML + QR + registro y el pipeline completo (guardado, PDF y subida)
+    def cotizacion_completa(i):
+        destino = entorno.destino(i + 200_000)
+        distancia = entorno.contexto.distancia(*origen, *destino).km
+        cantidad = 21 + i % 80
+        costo_envio = calcular_costo(entorno.tarifas, entorno.id_zona, TIPO_CARGA, LOCALIDAD, True, cantidad, 150000)
+        trabajo, _ = entorno.contexto.generar_cotizacion(
+            entorno.deposito, entorno.id_zona, LOCALIDAD, TIPO_CARGA, distancia, costo_envio,
+            True, False, cantidad, 150000,
+        )
+        if not trabajo.esperar(timeout=120, intervalo=0.001) or not trabajo.exitoso:
+            raise RuntimeError(f"La cotización no terminó bien: {trabajo.estado()} {trabajo.errores()}")
+
+    # (nombre, función, fracción de las repeticiones: las etapas lentas corren menos veces)
+    todas = [
+        ("arranque_json", arranque_json, 1.0),
+        ("distancia_acierto", distancia_acierto, 1.0),
+        ("distancia_fallo", distancia_fallo, 1.0),
+        ("calcular_costo", costo, 1.0),
+        ("generar_qr", qr, 1.0),
+        ("generar_html_cotizacion", html_cotizacion, 1.0),
+        ("pdf", pdf, 0.2),
+        ("supabase_guardado", supabase_guardado, 1.0),
+        ("supabase_subida", supabase_subida, 1.0),
+        ("cotizacion_completa", cotizacion_completa, 0.2),
+    ]
+
+    try:
+        convertir_html_a_pdf(html)
+        pdf_disponible = None
+    except ErrorPDF as e:
+        pdf_disponible = str(e)
+
+    resultados = {}
+    try:
+        for nombre, etapa, fraccion in todas:
+            if etapas and nombre not in etapas:
+                continue
+            if pdf_disponible is not None and nombre in ("pdf", "cotizacion_completa"):
+                resultados[nombre] = {"omitida": f"wkhtmltopdf no disponible: {pdf_disponible}"}
+                continue
+            resultados[nombre] = medir_etapa(etapa, max(3, int(repeticiones * fraccion)))
+            print(f"  {nombre:<26} mediana {resultados[nombre]['mediana_ms']:>9.3f} ms  "
+                  f"p95 {resultados[nombre]['p95_ms']:>9.3f} ms", file=sys.stderr)
+    finally:
+        entorno.cerrar()
+        shutil.rmtree(directorio, ignore_errors=True)
+    return resultados
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Función para comparar dos corridas; devuelve [(etapa, base_ms, actual_ms, cambio, umbral, regresion)]
+def comparar(base, actual, umbral=UMBRAL_RELATIVO, umbrales_etapa=None, margen_ms=MARGEN_MS):
+    filas = []
+    for etapa, resultado in actual["etapas"].items():
+        anterior = base["etapas"].get(etapa)
+        if not anterior or "mediana_ms" not in anterior or "mediana_ms" not in resultado:
+            continue
+        umbral_etapa = (umbrales_etapa or {}).get(etapa, umbral)
+        base_ms, actual_ms = anterior["mediana_ms"], resultado["mediana_ms"]
+        cambio = (actual_ms - base_ms) / base_ms if base_ms else 0.0
+        regresion = cambio > umbral_etapa and actual_ms - base_ms > margen_ms
+        filas.append((etapa, base_ms, actual_ms, cambio, umbral_etapa, regresion))
+    return filas
+
+
+def _umbral_etapa(texto):
+    try:
+        etapa, valor = texto.split("=", 1)
+        return etapa.strip(), float(valor)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"Se espera etapa=umbral, por ejemplo pdf=0.5: {texto}") from e
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks del camino de una cotización")
+    parser.add_argument("-o", "--salida", help="Archivo JSON con los resultados (por defecto solo se imprime)")
+    parser.add_argument("-n", "--repeticiones", type=int, default=50)
+    parser.add_argument("--etapa", action="append", dest="etapas", help="Medir solo esta etapa (repetible)")
+    parser.add_argument("--base", help="Resultados de referencia (JSON de otra corrida) contra los que comparar")
+    parser.add_argument("--umbral", type=float, default=UMBRAL_RELATIVO,
+                        help="Empeoramiento relativo máximo de la mediana (0.25 = 25%%)")
+    parser.add_argument("--umbral-etapa", type=_umbral_etapa, action="append", default=[],
+                        help="Umbral propio de una etapa, p. ej. pdf=0.5 (repetible)")
+    parser.add_argument("--margen-ms", type=float, default=MARGEN_MS,
+                        help="Diferencia absoluta mínima para considerar una regresión")
+    args = parser.parse_args()
+
+    resultado = {
+        "version": VERSION_FORMATO,
+        "commit": _commit_actual(),
+        "creado": time.time(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "repeticiones": args.repeticiones,
+        "etapas": correr_benchmarks(args.repeticiones, etapas=args.etapas),
+    }
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+
+    if not args.base:
+        return
+    with open(args.base, "r") as f:
+        base = json.load(f)
+    filas = comparar(base, resultado, args.umbral, dict(args.umbral_etapa), args.margen_ms)
+    print(f"\nComparación contra {args.base} (commit {base.get('commit') or '?'}):", file=sys.stderr)
+    for etapa, base_ms, actual_ms, cambio, umbral_etapa, regresion in filas:
+        marca = "REGRESIÓN" if regresion else "ok"
+        print(f"  {etapa:<26} {base_ms:>9.3f} -> {actual_ms:>9.3f} ms  {cambio:+7.1%} "
+              f"(umbral {umbral_etapa:.0%})  {marca}", file=sys.stderr)
+    regresiones = [fila[0] for fila in filas if fila[5]]
+    if regresiones:
+        print(f"Regresiones: {', '.join(regresiones)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import bisect
+import re
+import unicodedata
+from collections import Counter
+
+from cotizador.espacial import IndiceEspacial
+
+# Índice de búsqueda de localidades para catálogos grandes (miles de entradas).
+#
+# - Prefijos: cada comienzo de palabra del nombre normalizado (sin acentos, en
+#   minúsculas) se guarda en un array ordenado; un prefijo se resuelve con dos
+#   bisect (un trie aplanado: mismo orden, sin un dict por nodo). Primero van
+#   los nombres que empiezan con el texto y después los que lo tienen en otra
+#   palabra ("jujuy" -> "SAN SALVADOR DE JUJUY").
+# - Tolerancia a errores de tipeo (solo si ningún prefijo coincide): fracción
+#   de los trigramas del texto presentes en el nombre.
+# - Búsqueda inversa: localidad más cercana a unas coordenadas (k-d tree).
+
+LIMITE_RESULTADOS = 10
+SIMILITUD_MINIMA = 0.5
+
+# Trigramas presentes en más de esta fracción de las entradas no discriminan
+FRACCION_MAXIMA_TRIGRAMA = 0.2
+
+_NO_ALFANUMERICO = re.compile(r"[^0-9a-z]+")
+_COORDENADAS = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*[,; ]\s*(-?\d+(?:\.\d+)?)\s*$")
+
+
+# Función para normalizar texto de búsqueda: sin acentos, minúsculas, espacios simples
+def normalizar_busqueda(texto):
+    texto = "".join(c for c in unicodedata.normalize("NFKD", texto.casefold()) if not unicodedata.combining(c))
+    return _NO_ALFANUMERICO.sub(" ", texto).strip()
+
+
+def _trigramas(texto):
+    texto = f"  {texto} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+# Interpreta "lat, lon" escrito en el buscador; devuelve (lat, lon) o None
+def parsear_coordenadas(texto):
+    coincidencia = _COORDENADAS.match(texto or "")
+    if not coincidencia:
+        return None
+    lat, lon = float(coincidencia.group(1)), float(coincidencia.group(2))
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+class IndiceLocalidades:
+    def __init__(self, localidades):
+        # Orden alfabético: los rangos del índice de prefijos ya salen ordenados
+        self.localidades = sorted(localidades, key=lambda item: normalizar_busqueda(item['Localidad']))
+        self.nombres = [normalizar_busqueda(item['Localidad']) for item in self.localidades]
+
+        self._inicios = sorted((nombre, i) for i, nombre in enumerate(self.nombres))
+        self._claves_inicios = [clave for clave, _ in self._inicios]
+        palabras = []
+        for i, nombre in enumerate(self.nombres):
+            for coincidencia in re.finditer(r" (?=\S)", nombre):
+                palabras.append((nombre[coincidencia.end():], i))
+        self._palabras = sorted(palabras)
+        self._claves_palabras = [clave for clave, _ in self._palabras]
+
+        self._por_trigrama = {}
+        for i, nombre in enumerate(self.nombres):
+            for trigrama in _trigramas(nombre):
+                self._por_trigrama.setdefault(trigrama, []).append(i)
+        self._max_por_trigrama = max(10, int(len(self.nombres) * FRACCION_MAXIMA_TRIGRAMA))
+
+        self._espacial = IndiceEspacial(
+            [item['Latitud'] for item in self.localidades], [item['Longitud'] for item in self.localidades]
+        )
+
+    def __len__(self):
+        return len(self.localidades)
+
+    @staticmethod
+    def _rango(claves, prefijo):
+        return bisect.bisect_left(claves, prefijo), bisect.bisect_left(claves, prefijo + "\uffff")
+
+    def _por_prefijo(self, consulta, limite):
+        encontrados = []
+        vistos = set()
+        for entradas, claves in ((self._inicios, self._claves_inicios), (self._palabras, self._claves_palabras)):
+            inicio, fin = self._rango(claves, consulta)
+            for posicion in range(inicio, fin):
+                i = entradas[posicion][1]
+                if i not in vistos:
+                    vistos.add(i)
+                    encontrados.append(i)
+                    if len(encontrados) >= limite:
+                        return encontrados
+        return encontrados
+
+    def _aproximadas(self, consulta, limite):
+        trigramas = _trigramas(consulta)
+        votos = Counter()
+        for trigrama in trigramas:
+            postings = self._por_trigrama.get(trigrama, ())
+            if len(postings) <= self._max_por_trigrama:
+                votos.update(postings)
+
+        minimo = SIMILITUD_MINIMA * len(trigramas)
+        candidatos = [(-cantidad, len(self.nombres[i]), i) for i, cantidad in votos.items() if cantidad >= minimo]
+        return [i for _, _, i in sorted(candidatos)[:limite]]
+
+    # Devuelve hasta `limite` localidades (dicts de Zonas_Localidades) para el texto.
+    # Sin texto devuelve las primeras en orden alfabético.
+    def buscar(self, texto, limite=LIMITE_RESULTADOS):
+        consulta = normalizar_busqueda(texto or "")
+        if not consulta:
+            return self.localidades[:limite]
+
+        indices = self._por_prefijo(consulta, limite) or self._aproximadas(consulta, limite)
+        return [self.localidades[i] for i in indices]
+
+    # Localidad más cercana a unas coordenadas: (dict, distancia_km) o None
+    def mas_cercana(self, lat, lon, radio_km=None):
+        vecinos = self._espacial.vecinos(lat, lon, k=1, radio_km=radio_km)
+        if not vecinos:
+            return None
+        indice, km = vecinos[0]
+        return self.localidades[indice], km
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+# Caché de cotizaciones direccionada por contenido.
+# La clave es un hash canónico de los datos del formulario más la versión del
+# snapshot de tarifas: si el mismo envío se vuelve a cotizar dentro de la
+# validez de 24 hs se reutilizan el id, el HTML y la URL del PDF en lugar de
+# generar un uuid nuevo, volver a renderizar y guardar filas duplicadas.
+# Memoria acotada (LRU) respaldada por SQLite para sobrevivir a reinicios.
+
+RUTA_DB = os.environ.get("COTIZADOR_CACHE_COTIZACIONES", "cotizaciones_cache.db")
+
+# Una cotización es válida por 24 hs
+VALIDEZ_SEGUNDOS = 24 * 3600
+
+# El HTML incluye el QR en base64 (decenas de KB): pocas entradas en memoria
+MAX_ENTRADAS_MEMORIA = 256
+
+
+class CotizacionMemorizada(NamedTuple):
+    cotizacion_id: str
+    datos_cotizacion: dict
+    html_cotizacion: str
+    url_publica: Optional[str]
+    creado: float
+
+
+# Función para armar la clave canónica de una cotización
+def clave_cotizacion(deposito, id_zona, localidad, peso, distancia, cantidad,
+                     incluir_iva, desea_facturar, valor_mercaderia, version_tarifas):
+    entrada = {
+        "deposito": str(deposito).strip().upper(),
+        "id_zona": str(id_zona).strip(),
+        "localidad": str(localidad).strip().upper(),
+        "peso": str(peso).strip().upper(),
+        "distancia": round(float(distancia), 2),
+        "cantidad": int(cantidad),
+        "incluir_iva": bool(incluir_iva),
+        "desea_facturar": bool(desea_facturar),
+        "valor_mercaderia": round(float(valor_mercaderia or 0), 2),
+        "tarifas": version_tarifas,
+    }
+    canonico = json.dumps(entrada, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonico.encode("utf-8")).hexdigest()
+
+
+class CacheCotizaciones:
+    def __init__(self, ruta_db=RUTA_DB, validez_segundos=VALIDEZ_SEGUNDOS, max_entradas=MAX_ENTRADAS_MEMORIA):
+        self.ruta_db = ruta_db
+        self.validez_segundos = validez_segundos
+        self.max_entradas = max_entradas
+
+        self._lock = threading.Lock()
+        self._memoria = OrderedDict()  # clave -> CotizacionMemorizada
+        self._aciertos_memoria = 0
+        self._aciertos_disco = 0
+        self._fallos = 0
+        self._escrituras = 0
+
+        self._conexion = sqlite3.connect(ruta_db, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute("PRAGMA synchronous=NORMAL")
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS cotizaciones ("
+            " clave TEXT PRIMARY KEY,"
+            " cotizacion_id TEXT NOT NULL,"
+            " datos TEXT NOT NULL,"
+            " html TEXT NOT NULL,"
+            " url_publica TEXT,"
+            " creado REAL NOT NULL)"
+        )
+        self._conexion.execute(
+            "CREATE INDEX IF NOT EXISTS cotizaciones_por_id ON cotizaciones (cotizacion_id)"
+        )
+
+    def _vencida(self, creado):
+        return time.time() - creado > self.validez_segundos
+
+    def _recordar(self, clave, cotizacion):
+        self._memoria[clave] = cotizacion
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_entradas:
+            self._memoria.popitem(last=False)
+
+    # Devuelve la CotizacionMemorizada vigente para la clave, o None
+    def obtener(self, clave):
+        with self._lock:
+            cotizacion = self._memoria.get(clave)
+            if cotizacion is not None and not self._vencida(cotizacion.creado):
+                self._memoria.move_to_end(clave)
+                self._aciertos_memoria += 1
+                return cotizacion
+            if cotizacion is not None:
+                del self._memoria[clave]
+
+            # Pudo generarla otro worker, o antes de un reinicio
+            fila = self._conexion.execute(
+                "SELECT cotizacion_id, datos, html, url_publica, creado FROM cotizaciones WHERE clave = ?", (clave,)
+            ).fetchone()
+            if fila is not None and not self._vencida(fila[4]):
+                cotizacion = CotizacionMemorizada(fila[0], json.loads(fila[1]), fila[2], fila[3], fila[4])
+                self._recordar(clave, cotizacion)
+                self._aciertos_disco += 1
+                return cotizacion
+
+            self._fallos += 1
+            return None
+
+    def guardar(self, clave, cotizacion_id, datos_cotizacion, html_cotizacion, url_publica=None):
+        cotizacion = CotizacionMemorizada(cotizacion_id, datos_cotizacion, html_cotizacion, url_publica, time.time())
+        with self._lock:
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO cotizaciones (clave, cotizacion_id, datos, html, url_publica, creado)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (clave, cotizacion_id, json.dumps(datos_cotizacion), html_cotizacion, url_publica, cotizacion.creado),
+            )
+            self._recordar(clave, cotizacion)
+            self._escrituras += 1
+        return cotizacion
+
+    # Registra la URL del PDF una vez subido (la subida corre en segundo plano)
+    def registrar_url(self, cotizacion_id, url_publica):
+        with self._lock:
+            self._conexion.execute(
+                "UPDATE cotizaciones SET url_publica = ? WHERE cotizacion_id = ?", (url_publica, cotizacion_id)
+            )
+            for clave, cotizacion in self._memoria.items():
+                if cotizacion.cotizacion_id == cotizacion_id:
+                    self._memoria[clave] = cotizacion._replace(url_publica=url_publica)
+
+    # Elimina del disco las cotizaciones fuera de la ventana de validez
+    def purgar_vencidas(self):
+        limite = time.time() - self.validez_segundos
+        with self._lock:
+            cursor = self._conexion.execute("DELETE FROM cotizaciones WHERE creado < ?", (limite,))
+            for clave in [c for c, cotizacion in self._memoria.items() if cotizacion.creado < limite]:
+                del self._memoria[clave]
+            return cursor.rowcount
+
+    def estadisticas(self):
+        with self._lock:
+            aciertos = self._aciertos_memoria + self._aciertos_disco
+            consultas = aciertos + self._fallos
+            return {
+                "aciertos_memoria": self._aciertos_memoria,
+                "aciertos_disco": self._aciertos_disco,
+                "fallos": self._fallos,
+                "escrituras": self._escrituras,
+                "entradas_memoria": len(self._memoria),
+                "ratio_aciertos": aciertos / consultas if consultas else 0.0,
+            }
+
+    def cerrar(self):
+        with self._lock:
+            self._conexion.close()
+
+
+_cache_global = None
+_lock_global = threading.Lock()
+
+
+# Función para obtener la instancia única de la caché para todo el proceso
+def obtener_cache_cotizaciones():
+    global _cache_global
+    if _cache_global is None:
+        with _lock_global:
+            if _cache_global is None:
+                max_entradas = os.environ.get("COTIZADOR_CACHE_COTIZACIONES_MAX")
+                _cache_global = CacheCotizaciones(
+                    max_entradas=int(max_entradas) if max_entradas else MAX_ENTRADAS_MEMORIA
+                )
+                _cache_global.purgar_vencidas()
+    return _cache_global
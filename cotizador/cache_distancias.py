@@ -0,0 +1,232 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Caché de distancias compartida por todo el proceso.
+# Las consultas se resuelven en memoria y las escrituras se persisten en SQLite
+# (modo WAL), de modo que varios workers de Streamlit pueden compartir el mismo
+# archivo sin corromperlo ni perder entradas de otras sesiones.
+
+RUTA_DB = os.environ.get("COTIZADOR_CACHE_DISTANCIAS", "distancias_cache.db")
+RUTA_JSON_LEGADO = "distancias_cache.json"
+
+# 5 decimales equivalen a ~1 m: suficiente para absorber el ruido de formateo
+# de los floats sin confundir dos puntos distintos.
+DECIMALES_CLAVE = 5
+
+
+# Función para cuantizar coordenadas y armar la clave de la caché
+def clave_distancia(origen_lat, origen_lon, destino_lat, destino_lon, decimales=DECIMALES_CLAVE):
+    return ",".join(
+        f"{round(float(valor), decimales):.{decimales}f}"
+        for valor in (origen_lat, origen_lon, destino_lat, destino_lon)
+    )
+
+
+class CacheDistancias:
+    def __init__(self, ruta_db=RUTA_DB, ruta_json_legado=RUTA_JSON_LEGADO,
+                 ttl_segundos=None, max_entradas=None, decimales=DECIMALES_CLAVE):
+        self.ruta_db = ruta_db
+        self.ttl_segundos = ttl_segundos
+        self.max_entradas = max_entradas
+        self.decimales = decimales
+
+        self._lock = threading.Lock()
+        self._memoria = OrderedDict()  # clave -> (distancia_km, creado)
+        self._aciertos_memoria = 0
+        self._aciertos_disco = 0
+        self._fallos = 0
+        self._escrituras = 0
+
+        self._conexion = sqlite3.connect(ruta_db, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute("PRAGMA synchronous=NORMAL")
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS distancias ("
+            " clave TEXT PRIMARY KEY,"
+            " distancia_km REAL NOT NULL,"
+            " creado REAL NOT NULL)"
+        )
+        self._conexion.execute("CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT NOT NULL)")
+
+        if ruta_json_legado:
+            self._importar_json_legado(ruta_json_legado)
+        self._cargar_memoria()
+
+    # Importa el antiguo distancias_cache.json una sola vez, cuando la base es nueva.
+    # Queda marcado en 'meta' para que las entradas que el TTL purgó no vuelvan en
+    # cada arranque; una base con distancias de antes de la marca cuenta como importada.
+    def _importar_json_legado(self, ruta_json):
+        with self._lock:
+            importado = self._conexion.execute(
+                "SELECT 1 FROM meta WHERE clave = 'json_legado_importado'"
+            ).fetchone() or self._conexion.execute("SELECT 1 FROM distancias LIMIT 1").fetchone()
+        if importado:
+            self._marcar_json_legado_importado()
+            return
+
+        try:
+            with open(ruta_json, 'r') as f:
+                legado = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._marcar_json_legado_importado()
+            return
+
+        filas = []
+        ahora = time.time()
+        for clave, distancia_km in legado.items():
+            try:
+                coordenadas = [float(valor) for valor in clave.split(",")]
+            except ValueError:
+                continue
+            if len(coordenadas) != 4 or distancia_km is None:
+                continue
+            filas.append((clave_distancia(*coordenadas, decimales=self.decimales), float(distancia_km), ahora))
+
+        with self._lock:
+            self._conexion.execute("BEGIN IMMEDIATE")
+            try:
+                # Otro worker pudo importarlo mientras se leía el archivo
+                if self._conexion.execute("SELECT 1 FROM meta WHERE clave = 'json_legado_importado'").fetchone():
+                    self._conexion.execute("COMMIT")
+                    return
+                # INSERT OR IGNORE: nunca pisar valores más nuevos escritos por otro worker
+                self._conexion.executemany(
+                    "INSERT OR IGNORE INTO distancias (clave, distancia_km, creado) VALUES (?, ?, ?)", filas
+                )
+                self._conexion.execute(
+                    "INSERT OR REPLACE INTO meta (clave, valor) VALUES ('json_legado_importado', ?)", (str(ahora),)
+                )
+                self._conexion.execute("COMMIT")
+            except Exception:
+                self._conexion.execute("ROLLBACK")
+                raise
+
+    def _marcar_json_legado_importado(self):
+        with self._lock:
+            self._conexion.execute(
+                "INSERT OR IGNORE INTO meta (clave, valor) VALUES ('json_legado_importado', ?)", (str(time.time()),)
+            )
+
+    def _cargar_memoria(self):
+        with self._lock:
+            filas = self._conexion.execute(
+                "SELECT clave, distancia_km, creado FROM distancias ORDER BY creado"
+            ).fetchall()
+            for clave, distancia_km, creado in filas:
+                if not self._vencida(creado):
+                    self._recordar(clave, distancia_km, creado)
+
+    def _vencida(self, creado):
+        return self.ttl_segundos is not None and time.time() - creado > self.ttl_segundos
+
+    def _recordar(self, clave, distancia_km, creado):
+        self._memoria[clave] = (distancia_km, creado)
+        self._memoria.move_to_end(clave)
+        if self.max_entradas is not None:
+            while len(self._memoria) > self.max_entradas:
+                self._memoria.popitem(last=False)
+
+    def clave(self, origen_lat, origen_lon, destino_lat, destino_lon):
+        return clave_distancia(origen_lat, origen_lon, destino_lat, destino_lon, decimales=self.decimales)
+
+    # Devuelve la distancia en km o None si no está en caché (o está vencida).
+    # contar=False no afecta los contadores (uso interno de herramientas batch).
+    def obtener(self, origen_lat, origen_lon, destino_lat, destino_lon, contar=True):
+        clave = self.clave(origen_lat, origen_lon, destino_lat, destino_lon)
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada is not None and not self._vencida(entrada[1]):
+                self._memoria.move_to_end(clave)
+                self._aciertos_memoria += contar
+                return entrada[0]
+            if entrada is not None:
+                del self._memoria[clave]
+
+            # Otro worker pudo haberla calculado después de nuestra carga inicial
+            fila = self._conexion.execute(
+                "SELECT distancia_km, creado FROM distancias WHERE clave = ?", (clave,)
+            ).fetchone()
+            if fila is not None and not self._vencida(fila[1]):
+                self._recordar(clave, fila[0], fila[1])
+                self._aciertos_disco += contar
+                return fila[0]
+
+            self._fallos += contar
+            return None
+
+    def guardar(self, origen_lat, origen_lon, destino_lat, destino_lon, distancia_km):
+        self.guardar_varios([((origen_lat, origen_lon, destino_lat, destino_lon), distancia_km)])
+
+    # Guarda varias distancias en una sola transacción: [((lat, lon, lat, lon), km), ...]
+    def guardar_varios(self, distancias):
+        ahora = time.time()
+        filas = [
+            (self.clave(*coordenadas), float(distancia_km), ahora)
+            for coordenadas, distancia_km in distancias
+        ]
+        if not filas:
+            return
+        with self._lock:
+            self._conexion.execute("BEGIN IMMEDIATE")
+            try:
+                self._conexion.executemany(
+                    "INSERT OR REPLACE INTO distancias (clave, distancia_km, creado) VALUES (?, ?, ?)", filas
+                )
+                self._conexion.execute("COMMIT")
+            except Exception:
+                self._conexion.execute("ROLLBACK")
+                raise
+            for clave, distancia_km, creado in filas:
+                self._recordar(clave, distancia_km, creado)
+            self._escrituras += len(filas)
+
+    # Elimina del disco las entradas vencidas según el TTL configurado
+    def purgar_vencidas(self):
+        if self.ttl_segundos is None:
+            return 0
+        limite = time.time() - self.ttl_segundos
+        with self._lock:
+            cursor = self._conexion.execute("DELETE FROM distancias WHERE creado < ?", (limite,))
+            for clave in [c for c, (_, creado) in self._memoria.items() if creado < limite]:
+                del self._memoria[clave]
+            return cursor.rowcount
+
+    def estadisticas(self):
+        with self._lock:
+            aciertos = self._aciertos_memoria + self._aciertos_disco
+            consultas = aciertos + self._fallos
+            return {
+                "aciertos_memoria": self._aciertos_memoria,
+                "aciertos_disco": self._aciertos_disco,
+                "fallos": self._fallos,
+                "escrituras": self._escrituras,
+                "entradas_memoria": len(self._memoria),
+                "ratio_aciertos": aciertos / consultas if consultas else 0.0,
+            }
+
+    def cerrar(self):
+        with self._lock:
+            self._conexion.close()
+
+
+_cache_global = None
+_lock_global = threading.Lock()
+
+
+# Función para obtener la instancia única de la caché para todo el proceso
+def obtener_cache_distancias():
+    global _cache_global
+    if _cache_global is None:
+        with _lock_global:
+            if _cache_global is None:
+                ttl = os.environ.get("COTIZADOR_CACHE_DISTANCIAS_TTL")
+                max_entradas = os.environ.get("COTIZADOR_CACHE_DISTANCIAS_MAX")
+                _cache_global = CacheDistancias(
+                    ttl_segundos=float(ttl) if ttl else None,
+                    max_entradas=int(max_entradas) if max_entradas else None,
+                )
+    return _cache_global
@@ -0,0 +1,326 @@
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cotizador import ors_simulado, supabase_simulado
+
+# Prueba de carga de la app de Streamlit: N sesiones simuladas recorren el
+# formulario real (depósito -> búsqueda de localidad -> localidad -> tipo de
+# carga -> cantidad -> Generar Cotización) con streamlit.testing (AppTest),
+# contra el ORS y el Supabase simulados. Reporta throughput, p50/p95/p99 por
+# paso y crecimiento de memoria por sesión.
+#
+#   python -m cotizador.carga --sesiones 50 --sesiones-por-proceso 8 -o carga.json
+#   python -m cotizador.carga --sesiones 200 --procesos 4 -o carga.json
+#
+# Las sesiones de un proceso comparten el contexto (st.cache_resource), igual
+# que en un contenedor. AppTest no admite reruns simultáneos en el mismo proceso
+# (reemplaza estado global de Streamlit en cada run), así que dentro de un
+# proceso los reruns se ejecutan de a uno: las sesiones "simultáneas" solo se
+# intercalan. Por eso la latencia de cada paso es la del rerun en sí, y la
+# espera por el turno se informa aparte (espera_turno). Los reruns corren en
+# paralelo solo con --procesos > 1: cada proceso tiene su propio Streamlit y
+# comparten el ORS y el Supabase simulados y las bases SQLite (cachés y
+# outbox), como varios workers. El guardado, el PDF y la subida corren en
+# paralelo en el pipeline, como en producción.
+
+RUTA_APP = "app.py"
+TIPO_CARGA = "DE 21 KG A 100 KG"
+
+PASOS = ("inicio", "deposito", "busqueda", "localidad", "carga", "cantidad", "generar", "pipeline")
+
+
+def _percentil(muestras, p):
+    ordenadas = sorted(muestras)
+    return ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * p))] if ordenadas else 0.0
+
+
+def _resumir(tiempos):
+    return {
+        "muestras": len(tiempos),
+        "p50_ms": round(_percentil(tiempos, 0.50) * 1000, 2),
+        "p95_ms": round(_percentil(tiempos, 0.95) * 1000, 2),
+        "p99_ms": round(_percentil(tiempos, 0.99) * 1000, 2),
+        "max_ms": round(max(tiempos, default=0.0) * 1000, 2),
+    }
+
+
+# Memoria residente actual del proceso en bytes (pico si /proc no está disponible)
+def memoria_residente():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maximo if sys.platform == "darwin" else maximo * 1024
+
+
+class PruebaCarga:
+    # servicios: (url del ORS, url del Supabase) ya iniciados; si no, los inicia iniciar_servicios()
+    def __init__(self, concurrencia, ruta_app=RUTA_APP, timeout=60, servicios=None):
+        self.concurrencia = concurrencia
+        # AppTest resuelve las rutas relativas contra el módulo que lo llama
+        self.ruta_app = os.path.abspath(ruta_app)
+        self.timeout = timeout
+        self.servicios = servicios
+
+        self._turno = threading.Lock()
+        self._lock = threading.Lock()
+        self.tiempos = {paso: [] for paso in PASOS}
+        self.esperas = []
+        self.errores = []
+        self.apps = []
+
+        with open("Depositos.json", "r") as f:
+            self.depositos = [dep["Nombre"] for dep in json.load(f)["Lista_de_Depositos"]]
+        # Pares (zona, localidad): hay localidades homónimas en distintas zonas
+        with open("Zonas_Localidades.json", "r") as f:
+            items = json.load(f)
+        self.localidades = sorted({(item["ID_Zona"], item["Localidad"]) for item in items})
+        self.nombres_zona = {item["ID_Zona"]: item["Nombre_Zona"] for item in items}
+
+    def iniciar_servicios(self):
+        self.ors = ors_simulado.iniciar_servidor_simulado()
+        self.supabase = supabase_simulado.iniciar_servidor_simulado()
+        self.servicios = (self.ors.url_base, self.supabase.url_base)
+
+    def detener_servicios(self):
+        self.ors.shutdown()
+        self.supabase.shutdown()
+
+    def _nueva_app(self):
+        from streamlit.testing.v1 import AppTest
+
+        url_ors, url_supabase = self.servicios
+        at = AppTest.from_file(self.ruta_app, default_timeout=self.timeout)
+        at.secrets["supabase"] = {"url": url_supabase, "access_key": "prueba-carga"}
+        at.secrets["openrouteservice"] = {"api_key": "prueba-carga", "url_base": url_ors}
+        return at
+
+    # Ejecuta un paso (interacción + rerun; accion() devuelve el AppTest) y
+    # registra la duración del rerun y, aparte, la espera por el turno
+    def _paso(self, nombre, accion):
+        llegada = time.perf_counter()
+        with self._turno:
+            inicio = time.perf_counter()
+            at = accion()
+            fin = time.perf_counter()
+        if at.exception:
+            raise RuntimeError(f"{nombre}: {at.exception[0].value}")
+        with self._lock:
+            self.tiempos[nombre].append(fin - inicio)
+            self.esperas.append(inicio - llegada)
+        return at
+
+    # Recorre el formulario completo para una sesión; devuelve True si la cotización terminó bien
+    def sesion(self, numero, deposito, destino):
+        id_zona, localidad = destino
+        etiqueta = f"{localidad} ({self.nombres_zona[id_zona]})"
+        try:
+            at = self._nueva_app()
+            at = self._paso("inicio", lambda: at.run())
+            at = self._paso("deposito", lambda: at.selectbox(key="deposito_seleccionado").select(deposito).run())
+            at = self._paso("busqueda", lambda: at.text_input(key="busqueda_localidad").set_value(localidad[:4]).run())
+            at = self._paso("localidad", lambda: at.selectbox(key="destino_seleccionado").select(etiqueta).run())
+            at = self._paso("carga", lambda: at.selectbox(key="peso_seleccionado").select(TIPO_CARGA).run())
+            # Cantidad distinta por sesión para que no se reutilice la cotización de otra
+            at = self._paso("cantidad", lambda: at.number_input(key="cantidad").set_value(21 + numero % 80).run())
+            at = self._paso("generar", lambda: next(b for b in at.button if "Generar" in b.label).click().run())
+
+            inicio = time.perf_counter()
+            trabajo = at.session_state["cotizacion_generada"]["trabajo"]
+            if not trabajo.esperar(timeout=self.timeout, intervalo=0.01) or not trabajo.exitoso:
+                raise RuntimeError(f"pipeline: {trabajo.estado()} {trabajo.errores()}")
+            with self._lock:
+                self.tiempos["pipeline"].append(time.perf_counter() - inicio)
+                # La sesión sigue viva hasta el final (como una pestaña abierta)
+                self.apps.append(at)
+            return True
+        except Exception as e:
+            with self._lock:
+                self.errores.append(f"sesión {numero} ({localidad}, zona {id_zona}): {e}")
+            return False
+
+    # Una sesión de calentamiento: importa la app y arma el contexto compartido,
+    # así la memoria base no cuenta la carga inicial
+    def calentar(self):
+        if not self.sesion(-1, self.depositos[0], self.localidades[0]):
+            raise RuntimeError(f"Falló la sesión de calentamiento: {self.errores[0]}")
+        self.tiempos = {paso: [] for paso in PASOS}
+        self.esperas = []
+        self.apps.clear()
+        gc.collect()
+
+    # Corre las sesiones planeadas [(numero, deposito, (zona, localidad)), ...] en este
+    # proceso; devuelve las muestras crudas (ver resumir)
+    def medir(self, planes, barrera=None):
+        memoria_base = memoria_residente()
+        if barrera is not None:
+            barrera.wait()
+        inicio = time.time()
+        with ThreadPoolExecutor(max_workers=self.concurrencia, thread_name_prefix="sesion") as executor:
+            exitosas = sum(executor.map(lambda plan: self.sesion(*plan), planes))
+        fin = time.time()
+        gc.collect()
+        return {
+            "sesiones": len(planes),
+            "exitosas": exitosas,
+            "errores": self.errores,
+            "tiempos": self.tiempos,
+            "esperas": self.esperas,
+            "inicio": inicio,
+            "fin": fin,
+            "memoria_base": memoria_base,
+            "memoria_final": memoria_residente(),
+        }
+
+
+# Función para planear las sesiones: depósito en rotación y destino al azar
+def planear(prueba, sesiones, semilla=0):
+    azar = random.Random(semilla)
+    return [
+        (numero, prueba.depositos[numero % len(prueba.depositos)], azar.choice(prueba.localidades))
+        for numero in range(sesiones)
+    ]
+
+
+# Proceso de --procesos: calienta, espera a los demás y corre su parte de las sesiones
+def _proceso_carga(ruta_app, timeout, concurrencia, servicios, planes, barrera, cola):
+    try:
+        prueba = PruebaCarga(concurrencia, ruta_app, timeout=timeout, servicios=servicios)
+        prueba.calentar()
+        cola.put(prueba.medir(planes, barrera))
+    except Exception as e:
+        barrera.abort()
+        cola.put({"sesiones": len(planes), "exitosas": 0, "errores": [f"proceso {os.getpid()}: {e}"],
+                  "tiempos": {}, "esperas": [], "inicio": None, "fin": None,
+                  "memoria_base": 0, "memoria_final": 0})
+
+
+# Función para correr la prueba; con procesos > 1, en procesos separados (spawn)
+def correr(sesiones, concurrencia, ruta_app=RUTA_APP, timeout=60, semilla=0, procesos=1):
+    prueba = PruebaCarga(concurrencia, ruta_app, timeout=timeout)
+    prueba.iniciar_servicios()
+    try:
+        planes = planear(prueba, sesiones, semilla)
+        if procesos <= 1:
+            prueba.calentar()
+            partes = [prueba.medir(planes)]
+        else:
+            contexto = multiprocessing.get_context("spawn")
+            barrera = contexto.Barrier(procesos)
+            cola = contexto.Queue()
+            hijos = [
+                contexto.Process(target=_proceso_carga, args=(
+                    ruta_app, timeout, concurrencia, prueba.servicios, planes[i::procesos], barrera, cola,
+                ))
+                for i in range(procesos)
+            ]
+            for hijo in hijos:
+                hijo.start()
+            partes = [cola.get() for _ in hijos]
+            for hijo in hijos:
+                hijo.join()
+    finally:
+        prueba.detener_servicios()
+    return resumir(partes, sesiones, concurrencia, procesos)
+
+
+# Función para combinar las muestras de uno o más procesos en el resultado de la prueba
+def resumir(partes, sesiones, concurrencia, procesos):
+    tiempos = {paso: [] for paso in PASOS}
+    esperas = []
+    errores = []
+    for parte in partes:
+        for paso, muestras in parte["tiempos"].items():
+            tiempos[paso].extend(muestras)
+        esperas.extend(parte["esperas"])
+        errores.extend(parte["errores"])
+    exitosas = sum(parte["exitosas"] for parte in partes)
+    medidas = [parte for parte in partes if parte["inicio"] is not None]
+    duracion = (max(p["fin"] for p in medidas) - min(p["inicio"] for p in medidas)) if medidas else 0.0
+    memoria_base = sum(parte["memoria_base"] for parte in partes)
+    memoria_final = sum(parte["memoria_final"] for parte in partes)
+
+    return {
+        "sesiones": sesiones,
+        "procesos": procesos,
+        "sesiones_por_proceso": concurrencia,
+        "exitosas": exitosas,
+        "errores": errores[:20],
+        "segundos": round(duracion, 3),
+        "cotizaciones_por_segundo": round(exitosas / duracion, 3) if duracion else 0.0,
+        # Reruns en paralelo como máximo: uno por proceso
+        "reruns_por_segundo": round(sum(len(t) for p, t in tiempos.items() if p != "pipeline") / duracion, 3)
+        if duracion else 0.0,
+        "pasos": {paso: _resumir(muestras) for paso, muestras in tiempos.items()},
+        "espera_turno": _resumir(esperas),
+        "memoria": {
+            "base_mb": round(memoria_base / 2**20, 1),
+            "final_mb": round(memoria_final / 2**20, 1),
+            "por_sesion_kb": round((memoria_final - memoria_base) / max(1, exitosas) / 1024, 1),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de la app con sesiones simuladas")
+    parser.add_argument("--sesiones", type=int, default=20, help="Cantidad total de sesiones")
+    parser.add_argument("--sesiones-por-proceso", type=int, default=8,
+                        help="Sesiones abiertas a la vez en cada proceso (sus reruns se turnan)")
+    parser.add_argument("--procesos", type=int, default=1, help="Procesos con reruns en paralelo")
+    parser.add_argument("--app", default=RUTA_APP)
+    parser.add_argument("--timeout", type=float, default=60, help="Segundos máximos por rerun y por cotización")
+    parser.add_argument("--semilla", type=int, default=0, help="Semilla para elegir las localidades")
+    parser.add_argument("-o", "--salida", help="Archivo JSON con el resultado")
+    args = parser.parse_args()
+
+    # Cachés y outbox en un directorio temporal: la prueba no toca los datos reales.
+    # Se configuran antes de que la app importe los módulos del cotizador.
+    directorio = tempfile.mkdtemp(prefix="cotizador-carga-")
+    os.environ["COTIZADOR_CACHE_DISTANCIAS"] = os.path.join(directorio, "distancias.db")
+    os.environ["COTIZADOR_CACHE_COTIZACIONES"] = os.path.join(directorio, "cotizaciones.db")
+    os.environ["COTIZADOR_OUTBOX"] = os.path.join(directorio, "outbox.db")
+
+    try:
+        resultado = correr(
+            args.sesiones, args.sesiones_por_proceso, args.app, timeout=args.timeout,
+            semilla=args.semilla, procesos=args.procesos,
+        )
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    print(f"{resultado['exitosas']}/{resultado['sesiones']} sesiones en {resultado['segundos']} s "
+          f"({resultado['procesos']} procesos x {resultado['sesiones_por_proceso']} sesiones) | "
+          f"{resultado['cotizaciones_por_segundo']} cotizaciones/s | "
+          f"{resultado['reruns_por_segundo']} reruns/s")
+    print(f"{'paso':<10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for paso, datos in resultado["pasos"].items():
+        print(f"{paso:<10} {datos['p50_ms']:>9.1f} {datos['p95_ms']:>9.1f} {datos['p99_ms']:>9.1f} {datos['max_ms']:>9.1f}")
+    espera = resultado["espera_turno"]
+    print(f"{'(turno)':<10} {espera['p50_ms']:>9.1f} {espera['p95_ms']:>9.1f} {espera['p99_ms']:>9.1f} "
+          f"{espera['max_ms']:>9.1f}  espera por el turno de rerun, aparte de los pasos")
+    memoria = resultado["memoria"]
+    print(f"memoria: {memoria['base_mb']} -> {memoria['final_mb']} MB ({memoria['por_sesion_kb']} KB por sesión)")
+    for error in resultado["errores"]:
+        print(f"  error: {error}")
+
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+    if resultado["exitosas"] < resultado["sesiones"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import os
+import tomllib
+
+# Lectura de secretos fuera de Streamlit (CLIs, servicios auxiliares).
+# Usa el mismo .streamlit/secrets.toml que la app.
+
+RUTA_SECRETOS = os.environ.get("COTIZADOR_SECRETOS", os.path.join(".streamlit", "secrets.toml"))
+
+URL_BASE_ORS = "https://api.openrouteservice.org"
+
+# Backends de distancia: OpenRouteService, grafo vial local o estimación haversine
+BACKENDS_RUTEO = ("ors", "local", "haversine")
+
+
+# Función para cargar los secretos desde el archivo TOML
+def cargar_secretos(ruta=RUTA_SECRETOS):
+    try:
+        with open(ruta, 'rb') as f:
+            return tomllib.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+# Función para obtener la configuración de OpenRouteService (clave y URL base)
+def configuracion_ors(secretos=None):
+    if secretos is None:
+        secretos = cargar_secretos()
+    ors = secretos.get("openrouteservice", {})
+    return {
+        "api_key": ors.get("api_key", ""),
+        "url_base": ors.get("url_base", URL_BASE_ORS).rstrip("/"),
+    }
+
+
+# Función para obtener la configuración de la verificación por QR ([verificacion] en
+# secrets.toml o COTIZADOR_CLAVE_VERIFICACION / COTIZADOR_URL_VERIFICACION).
+# Sin clave o sin URL, el QR de la cotización no lleva enlace de verificación.
+def configuracion_verificacion(secretos=None):
+    if secretos is None:
+        secretos = cargar_secretos()
+    verificacion = secretos.get("verificacion", {})
+    clave = os.environ.get("COTIZADOR_CLAVE_VERIFICACION") or verificacion.get("clave", "")
+    url_base = os.environ.get("COTIZADOR_URL_VERIFICACION") or verificacion.get("url_base", "")
+    if not clave or not url_base:
+        return None
+    return {"clave": clave, "url_base": url_base}
+
+
+# Función para obtener el backend de distancias ([ruteo] en secrets.toml o COTIZADOR_RUTEO)
+def configuracion_ruteo(secretos=None):
+    if secretos is None:
+        secretos = cargar_secretos()
+    ruteo = secretos.get("ruteo", {})
+    backend = os.environ.get("COTIZADOR_RUTEO") or ruteo.get("backend", "ors")
+    if backend not in BACKENDS_RUTEO:
+        raise ValueError(f"Backend de ruteo desconocido: {backend} (opciones: {', '.join(BACKENDS_RUTEO)})")
+    return {
+        "backend": backend,
+        "grafo": ruteo.get("grafo", os.environ.get("COTIZADOR_GRAFO_VIAL", "grafo_vial")),
+    }
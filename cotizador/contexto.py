@@ -0,0 +1,208 @@
+import json
+import logging
+import threading
+import uuid
+from collections import deque
+
+from supabase import create_client
+
+from cotizador.cache_cotizaciones import clave_cotizacion, obtener_cache_cotizaciones
+from cotizador.cache_distancias import obtener_cache_distancias
+from cotizador.configuracion import configuracion_ors, configuracion_ruteo, configuracion_verificacion
+from cotizador.documentos import armar_datos_cotizacion, armar_documento, renderizar_documento
+from cotizador.documentos_guardados import DocumentosGuardados
+from cotizador.metricas import iniciar_servidor_metricas, medir, perfilador_desde_entorno, registrar_contexto, registro
+from cotizador.outbox import OutboxCotizaciones
+from cotizador.ruteo import ClienteORS, ResultadoDistancia, RuteoHaversine
+from cotizador.seleccion_depositos import SelectorDepositos
+from cotizador.tarifas import obtener_gestor_tarifas
+from cotizador.trabajos import PipelineCotizacion
+from cotizador.verificacion import VerificadorCotizaciones, buscar_en_supabase, leer_token, url_verificacion
+
+# Contexto de la aplicación: todo lo que antes se recalculaba en cada rerun de
+# Streamlit (datos de referencia, listas de opciones, clientes de ORS y Supabase) se arma
+# una sola vez por proceso. Lo comparten la app y la API.
+
+logger = logging.getLogger(__name__)
+
+RUTA_DEPOSITOS = 'Depositos.json'
+
+# Locks por franja de clave: dos clics sobre la misma cotización no la generan dos veces
+FRANJAS_GENERACION = 64
+
+
+class ContextoApp:
+    def __init__(self, supabase=None, ruteo=None, pipeline=None, outbox=None,
+                 ruta_depositos=RUTA_DEPOSITOS, muestras_reruns=500,
+                 cache_distancias=None, cache_cotizaciones=None, verificacion=None):
+        with open(ruta_depositos, 'r') as f:
+            self.depositos = json.load(f)["Lista_de_Depositos"]
+        self.depositos_por_nombre = {dep["Nombre"]: dep for dep in self.depositos}
+        self.nombres_depositos = [dep["Nombre"] for dep in self.depositos]
+        self.selector_depositos = SelectorDepositos(self.depositos)
+
+        self.supabase = supabase
+        self.ruteo = ruteo
+        self.pipeline = pipeline
+        self.outbox = outbox
+        # HTML y PDF de cotizaciones guardadas, generados a pedido con caché
+        self.documentos = DocumentosGuardados(supabase) if supabase is not None else None
+        # Verificación por QR: {"clave", "url_base"} o None si no está configurada
+        self.verificacion = verificacion
+        self.verificador = VerificadorCotizaciones(self._buscar_para_verificar)
+        self.gestor_tarifas = obtener_gestor_tarifas()
+        # Por defecto, las cachés únicas del proceso
+        self.cache_distancias = cache_distancias or obtener_cache_distancias()
+        self.cache_cotizaciones = cache_cotizaciones or obtener_cache_cotizaciones()
+
+        self._lock = threading.Lock()
+        self._locks_generacion = [threading.Lock() for _ in range(FRANJAS_GENERACION)]
+        self._reruns = deque(maxlen=muestras_reruns)
+        # Perfilado de reruns lentos, solo si está activado por entorno (ver cotizador.metricas)
+        self.perfilador = perfilador_desde_entorno()
+
+    # Snapshot de tarifas vigente (con recarga en caliente)
+    @property
+    def tarifas(self):
+        return self.gestor_tarifas.actual()
+
+    # Cotización para la verificación: la del pipeline si está en memoria, si no la de Supabase
+    def _buscar_para_verificar(self, cotizacion_id):
+        trabajo = self.pipeline.obtener(cotizacion_id) if self.pipeline is not None else None
+        if trabajo is not None:
+            return {**trabajo.datos_cotizacion, "creado": trabajo.creado}
+        if self.supabase is None:
+            return None
+        return buscar_en_supabase(self.supabase, cotizacion_id)
+
+    # URL firmada para el QR de una cotización; None si la verificación no está configurada
+    def url_verificacion(self, cotizacion_id):
+        if self.verificacion is None:
+            return None
+        return url_verificacion(cotizacion_id, self.verificacion["url_base"], self.verificacion["clave"])
+
+    # Id de la cotización de un token de verificación; None si la firma no es válida
+    def leer_token_verificacion(self, token):
+        if self.verificacion is None:
+            return None
+        return leer_token(token, self.verificacion["clave"])
+
+    # Distancia depósito -> destino: primero la caché, después el backend de ruteo.
+    # Devuelve un ResultadoDistancia; puede lanzar ErrorRuteo.
+    @medir("distancia")
+    def distancia(self, origen_lat, origen_lon, destino_lat, destino_lon):
+        distancia_cacheada = self.cache_distancias.obtener(origen_lat, origen_lon, destino_lat, destino_lon)
+        if distancia_cacheada is not None:
+            return ResultadoDistancia(distancia_cacheada, False)
+
+        resultado = self.ruteo.distancia(origen_lat, origen_lon, destino_lat, destino_lon)
+        # Las estimaciones por línea recta no se guardan en caché
+        if not resultado.aproximada:
+            self.cache_distancias.guardar(origen_lat, origen_lon, destino_lat, destino_lon, resultado.km)
+        return resultado
+
+    # Depósitos ordenados del más cercano al más lejano por ruta para un destino
+    # (lista de OpcionDeposito); el precio no depende del depósito de origen
+    def rankear_depositos(self, destino_lat, destino_lon):
+        return self.selector_depositos.rankear(
+            destino_lat, destino_lon, self.distancia, cache_distancias=self.cache_distancias
+        )
+
+    # Genera la cotización (id, HTML, registro) y encola guardado, PDF y subida.
+    # Si el mismo envío ya se cotizó dentro de la validez, reutiliza la existente.
+    # Devuelve (TrabajoCotizacion, reutilizada); lanza ValueError si faltan tarifas.
+    def generar_cotizacion(self, deposito_info, id_zona, localidad, peso, distancia, costo_final,
+                           incluir_iva, desea_facturar, cantidad, valor_mercaderia):
+        tarifas = self.tarifas
+        clave = clave_cotizacion(
+            deposito_info["Nombre"], id_zona, localidad, peso, distancia, cantidad,
+            incluir_iva, desea_facturar, valor_mercaderia, tarifas.version,
+        )
+        with self._locks_generacion[int(clave[:8], 16) % FRANJAS_GENERACION]:
+            memorizada = self.cache_cotizaciones.obtener(clave)
+            if memorizada is not None:
+                trabajo = self.pipeline.obtener(memorizada.cotizacion_id)
+                if trabajo is None and memorizada.url_publica:
+                    trabajo = self.pipeline.restaurar(
+                        memorizada.cotizacion_id, memorizada.datos_cotizacion, memorizada.html_cotizacion,
+                        memorizada.url_publica, creado=memorizada.creado,
+                    )
+                elif trabajo is None:
+                    # Se reinició antes de subir el PDF: mismas filas y mismo archivo (upsert idempotente)
+                    trabajo = self.pipeline.enviar(
+                        memorizada.cotizacion_id, memorizada.datos_cotizacion, memorizada.html_cotizacion
+                    )
+                    trabajo.creado = memorizada.creado
+                return trabajo, True
+
+            tarifa = tarifas.tarifa(id_zona, peso)
+            if not tarifa:
+                raise ValueError("Error en configuración de tarifas")
+
+            cotizacion_id = str(uuid.uuid4())
+            documento = armar_documento(
+                deposito_info, id_zona, localidad, peso, distancia, costo_final,
+                incluir_iva, desea_facturar, cantidad, valor_mercaderia,
+                url_verificacion=self.url_verificacion(cotizacion_id),
+            )
+            html_cotizacion = renderizar_documento(cotizacion_id, documento)
+            datos_cotizacion = armar_datos_cotizacion(
+                cotizacion_id, deposito_info, tarifas.nombre_zona(id_zona), localidad, tarifa, distancia,
+                costo_final, incluir_iva, desea_facturar, cantidad, valor_mercaderia,
+            )
+            self.cache_cotizaciones.guardar(clave, cotizacion_id, datos_cotizacion, html_cotizacion)
+            return self.pipeline.enviar(cotizacion_id, datos_cotizacion, html_cotizacion, documento), False
+
+    # Registra el tiempo de pared de un rerun completo del script
+    def registrar_rerun(self, segundos):
+        with self._lock:
+            self._reruns.append(segundos)
+        registro.observar("rerun_segundos", segundos)
+        logger.debug("Rerun en %.1f ms", segundos * 1000)
+
+    def estadisticas_reruns(self):
+        with self._lock:
+            muestras = sorted(self._reruns)
+        if not muestras:
+            return {"reruns": 0}
+        return {
+            "reruns": len(muestras),
+            "p50_ms": muestras[len(muestras) // 2] * 1000,
+            "p95_ms": muestras[min(len(muestras) - 1, int(len(muestras) * 0.95))] * 1000,
+            "max_ms": muestras[-1] * 1000,
+        }
+
+
+# Función para crear el backend de distancias configurado (ors, local o haversine)
+def crear_ruteo(secretos):
+    config = configuracion_ruteo(secretos)
+    if config["backend"] == "haversine":
+        return RuteoHaversine()
+
+    config_ors = configuracion_ors(secretos)
+    cliente_ors = ClienteORS(config_ors["api_key"], url_base=config_ors["url_base"])
+    if config["backend"] == "ors":
+        return cliente_ors
+
+    # Importación diferida: solo el backend local necesita el grafo
+    from cotizador.grafo_vial import GrafoVial, RuteoLocal
+    # ORS (si hay clave) cubre los puntos que quedan fuera del grafo
+    return RuteoLocal(GrafoVial(config["grafo"]), respaldo=cliente_ors if config_ors["api_key"] else None)
+
+
+# Función para crear el contexto completo a partir de los secretos (st.secrets o secrets.toml)
+def crear_contexto(secretos):
+    url = secretos["supabase"]["url"]
+    cliente = create_client(url, secretos["supabase"]["access_key"])
+    # Las cotizaciones se guardan primero en el outbox local y se envían a Supabase en lotes
+    outbox = OutboxCotizaciones(cliente).iniciar()
+    pipeline = PipelineCotizacion(
+        cliente, url, guardar=outbox.encolar_cotizacion, al_subir=obtener_cache_cotizaciones().registrar_url
+    )
+    contexto = ContextoApp(
+        supabase=cliente, ruteo=crear_ruteo(secretos), pipeline=pipeline, outbox=outbox,
+        verificacion=configuracion_verificacion(secretos),
+    )
+    registrar_contexto(contexto)
+    iniciar_servidor_metricas()
+    return contexto
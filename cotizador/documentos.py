@@ -0,0 +1,190 @@
+import base64
+from datetime import datetime
+from io import BytesIO
+
+import qrcode
+
+from cotizador.metricas import medir
+from cotizador.precios import calcular_seguro
+
+# Generación de los documentos de la cotización (registro, QR y HTML), sin Streamlit.
+
+# Versión de la plantilla HTML. El documento de una cotización (armar_documento)
+# más esta versión alcanzan para volver a generar exactamente el mismo HTML, así
+# que un cambio visible en generar_html_cotizacion requiere una versión nueva en
+# PLANTILLAS (conservando la anterior para las cotizaciones ya emitidas).
+VERSION_PLANTILLA = 1
+
+FORMATO_FECHA = "%Y-%m-%d %H:%M"
+
+
+# Función para generar QR en base64
+@medir("qr")
+def generar_qr(data):
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=4,
+        border=2,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color="black", back_color="white")
+
+    buffered = BytesIO()
+    img.save(buffered, format="PNG")
+    return base64.b64encode(buffered.getvalue()).decode()
+
+
+# Función para generar el HTML de la cotización
+@medir("html")
+def generar_html_cotizacion(deposito_info, zona_seleccionada, localidad, peso, distancia, 
+                           costo_final, incluir_iva, desea_facturar, cotizacion_id, cantidad, valor_mercaderia=None,
+                           fecha=None, url_verificacion=None):
+    fecha = fecha or datetime.now().strftime(FORMATO_FECHA)
+    # Con verificación configurada, el QR lleva el enlace firmado (ver cotizador.verificacion)
+    qr_data = url_verificacion or (f"""
+    ID Cotización: {cotizacion_id}
+    Fecha: {fecha}
+    Monto: ${costo_final:,.2f}
+    Destino: {localidad} (Zona {zona_seleccionada})
+    Depósito: {deposito_info['Nombre']}
+    Cantidad: {cantidad}
+    Valor Declarado: ${valor_mercaderia:,.2f}""" if valor_mercaderia else "")
+
+    qr_base64 = generar_qr(qr_data)
+
+    html = f"""
+    <html>
+    <head>
+        <style>
+            body {{
+                font-family: Arial, sans-serif;
+                margin: 20px;
+            }}
+            .container {{
+                max-width: 800px;
+                margin: auto;
+                padding: 20px;
+                border: 1px solid #ccc;
+                border-radius: 10px;
+                background-color: #f9f9f9;
+            }}
+            .header {{
+                text-align: center;
+                margin-bottom: 20px;
+            }}
+            .header h1 {{
+                color: #333;
+            }}
+            .details {{
+                margin-bottom: 20px;
+            }}
+            .details p {{
+                margin: 5px 0;
+            }}
+            .qr-code {{
+                text-align: center;
+                margin-top: 20px;
+            }}
+            .qr-code img {{
+                width: 150px;
+                height: 150px;
+            }}
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <div class="header">
+                <h1>Cotizacion Automatizada</h1>
+                <h2>Transporte Rio Lavayen</h2>
+            </div>
+            <div class="details">
+                <p><strong>Fecha:</strong> {fecha}</p>
+                <p><strong>Deposito de Origen:</strong> {deposito_info['Nombre']}</p>
+                <p><strong>Destino:</strong> {localidad} (Zona {zona_seleccionada})</p>
+                <p><strong>Distancia Aproximada:</strong> {distancia} km</p>
+                <p><strong>Tipo de Carga:</strong> {peso}</p>
+                <p><strong>Cantidad:</strong> {cantidad}</p>
+                <p><strong>Valor Declarado:</strong> ${valor_mercaderia:,.2f}</p>
+                <p><strong>Incluir IVA:</strong> {"Si" if incluir_iva else "No"}</p>
+                <p><strong>Solicitar Seguro de Carga:</strong> {"Si" if desea_facturar else "No"}</p>
+                <p><strong>Cotizacion Estimada:</strong> ${costo_final:,.2f}</p>
+            </div>
+            <div class="qr-code">
+                <img src="data:image/png;base64,{qr_base64}" alt="QR Code">
+                <p><strong>ID Cotizacion:</strong> {cotizacion_id}</p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+    return html
+
+
+# Función para armar el documento de una cotización: los datos que muestra el
+# HTML (con la fecha de emisión y, si hay, el enlace de verificación del QR)
+def armar_documento(deposito_info, zona_seleccionada, localidad, peso, distancia, costo_final,
+                    incluir_iva, desea_facturar, cantidad, valor_mercaderia=None, fecha=None,
+                    url_verificacion=None):
+    documento = {
+        "fecha": fecha or datetime.now().strftime(FORMATO_FECHA),
+        "deposito": deposito_info['Nombre'],
+        "id_zona": str(zona_seleccionada),
+        "localidad": localidad,
+        "tipo_carga": peso,
+        "distancia": distancia,
+        "costo_final": costo_final,
+        "incluir_iva": bool(incluir_iva),
+        "desea_facturar": bool(desea_facturar),
+        "cantidad": cantidad,
+        "valor_mercaderia": valor_mercaderia,
+    }
+    if url_verificacion:
+        documento["url_verificacion"] = url_verificacion
+    return documento
+
+
+def _plantilla_v1(cotizacion_id, documento):
+    return generar_html_cotizacion(
+        {"Nombre": documento["deposito"]}, documento["id_zona"], documento["localidad"], documento["tipo_carga"],
+        documento["distancia"], documento["costo_final"], documento["incluir_iva"], documento["desea_facturar"],
+        cotizacion_id, documento["cantidad"], documento["valor_mercaderia"], fecha=documento["fecha"],
+        url_verificacion=documento.get("url_verificacion"),
+    )
+
+
+PLANTILLAS = {1: _plantilla_v1}
+
+
+# Función para generar el HTML de una cotización a partir de su documento
+# (mismo resultado byte a byte para el mismo documento y versión)
+def renderizar_documento(cotizacion_id, documento, version_plantilla=VERSION_PLANTILLA):
+    plantilla = PLANTILLAS.get(version_plantilla)
+    if plantilla is None:
+        raise ValueError(f"Versión de plantilla desconocida: {version_plantilla}")
+    return plantilla(cotizacion_id, documento)
+
+
+# Función para armar el registro de la cotización que se guarda en Supabase
+def armar_datos_cotizacion(cotizacion_id, deposito_info, nombre_zona, localidad, tarifa, distancia,
+                           costo_final, incluir_iva, desea_facturar, cantidad, valor_mercaderia):
+    try:
+        peso_value = float(tarifa['Codigo'])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError("Formato inválido en código de tarifa") from e
+
+    return {
+        "id": cotizacion_id,
+        "deposito": deposito_info['Nombre'],
+        "zona": nombre_zona,
+        "localidad": localidad,
+        "peso": peso_value,
+        "distancia": float(distancia),
+        "costo_final": float(costo_final),
+        "seguro_carga": float(calcular_seguro(valor_mercaderia)),
+        "incluir_iva": bool(incluir_iva),
+        "desea_facturar": bool(desea_facturar),
+        "cantidad": int(cantidad),
+        "valor_mercaderia": float(valor_mercaderia or 0)
+    }
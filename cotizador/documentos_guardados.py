@@ -0,0 +1,245 @@
+import argparse
+import json
+import re
+import threading
+from collections import OrderedDict
+
+from cotizador.almacenamiento import MODOS_ALMACENAMIENTO, fila_html, html_desde_fila, upsert_filas
+from cotizador.configuracion import cargar_secretos
+from cotizador.documentos import VERSION_PLANTILLA, renderizar_documento
+from cotizador.pdf import convertir_html_a_pdf
+
+# HTML y PDF de cotizaciones guardadas, generados a pedido.
+# Con COTIZADOR_ALMACENAMIENTO=compacto 'cotizaciones_html' guarda solo el
+# documento y la versión de plantilla; acá se vuelve a generar el HTML (igual
+# byte a byte) y el PDF, con una caché LRU en memoria para cada uno.
+#
+# También migra las filas existentes al modo comprimido o compacto:
+#
+#   python -m cotizador.documentos_guardados migrar --modo compacto --simular
+#   python -m cotizador.documentos_guardados ver <id> -o cotizacion.pdf
+#
+# Para pasar a compacto, el documento se extrae del HTML guardado y solo se
+# usa si al volver a renderizarlo da exactamente el mismo HTML; si no (otra
+# plantilla, QR con otro minuto), la fila queda comprimida.
+
+# Un HTML ocupa unos 3 KB y un PDF decenas de KB
+MAX_HTML_MEMORIA = 512
+MAX_PDF_MEMORIA = 64
+
+TAMANO_PAGINA = 200
+
+# Campos de la plantilla v1 (el HTML de generar_html_cotizacion)
+_PATRONES_V1 = {
+    "fecha": r"<p><strong>Fecha:</strong> (.*?)</p>",
+    "deposito": r"<p><strong>Deposito de Origen:</strong> (.*?)</p>",
+    "destino": r"<p><strong>Destino:</strong> (.*) \(Zona (.*?)\)</p>",
+    "distancia": r"<p><strong>Distancia Aproximada:</strong> (.*?) km</p>",
+    "tipo_carga": r"<p><strong>Tipo de Carga:</strong> (.*?)</p>",
+    "cantidad": r"<p><strong>Cantidad:</strong> (-?\d+)</p>",
+    "valor_mercaderia": r"<p><strong>Valor Declarado:</strong> \$(.*?)</p>",
+    "incluir_iva": r"<p><strong>Incluir IVA:</strong> (Si|No)</p>",
+    "desea_facturar": r"<p><strong>Solicitar Seguro de Carga:</strong> (Si|No)</p>",
+    "costo_final": r"<p><strong>Cotizacion Estimada:</strong> \$(.*?)</p>",
+}
+
+
+def _numero(texto):
+    texto = texto.replace(",", "")
+    return int(texto) if texto.lstrip("-").isdigit() else float(texto)
+
+
+# Función para recuperar el documento de una cotización desde su HTML (plantilla v1).
+# Devuelve None si el HTML no se puede reconstruir exactamente a partir del documento.
+def extraer_documento(cotizacion_id, html):
+    valores = {}
+    for campo, patron in _PATRONES_V1.items():
+        coincidencia = re.search(patron, html)
+        if coincidencia is None:
+            return None
+        valores[campo] = coincidencia.groups()
+
+    try:
+        documento = {
+            "fecha": valores["fecha"][0],
+            "deposito": valores["deposito"][0],
+            "id_zona": valores["destino"][1],
+            "localidad": valores["destino"][0],
+            "tipo_carga": valores["tipo_carga"][0],
+            "distancia": _numero(valores["distancia"][0]),
+            "costo_final": float(valores["costo_final"][0].replace(",", "")),
+            "incluir_iva": valores["incluir_iva"][0] == "Si",
+            "desea_facturar": valores["desea_facturar"][0] == "Si",
+            "cantidad": int(valores["cantidad"][0]),
+            "valor_mercaderia": float(valores["valor_mercaderia"][0].replace(",", "")),
+        }
+    except ValueError:
+        return None
+    if renderizar_documento(cotizacion_id, documento, VERSION_PLANTILLA) != html:
+        return None
+    return documento
+
+
+class DocumentosGuardados:
+    def __init__(self, supabase, max_html=MAX_HTML_MEMORIA, max_pdf=MAX_PDF_MEMORIA,
+                 renderizar_pdf=convertir_html_a_pdf):
+        self.supabase = supabase
+        self.max_html = max_html
+        self.max_pdf = max_pdf
+        self.renderizar_pdf = renderizar_pdf
+
+        self._lock = threading.Lock()
+        self._html = OrderedDict()  # cotizacion_id -> HTML
+        self._pdf = OrderedDict()   # cotizacion_id -> bytes
+        self._aciertos = 0
+        self._fallos = 0
+
+    def _leer(self, memoria, cotizacion_id):
+        with self._lock:
+            valor = memoria.get(cotizacion_id)
+            if valor is not None:
+                memoria.move_to_end(cotizacion_id)
+                self._aciertos += 1
+            else:
+                self._fallos += 1
+            return valor
+
+    def _recordar(self, memoria, maximo, cotizacion_id, valor):
+        with self._lock:
+            memoria[cotizacion_id] = valor
+            memoria.move_to_end(cotizacion_id)
+            while len(memoria) > maximo:
+                memoria.popitem(last=False)
+
+    # Fila de 'cotizaciones_html' (bloqueante); None si no existe
+    def fila(self, cotizacion_id):
+        response = self.supabase.table('cotizaciones_html').select('*').eq('id', cotizacion_id).limit(1).execute()
+        return response.data[0] if response.data else None
+
+    # HTML de la cotización en cualquier modo de almacenamiento; None si no existe
+    def html(self, cotizacion_id):
+        html = self._leer(self._html, cotizacion_id)
+        if html is None:
+            fila = self.fila(cotizacion_id)
+            html = html_desde_fila(fila) if fila is not None else None
+            if html is not None:
+                self._recordar(self._html, self.max_html, cotizacion_id, html)
+        return html
+
+    # PDF de la cotización (bytes); None si no existe. Puede lanzar ErrorPDF.
+    def pdf(self, cotizacion_id):
+        pdf_bytes = self._leer(self._pdf, cotizacion_id)
+        if pdf_bytes is None:
+            html = self.html(cotizacion_id)
+            if html is None:
+                return None
+            pdf_bytes = self.renderizar_pdf(html)
+            self._recordar(self._pdf, self.max_pdf, cotizacion_id, pdf_bytes)
+        return pdf_bytes
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "html_en_memoria": len(self._html),
+                "pdf_en_memoria": len(self._pdf),
+                "aciertos": self._aciertos,
+                "fallos": self._fallos,
+            }
+
+
+def _tamano(fila):
+    return len(json.dumps(fila, ensure_ascii=False).encode("utf-8"))
+
+
+# Función para pasar las filas de 'cotizaciones_html' al modo indicado.
+# Recorre la tabla por id en páginas; con simular=True solo informa.
+def migrar(supabase, modo, tamano_pagina=TAMANO_PAGINA, limite=None, simular=False):
+    if modo not in MODOS_ALMACENAMIENTO or modo == "completo":
+        raise ValueError(f"Solo se migra a comprimido o compacto, no a {modo}")
+    resumen = {"revisadas": 0, "migradas": 0, "compactas": 0, "comprimidas": 0, "sin_html": 0,
+               "bytes_antes": 0, "bytes_despues": 0}
+    ultimo_id = None
+    while limite is None or resumen["revisadas"] < limite:
+        consulta = supabase.table('cotizaciones_html').select('*').order('id')
+        if ultimo_id is not None:
+            consulta = consulta.gt('id', ultimo_id)
+        pagina = consulta.limit(tamano_pagina).execute().data or []
+        if not pagina:
+            break
+        ultimo_id = pagina[-1]["id"]
+        if limite is not None:
+            pagina = pagina[:limite - resumen["revisadas"]]
+
+        nuevas = []
+        for fila in pagina:
+            resumen["revisadas"] += 1
+            # Ya en el modo destino (o más compacta): no se toca
+            if fila.get("documento") or (modo == "comprimido" and fila.get("html_comprimido")):
+                continue
+            html = html_desde_fila(fila)
+            if html is None:
+                resumen["sin_html"] += 1
+                continue
+            documento = extraer_documento(fila["id"], html) if modo == "compacto" else None
+            # No se pudo compactar y ya estaba comprimida: queda como está
+            if documento is None and fila.get("html_comprimido"):
+                continue
+            nueva = fila_html(fila["id"], html, documento, modo=modo)
+            resumen["compactas" if nueva["documento"] else "comprimidas"] += 1
+            resumen["bytes_antes"] += _tamano({k: v for k, v in fila.items() if v is not None})
+            resumen["bytes_despues"] += _tamano({k: v for k, v in nueva.items() if v is not None})
+            nuevas.append(nueva)
+
+        if nuevas and not simular:
+            upsert_filas(supabase, 'cotizaciones_html', nuevas)
+        resumen["migradas"] += len(nuevas)
+    return resumen
+
+
+def _cliente_supabase():
+    from supabase import create_client
+
+    secretos = cargar_secretos()
+    return create_client(secretos["supabase"]["url"], secretos["supabase"]["access_key"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Documentos de cotizaciones guardadas y migración de almacenamiento")
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+
+    migracion = subcomandos.add_parser("migrar", help="Comprimir o compactar las filas de cotizaciones_html")
+    migracion.add_argument("--modo", choices=("comprimido", "compacto"), default="compacto")
+    migracion.add_argument("--pagina", type=int, default=TAMANO_PAGINA, help="Filas por consulta y por upsert")
+    migracion.add_argument("--limite", type=int, help="Máximo de filas a revisar")
+    migracion.add_argument("--simular", action="store_true", help="Solo informar, sin escribir")
+
+    ver = subcomandos.add_parser("ver", help="Generar el HTML o el PDF de una cotización guardada")
+    ver.add_argument("id")
+    ver.add_argument("-o", "--salida", required=True, help="Archivo .html o .pdf")
+    args = parser.parse_args()
+
+    supabase = _cliente_supabase()
+    if args.comando == "migrar":
+        resumen = migrar(supabase, args.modo, tamano_pagina=args.pagina, limite=args.limite, simular=args.simular)
+        ahorro = 1 - resumen["bytes_despues"] / resumen["bytes_antes"] if resumen["bytes_antes"] else 0.0
+        print(f"{resumen['revisadas']} filas revisadas, {resumen['migradas']} "
+              f"{'a migrar' if args.simular else 'migradas'} ({resumen['compactas']} compactas, "
+              f"{resumen['comprimidas']} comprimidas, {resumen['sin_html']} sin HTML) | "
+              f"{resumen['bytes_antes'] / 1024:.1f} KB -> {resumen['bytes_despues'] / 1024:.1f} KB ({ahorro:.0%} menos)")
+        return
+
+    documentos = DocumentosGuardados(supabase)
+    if args.salida.endswith(".pdf"):
+        contenido = documentos.pdf(args.id)
+    else:
+        html = documentos.html(args.id)
+        contenido = html.encode("utf-8") if html is not None else None
+    if contenido is None:
+        raise SystemExit(f"Cotización {args.id} no encontrada")
+    with open(args.salida, "wb") as f:
+        f.write(contenido)
+    print(f"{args.salida}: {len(contenido)} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import heapq
+import math
+
+import numpy as np
+
+from cotizador.geo import RADIO_TIERRA_KM
+
+# Índice espacial (k-d tree) para búsquedas de vecinos más cercanos sobre la
+# superficie terrestre. Los puntos se proyectan a vectores unitarios (x, y, z):
+# la distancia euclídea entre ellos (la cuerda) crece con la distancia de gran
+# círculo, así que el árbol puede podar con planos sin errores cerca de los
+# polos ni del antimeridiano. Las distancias devueltas son haversine en km.
+
+
+# Función para convertir lat/lon (grados) a vectores unitarios
+def a_cartesianas(lat, lon):
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def cuerda_a_km(cuerda):
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.minimum(np.asarray(cuerda) / 2, 1.0))
+
+
+def km_a_cuerda(km):
+    return 2 * math.sin(min(km / (2 * RADIO_TIERRA_KM), math.pi / 2))
+
+
+class IndiceEspacial:
+    def __init__(self, lat, lon, tamano_hoja=16):
+        self.puntos = a_cartesianas(lat, lon).reshape(-1, 3)
+        self.tamano_hoja = tamano_hoja
+        self.orden = np.arange(len(self.puntos))
+        # Nodos: (inicio, fin, eje, corte, hijo_izquierdo, hijo_derecho); eje -1 = hoja
+        self._nodos = []
+        if len(self.puntos):
+            self._construir(0, len(self.puntos))
+        self._puntos_ordenados = self.puntos[self.orden]
+
+    def __len__(self):
+        return len(self.puntos)
+
+    def _construir(self, inicio, fin):
+        indice_nodo = len(self._nodos)
+        self._nodos.append(None)
+        if fin - inicio <= self.tamano_hoja:
+            self._nodos[indice_nodo] = (inicio, fin, -1, 0.0, -1, -1)
+            return indice_nodo
+
+        segmento = self.orden[inicio:fin]
+        coordenadas = self.puntos[segmento]
+        eje = int(np.argmax(coordenadas.max(axis=0) - coordenadas.min(axis=0)))
+        medio = (fin - inicio) // 2
+        particion = np.argpartition(coordenadas[:, eje], medio)
+        self.orden[inicio:fin] = segmento[particion]
+        corte = float(self.puntos[self.orden[inicio + medio], eje])
+
+        izquierdo = self._construir(inicio, inicio + medio)
+        derecho = self._construir(inicio + medio, fin)
+        self._nodos[indice_nodo] = (inicio, fin, eje, corte, izquierdo, derecho)
+        return indice_nodo
+
+    # Devuelve [(indice, distancia_km), ...] de los k puntos más cercanos, ordenados.
+    # Con radio_km solo se consideran los puntos dentro de ese radio.
+    def vecinos(self, lat, lon, k=1, radio_km=None):
+        if not self._nodos or k <= 0:
+            return []
+        consulta = a_cartesianas(lat, lon)
+        limite = km_a_cuerda(radio_km) ** 2 if radio_km is not None else math.inf
+        mejores = []  # max-heap por distancia: (-cuerda², indice)
+
+        def peor():
+            return -mejores[0][0] if len(mejores) == k else limite
+
+        pendientes = [(0, 0.0)]  # (nodo, cota inferior de la cuerda²)
+        while pendientes:
+            nodo, cota = pendientes.pop()
+            if cota >= peor():
+                continue
+            inicio, fin, eje, corte, izquierdo, derecho = self._nodos[nodo]
+            if eje < 0:
+                diferencias = self._puntos_ordenados[inicio:fin] - consulta
+                cuerdas = np.einsum("ij,ij->i", diferencias, diferencias)
+                for posicion in np.flatnonzero(cuerdas < peor()).tolist():
+                    elemento = (-float(cuerdas[posicion]), int(self.orden[inicio + posicion]))
+                    if len(mejores) < k:
+                        heapq.heappush(mejores, elemento)
+                    elif -elemento[0] < peor():
+                        heapq.heapreplace(mejores, elemento)
+                continue
+
+            diferencia = float(consulta[eje]) - corte
+            cercano, lejano = (izquierdo, derecho) if diferencia < 0 else (derecho, izquierdo)
+            # El lado lejano solo puede tener candidatos si el plano de corte está más cerca que el peor
+            pendientes.append((lejano, max(cota, diferencia * diferencia)))
+            pendientes.append((cercano, cota))
+
+        resultado = sorted((-cuerda2, indice) for cuerda2, indice in mejores)
+        return [(indice, float(cuerda_a_km(math.sqrt(cuerda2)))) for cuerda2, indice in resultado]
+
+    def mas_cercano(self, lat, lon):
+        vecinos = self.vecinos(lat, lon, k=1)
+        return vecinos[0] if vecinos else None
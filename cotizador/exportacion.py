@@ -0,0 +1,303 @@
+import argparse
+import functools
+import io
+import json
+import os
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from cotizador.almacenamiento import filas_cotizacion, html_desde_fila, subir_pdf, upsert_filas
+from cotizador.cache_distancias import obtener_cache_distancias
+from cotizador.configuracion import cargar_secretos, configuracion_verificacion
+from cotizador.documentos import armar_datos_cotizacion, armar_documento, renderizar_documento
+from cotizador.lote import leer_envios, cotizar_lote
+from cotizador.pdf import convertir_html_a_pdf
+from cotizador.tarifas import compilar_snapshot
+from cotizador.verificacion import url_verificacion
+
+# Exportación masiva de cotizaciones (cierre de mes, licitaciones).
+#
+# Las cotizaciones se toman de Supabase por id (se vuelve a renderizar el HTML
+# guardado, en cualquier modo de almacenamiento) o se generan desde un archivo de envíos como el del cotizador por
+# lotes (HTML + QR nuevos). El HTML y el PDF se arman en un pool de procesos
+# (uno por núcleo) y los resultados se escriben a medida que llegan, en el
+# orden de entrada, en un ZIP o en un único PDF unido (requiere pypdf). En
+# memoria solo quedan los documentos en vuelo, no el lote completo. Con
+# --subir, cada PDF se sube al bucket `cotizaciones` apenas está listo y las
+# cotizaciones nuevas se registran en las tablas.
+#
+#   python -m cotizador.exportacion --ids-archivo ids.txt -o cierre_mes.zip
+#   python -m cotizador.exportacion --lote envios.csv -o licitacion.pdf --subir
+
+# Ids por consulta a Supabase
+TAMANO_CONSULTA = 100
+# Filas por upsert al registrar cotizaciones nuevas
+TAMANO_LOTE_FILAS = 100
+# Subidas simultáneas al Storage (y PDFs esperando subida como máximo)
+MAX_SUBIDAS = 8
+MAX_SUBIDAS_PENDIENTES = 32
+
+
+# Función para leer de Supabase la fila guardada de cada id, en bloques.
+# Produce tareas ("fila", id, fila de cotizaciones_html); los ids que no existen van con fila None.
+def tareas_desde_ids(supabase, ids):
+    for i in range(0, len(ids), TAMANO_CONSULTA):
+        bloque = ids[i:i + TAMANO_CONSULTA]
+        response = supabase.table('cotizaciones_html').select('*').in_('id', bloque).execute()
+        fila_por_id = {fila['id']: fila for fila in response.data or []}
+        for cotizacion_id in bloque:
+            yield ("fila", cotizacion_id, fila_por_id.get(cotizacion_id))
+
+
+# Función para cotizar un archivo de envíos y armar una tarea de documento por
+# cada fila sin error: ("generar", id, documento, registro).
+# url_verificacion(id), si se pasa, da el enlace firmado para el QR.
+def tareas_desde_lote(envios, tarifas, depositos, cache_distancias=None, url_verificacion=None):
+    resultado = cotizar_lote(envios, tarifas, depositos, cache_distancias=cache_distancias)
+    depositos_por_nombre = {dep["Nombre"]: dep for dep in depositos}
+    tareas = []
+    errores = []
+    for fila in range(len(resultado["costo_final"])):
+        deposito = depositos_por_nombre.get(resultado["deposito"][fila])
+        if resultado["error"][fila] or deposito is None:
+            errores.append((fila, resultado["error"][fila] or "depósito desconocido"))
+            continue
+        id_zona = resultado["id_zona"][fila]
+        tipo_carga = resultado["tipo_carga"][fila]
+        cantidad = int(resultado["cantidad"][fila])
+        incluir_iva = bool(resultado["incluir_iva"][fila])
+        valor_declarado = float(resultado["valor_declarado"][fila])
+        distancia = round(float(resultado["distancia_km"][fila]), 2)
+        costo_final = float(resultado["costo_final"][fila])
+        desea_facturar = valor_declarado > 0
+
+        cotizacion_id = str(uuid.uuid4())
+        documento = armar_documento(
+            deposito, id_zona, resultado["localidad"][fila], tipo_carga, distancia, costo_final,
+            incluir_iva, desea_facturar, cantidad, valor_declarado,
+            url_verificacion=url_verificacion(cotizacion_id) if url_verificacion else None,
+        )
+        datos = armar_datos_cotizacion(
+            cotizacion_id, deposito, tarifas.nombre_zona(id_zona), resultado["localidad"][fila],
+            tarifas.tarifa(id_zona, tipo_carga), distancia, costo_final, incluir_iva, desea_facturar,
+            cantidad, valor_declarado,
+        )
+        tareas.append(("generar", cotizacion_id, documento, datos))
+    return tareas, errores
+
+
+# Trabajo de cada proceso del pool: (id, html generado o None, pdf_bytes, error)
+def _renderizar(tarea):
+    tipo, cotizacion_id, contenido = tarea[:3]
+    try:
+        if tipo == "generar":
+            html = renderizar_documento(cotizacion_id, contenido)
+        else:
+            html = html_desde_fila(contenido) if contenido is not None else None
+        if html is None:
+            return cotizacion_id, None, None, "cotización no encontrada"
+        return cotizacion_id, html if tipo == "generar" else None, convertir_html_a_pdf(html), None
+    except Exception as e:
+        return cotizacion_id, None, None, str(e)
+
+
+# Función para renderizar las tareas en un pool de procesos; produce
+# (tarea, html, pdf_bytes, error) en el orden de entrada, con a lo sumo
+# `en_vuelo` documentos en memoria a la vez
+def renderizar_en_paralelo(tareas, procesos=None, en_vuelo=None):
+    procesos = procesos or os.cpu_count() or 1
+    en_vuelo = en_vuelo or procesos * 4
+    tareas = iter(tareas)
+    pendientes = {}   # future -> (posición, tarea)
+    listos = {}       # posición -> resultado
+    siguiente_envio = 0
+    siguiente_salida = 0
+
+    with ProcessPoolExecutor(max_workers=procesos) as executor:
+        agotadas = False
+        while True:
+            while not agotadas and len(pendientes) + len(listos) < en_vuelo:
+                tarea = next(tareas, None)
+                if tarea is None:
+                    agotadas = True
+                    break
+                # El registro (tarea[3]) no viaja al proceso: solo lo necesario para el documento
+                pendientes[executor.submit(_renderizar, tarea[:3])] = (siguiente_envio, tarea)
+                siguiente_envio += 1
+            if not pendientes and not listos:
+                return
+
+            if pendientes:
+                terminados, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+                for future in terminados:
+                    posicion, tarea = pendientes.pop(future)
+                    _, html, pdf_bytes, error = future.result()
+                    listos[posicion] = (tarea, html, pdf_bytes, error)
+
+            while siguiente_salida in listos:
+                yield listos.pop(siguiente_salida)
+                siguiente_salida += 1
+
+
+class SalidaZip:
+    def __init__(self, ruta):
+        self._zip = zipfile.ZipFile(ruta, "w", compression=zipfile.ZIP_DEFLATED)
+
+    def agregar(self, cotizacion_id, pdf_bytes):
+        self._zip.writestr(f"{cotizacion_id}.pdf", pdf_bytes)
+
+    def cerrar(self):
+        self._zip.close()
+
+
+class SalidaPdfUnido:
+    def __init__(self, ruta):
+        try:
+            from pypdf import PdfReader, PdfWriter
+        except ImportError as e:
+            raise SystemExit("Para unir los PDF instale pypdf: pip install pypdf (o exporte a .zip)") from e
+        self.ruta = ruta
+        self._lector = PdfReader
+        self._escritor = PdfWriter()
+
+    def agregar(self, cotizacion_id, pdf_bytes):
+        self._escritor.append(self._lector(io.BytesIO(pdf_bytes)), outline_item=cotizacion_id)
+
+    def cerrar(self):
+        with open(self.ruta, "wb") as f:
+            self._escritor.write(f)
+
+
+class SubidaMasiva:
+    def __init__(self, supabase, url_supabase, max_subidas=MAX_SUBIDAS, max_pendientes=MAX_SUBIDAS_PENDIENTES):
+        self.supabase = supabase
+        self.url_supabase = url_supabase
+        self._executor = ThreadPoolExecutor(max_workers=max_subidas, thread_name_prefix="subida")
+        # Si el Storage va más lento que el render, se frena el render en vez de acumular PDFs
+        self._cupos = threading.BoundedSemaphore(max_pendientes)
+        self._lock = threading.Lock()
+        self._filas = {"cotizaciones": [], "cotizaciones_html": []}
+        self.subidos = 0
+        self.errores = []
+
+    def _subir(self, cotizacion_id, pdf_bytes):
+        try:
+            subir_pdf(self.supabase, self.url_supabase, f"{cotizacion_id}.pdf", pdf_bytes)
+            with self._lock:
+                self.subidos += 1
+        except Exception as e:
+            with self._lock:
+                self.errores.append((cotizacion_id, str(e)))
+        finally:
+            self._cupos.release()
+
+    def subir(self, cotizacion_id, pdf_bytes):
+        self._cupos.acquire()
+        self._executor.submit(self._subir, cotizacion_id, pdf_bytes)
+
+    # Registra una cotización nueva en las tablas (en lotes de TAMANO_LOTE_FILAS)
+    def registrar(self, cotizacion_id, datos_cotizacion, html_cotizacion, documento=None):
+        for tabla, fila in filas_cotizacion(cotizacion_id, datos_cotizacion, html_cotizacion, documento).items():
+            self._filas[tabla].append(fila)
+        if len(self._filas["cotizaciones"]) >= TAMANO_LOTE_FILAS:
+            self._vaciar_filas()
+
+    def _vaciar_filas(self):
+        for tabla, filas in self._filas.items():
+            if filas:
+                try:
+                    upsert_filas(self.supabase, tabla, filas)
+                except Exception as e:
+                    self.errores.extend((fila["id"], f"{tabla}: {e}") for fila in filas)
+                filas.clear()
+
+    def cerrar(self):
+        self._vaciar_filas()
+        self._executor.shutdown(wait=True)
+
+
+# Función para exportar las tareas a `salida` (.zip o .pdf); devuelve un resumen
+def exportar(tareas, salida, procesos=None, subida=None):
+    destino = SalidaPdfUnido(salida) if salida.endswith(".pdf") else SalidaZip(salida)
+    exportados = 0
+    errores = []
+    try:
+        for tarea, html, pdf_bytes, error in renderizar_en_paralelo(tareas, procesos):
+            cotizacion_id = tarea[1]
+            if error is not None:
+                errores.append((cotizacion_id, error))
+                continue
+            destino.agregar(cotizacion_id, pdf_bytes)
+            exportados += 1
+            if subida is not None:
+                if tarea[0] == "generar":
+                    subida.registrar(cotizacion_id, tarea[3], html, tarea[2])
+                subida.subir(cotizacion_id, pdf_bytes)
+    finally:
+        destino.cerrar()
+        if subida is not None:
+            subida.cerrar()
+    return {
+        "exportados": exportados,
+        "errores": errores,
+        "subidos": subida.subidos if subida is not None else 0,
+        "errores_subida": subida.errores if subida is not None else [],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exportación masiva de cotizaciones a ZIP o PDF unido")
+    origen = parser.add_mutually_exclusive_group(required=True)
+    origen.add_argument("--ids", nargs="+", help="Ids de cotizaciones guardadas en Supabase")
+    origen.add_argument("--ids-archivo", help="Archivo con un id por línea")
+    origen.add_argument("--lote", help="Archivo de envíos (.csv o .parquet) para generar cotizaciones nuevas")
+    parser.add_argument("-o", "--salida", required=True, help="Archivo de salida: .zip o .pdf (unido, con pypdf)")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count() or 1, help="Procesos del pool de render")
+    parser.add_argument("--subir", action="store_true",
+                        help="Subir cada PDF al bucket 'cotizaciones' (y registrar las cotizaciones nuevas)")
+    parser.add_argument("--depositos", default="Depositos.json")
+    args = parser.parse_args()
+
+    supabase = url_supabase = None
+    if args.subir or not args.lote:
+        from supabase import create_client
+
+        secretos = cargar_secretos()
+        url_supabase = secretos["supabase"]["url"]
+        supabase = create_client(url_supabase, secretos["supabase"]["access_key"])
+
+    inicio = time.perf_counter()
+    errores_lote = []
+    if args.lote:
+        with open(args.depositos, 'r') as f:
+            depositos = json.load(f)["Lista_de_Depositos"]
+        verificacion = configuracion_verificacion()
+        firmar = functools.partial(
+            url_verificacion, url_base=verificacion["url_base"], clave=verificacion["clave"]
+        ) if verificacion else None
+        tareas, errores_lote = tareas_desde_lote(
+            leer_envios(args.lote), compilar_snapshot(), depositos, obtener_cache_distancias(), url_verificacion=firmar
+        )
+    else:
+        ids = args.ids
+        if args.ids_archivo:
+            with open(args.ids_archivo, 'r') as f:
+                ids = [linea.strip() for linea in f if linea.strip()]
+        tareas = tareas_desde_ids(supabase, list(dict.fromkeys(ids)))
+
+    subida = SubidaMasiva(supabase, url_supabase) if args.subir else None
+    resumen = exportar(tareas, args.salida, procesos=args.procesos, subida=subida)
+
+    print(f"{resumen['exportados']} cotizaciones -> {args.salida} en {time.perf_counter() - inicio:.1f} s "
+          f"({args.procesos} procesos)" + (f" | {resumen['subidos']} PDF subidos" if args.subir else ""))
+    for fila, error in errores_lote:
+        print(f"  fila {fila + 2}: {error}")
+    for cotizacion_id, error in resumen["errores"] + resumen["errores_subida"]:
+        print(f"  {cotizacion_id}: {error}")
+
+
+if __name__ == "__main__":
+    main()
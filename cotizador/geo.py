@@ -0,0 +1,13 @@
+import math
+
+RADIO_TIERRA_KM = 6371.0088
+
+
+# Función para calcular la distancia en línea recta (gran círculo) entre dos puntos
+def haversine_km(origen_lat, origen_lon, destino_lat, destino_lon):
+    lat1, lon1, lat2, lon2 = map(math.radians, (origen_lat, origen_lon, destino_lat, destino_lon))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * RADIO_TIERRA_KM * math.asin(math.sqrt(a))
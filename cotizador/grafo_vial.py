@@ -0,0 +1,435 @@
+import argparse
+import bz2
+import glob
+import gzip
+import heapq
+import json
+import logging
+import math
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import Counter, deque
+
+import numpy as np
+
+from cotizador.geo import RADIO_TIERRA_KM, haversine_km
+from cotizador.ruteo import ResultadoDistancia, estimar_distancia
+
+# Motor de distancias por ruta sin conexión, sobre un grafo vial de la zona de
+# servicio preprocesado desde un extracto de OpenStreetMap.
+#
+# El grafo se guarda como adyacencia CSR en archivos .npy (indptr, destinos,
+# pesos en km, lat, lon) que se abren con mmap: cargarlo no copia nada a memoria
+# y varios workers comparten las mismas páginas. Las consultas usan A* con
+# heurística haversine (admisible: ningún tramo es más corto que la línea
+# recta). Para los depósitos, el constructor puede guardar además el árbol de
+# distancias completo (Dijkstra desde el depósito), y entonces la consulta es
+# una sola lectura del array.
+#
+#   python -m cotizador.grafo_vial jujuy.osm.pbf -o grafo_vial --depositos Depositos.json
+
+logger = logging.getLogger(__name__)
+
+RUTA_GRAFO = os.environ.get("COTIZADOR_GRAFO_VIAL", "grafo_vial")
+
+# Tipos de vía transitables en auto (similar al perfil driving-car de ORS)
+VIAS_TRANSITABLES = {
+    "motorway", "motorway_link", "trunk", "trunk_link", "primary", "primary_link",
+    "secondary", "secondary_link", "tertiary", "tertiary_link", "unclassified",
+    "residential", "living_street", "service", "road",
+}
+ACCESO_PROHIBIDO = {"no", "private"}
+
+# Un punto a más de esta distancia del nodo más cercano no se considera ruteable
+MAX_DISTANCIA_NODO_KM = 5.0
+
+# Tamaño de celda del índice para ubicar el nodo más cercano (~5,5 km)
+GRADOS_CELDA = 0.05
+
+
+# --- Construcción del grafo -------------------------------------------------
+
+def _abrir_osm(ruta):
+    if ruta.endswith(".bz2"):
+        return bz2.open(ruta, "rb")
+    if ruta.endswith(".gz"):
+        return gzip.open(ruta, "rb")
+    return open(ruta, "rb")
+
+
+def _sentido(etiquetas):
+    oneway = etiquetas.get("oneway", "")
+    if oneway in ("yes", "1", "true") or etiquetas.get("junction") == "roundabout":
+        return 1
+    if oneway == "-1":
+        return -1
+    return 0
+
+
+def _es_transitable(etiquetas):
+    return (
+        etiquetas.get("highway") in VIAS_TRANSITABLES
+        and etiquetas.get("access") not in ACCESO_PROHIBIDO
+        and etiquetas.get("motor_vehicle") not in ACCESO_PROHIBIDO
+        and etiquetas.get("area") != "yes"
+    )
+
+
+# Lee un extracto OSM XML (.osm, .osm.bz2, .osm.gz) en dos pasadas en streaming:
+# primero las vías transitables y después solo las coordenadas de sus nodos
+def _leer_osm_xml(ruta):
+    vias = []
+    for elemento in _elementos_osm(ruta):
+        if elemento.tag == "way":
+            etiquetas = {tag.get("k"): tag.get("v") for tag in elemento.iter("tag")}
+            if _es_transitable(etiquetas):
+                nodos = [int(nd.get("ref")) for nd in elemento.iter("nd")]
+                if len(nodos) > 1:
+                    vias.append((nodos, _sentido(etiquetas)))
+
+    necesarios = {nodo for nodos, _ in vias for nodo in nodos}
+    coordenadas = {}
+    for elemento in _elementos_osm(ruta):
+        if elemento.tag == "node":
+            nodo = int(elemento.get("id"))
+            if nodo in necesarios:
+                coordenadas[nodo] = (float(elemento.get("lat")), float(elemento.get("lon")))
+    return vias, coordenadas
+
+
+# Recorre los elementos de primer nivel (node, way, relation) de un .osm en streaming.
+# Después de procesar cada uno se vacía la raíz: clear() sobre el elemento solo no
+# alcanza, la raíz seguiría guardando un hijo vacío por cada elemento del extracto.
+def _elementos_osm(ruta):
+    raiz = None
+    for evento, elemento in ET.iterparse(_abrir_osm(ruta), events=("start", "end")):
+        if raiz is None:
+            raiz = elemento
+        if evento == "end" and elemento.tag in ("node", "way", "relation"):
+            yield elemento
+            raiz.clear()
+
+
+# Lee un extracto .osm.pbf con pyosmium (dependencia opcional)
+def _leer_osm_pbf(ruta):
+    try:
+        import osmium
+    except ImportError as e:
+        raise SystemExit("Para leer .osm.pbf instale pyosmium: pip install osmium") from e
+
+    vias = []
+    coordenadas = {}
+
+    class Lector(osmium.SimpleHandler):
+        def way(self, via):
+            etiquetas = {tag.k: tag.v for tag in via.tags}
+            if not _es_transitable(etiquetas):
+                return
+            nodos = []
+            for nd in via.nodes:
+                if nd.location.valid():
+                    coordenadas[nd.ref] = (nd.location.lat, nd.location.lon)
+                    nodos.append(nd.ref)
+            if len(nodos) > 1:
+                vias.append((nodos, _sentido(etiquetas)))
+
+    Lector().apply_file(ruta, locations=True)
+    return vias, coordenadas
+
+
+# Función para armar las aristas simplificadas: solo se conservan los cruces y
+# extremos de vía; los nodos intermedios se suman en la longitud del tramo
+def armar_aristas(vias, coordenadas):
+    usos = Counter()
+    for nodos, _ in vias:
+        usos.update(nodos)
+        usos[nodos[0]] += 1
+        usos[nodos[-1]] += 1
+
+    indice = {}
+    origenes, destinos, pesos = [], [], []
+    for nodos, sentido in vias:
+        nodos = [nodo for nodo in nodos if nodo in coordenadas]
+        if len(nodos) < 2:
+            continue
+        inicio = nodos[0]
+        longitud = 0.0
+        for anterior, nodo in zip(nodos, nodos[1:]):
+            longitud += haversine_km(*coordenadas[anterior], *coordenadas[nodo])
+            if usos[nodo] > 1 or nodo == nodos[-1]:
+                a = indice.setdefault(inicio, len(indice))
+                b = indice.setdefault(nodo, len(indice))
+                if a != b:
+                    tramos = [(a, b)] if sentido > 0 else [(b, a)] if sentido < 0 else [(a, b), (b, a)]
+                    for desde, hasta in tramos:
+                        origenes.append(desde)
+                        destinos.append(hasta)
+                        pesos.append(longitud)
+                inicio = nodo
+                longitud = 0.0
+
+    lat = np.empty(len(indice))
+    lon = np.empty(len(indice))
+    for nodo, i in indice.items():
+        lat[i], lon[i] = coordenadas[nodo]
+    return lat, lon, np.asarray(origenes, dtype=np.int64), np.asarray(destinos, dtype=np.int64), np.asarray(pesos)
+
+
+# Nodos de la componente conexa (sin considerar sentidos) más grande
+def _componente_principal(cantidad_nodos, origenes, destinos):
+    vecinos = [[] for _ in range(cantidad_nodos)]
+    for a, b in zip(origenes.tolist(), destinos.tolist()):
+        vecinos[a].append(b)
+        vecinos[b].append(a)
+
+    componente = [-1] * cantidad_nodos
+    mejor, tamano_mejor = -1, 0
+    for inicio in range(cantidad_nodos):
+        if componente[inicio] >= 0:
+            continue
+        componente[inicio] = inicio
+        cola, tamano = deque([inicio]), 0
+        while cola:
+            nodo = cola.popleft()
+            tamano += 1
+            for vecino in vecinos[nodo]:
+                if componente[vecino] < 0:
+                    componente[vecino] = inicio
+                    cola.append(vecino)
+        if tamano > tamano_mejor:
+            mejor, tamano_mejor = inicio, tamano
+    return np.asarray(componente) == mejor
+
+
+# Función para guardar el grafo en formato CSR (un .npy por array)
+def guardar_grafo(directorio, lat, lon, origenes, destinos, pesos, metadatos=None):
+    conservar = _componente_principal(len(lat), origenes, destinos)
+    nuevo_indice = np.cumsum(conservar) - 1
+    aristas = conservar[origenes] & conservar[destinos]
+    origenes, destinos, pesos = nuevo_indice[origenes[aristas]], nuevo_indice[destinos[aristas]], pesos[aristas]
+    lat, lon = lat[conservar], lon[conservar]
+
+    # Ordena por origen y deja una sola arista (la más corta) por par de nodos
+    orden = np.lexsort((pesos, destinos, origenes))
+    origenes, destinos, pesos = origenes[orden], destinos[orden], pesos[orden]
+    primera = np.ones(len(origenes), dtype=bool)
+    primera[1:] = (origenes[1:] != origenes[:-1]) | (destinos[1:] != destinos[:-1])
+    origenes, destinos, pesos = origenes[primera], destinos[primera], pesos[primera]
+
+    indptr = np.zeros(len(lat) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(origenes, minlength=len(lat)), out=indptr[1:])
+
+    os.makedirs(directorio, exist_ok=True)
+    np.save(os.path.join(directorio, "indptr.npy"), indptr)
+    np.save(os.path.join(directorio, "destinos.npy"), destinos.astype(np.int32))
+    np.save(os.path.join(directorio, "pesos.npy"), pesos.astype(np.float32))
+    np.save(os.path.join(directorio, "lat.npy"), lat)
+    np.save(os.path.join(directorio, "lon.npy"), lon)
+    for viejo in glob.glob(os.path.join(directorio, "arbol_*.npy")):
+        os.remove(viejo)
+    with open(os.path.join(directorio, "grafo.json"), "w") as f:
+        json.dump(dict(metadatos or {}, nodos=len(lat), aristas=len(destinos), creado=time.time()), f, indent=2)
+    return len(lat), len(destinos)
+
+
+# --- Consultas ---------------------------------------------------------------
+
+class GrafoVial:
+    def __init__(self, directorio=RUTA_GRAFO):
+        self.directorio = directorio
+
+        def cargar(nombre):
+            return np.load(os.path.join(directorio, f"{nombre}.npy"), mmap_mode="r")
+
+        self.indptr = cargar("indptr")
+        self.destinos = cargar("destinos")
+        self.pesos = cargar("pesos")
+        self.lat = cargar("lat")
+        self.lon = cargar("lon")
+        self.cantidad_nodos = len(self.lat)
+
+        # Índice de celdas para ubicar el nodo más cercano sin recorrer todo el grafo
+        celdas = self._celda(np.asarray(self.lat), np.asarray(self.lon))
+        self._orden_celdas = np.argsort(celdas, kind="stable")
+        claves, inicios, cantidades = np.unique(celdas[self._orden_celdas], return_index=True, return_counts=True)
+        self._celdas = dict(zip(claves.tolist(), zip(inicios.tolist(), (inicios + cantidades).tolist())))
+
+        # Árboles de distancias precalculados: nodo de origen -> distancias a todos los nodos
+        self._arboles = {}
+        for ruta in glob.glob(os.path.join(directorio, "arbol_*.npy")):
+            nodo = int(os.path.basename(ruta)[len("arbol_"):-len(".npy")])
+            self._arboles[nodo] = np.load(ruta, mmap_mode="r")
+
+    @staticmethod
+    def _celda(lat, lon):
+        return np.floor(lat / GRADOS_CELDA).astype(np.int64) * 100_000 + np.floor(lon / GRADOS_CELDA).astype(np.int64)
+
+    # Devuelve (nodo, distancia_km) del nodo más cercano al punto
+    def nodo_mas_cercano(self, lat, lon):
+        fila, columna = math.floor(lat / GRADOS_CELDA), math.floor(lon / GRADOS_CELDA)
+        candidatos = [
+            self._orden_celdas[inicio:fin]
+            for inicio, fin in (
+                self._celdas.get((fila + df) * 100_000 + columna + dc, (0, 0))
+                for df in (-1, 0, 1) for dc in (-1, 0, 1)
+            )
+        ]
+        candidatos = np.concatenate(candidatos)
+        if not len(candidatos):
+            candidatos = np.arange(self.cantidad_nodos)
+
+        lat_c = np.radians(self.lat[candidatos])
+        lon_c = np.radians(self.lon[candidatos])
+        lat0, lon0 = math.radians(lat), math.radians(lon)
+        a = np.sin((lat_c - lat0) / 2) ** 2 + math.cos(lat0) * np.cos(lat_c) * np.sin((lon_c - lon0) / 2) ** 2
+        distancias = 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(a))
+        mejor = int(np.argmin(distancias))
+        return int(candidatos[mejor]), float(distancias[mejor])
+
+    # Distancia más corta (km) entre dos nodos, o None si no hay camino
+    def distancia_nodos(self, origen, destino):
+        arbol = self._arboles.get(origen)
+        if arbol is not None:
+            km = float(arbol[destino])
+            return None if math.isinf(km) else km
+        return self._a_estrella(origen, destino)
+
+    def _a_estrella(self, origen, destino):
+        if origen == destino:
+            return 0.0
+        indptr, destinos, pesos, lat, lon = self.indptr, self.destinos, self.pesos, self.lat, self.lon
+        lat_d, lon_d = float(lat[destino]), float(lon[destino])
+
+        def heuristica(nodo):
+            return haversine_km(float(lat[nodo]), float(lon[nodo]), lat_d, lon_d)
+
+        distancia = {origen: 0.0}
+        cerrados = set()
+        pendientes = [(heuristica(origen), 0.0, origen)]
+        while pendientes:
+            _, g, nodo = heapq.heappop(pendientes)
+            if nodo == destino:
+                return g
+            if nodo in cerrados:
+                continue
+            cerrados.add(nodo)
+            inicio, fin = int(indptr[nodo]), int(indptr[nodo + 1])
+            for vecino, peso in zip(destinos[inicio:fin].tolist(), pesos[inicio:fin].tolist()):
+                nueva = g + peso
+                if nueva < distancia.get(vecino, math.inf):
+                    distancia[vecino] = nueva
+                    heapq.heappush(pendientes, (nueva + heuristica(vecino), nueva, vecino))
+        return None
+
+    # Dijkstra desde un nodo hacia todo el grafo (array de km; inf si no hay camino)
+    def arbol_distancias(self, origen):
+        indptr, destinos, pesos = self.indptr, self.destinos, self.pesos
+        distancia = np.full(self.cantidad_nodos, np.inf)
+        distancia[origen] = 0.0
+        cerrados = np.zeros(self.cantidad_nodos, dtype=bool)
+        pendientes = [(0.0, origen)]
+        while pendientes:
+            g, nodo = heapq.heappop(pendientes)
+            if cerrados[nodo]:
+                continue
+            cerrados[nodo] = True
+            inicio, fin = int(indptr[nodo]), int(indptr[nodo + 1])
+            for vecino, peso in zip(destinos[inicio:fin].tolist(), pesos[inicio:fin].tolist()):
+                nueva = g + peso
+                if nueva < distancia[vecino]:
+                    distancia[vecino] = nueva
+                    heapq.heappush(pendientes, (nueva, vecino))
+        return distancia
+
+    # Precalcula y guarda el árbol de distancias de un nodo de origen (p. ej. un depósito)
+    def guardar_arbol(self, origen):
+        arbol = self.arbol_distancias(origen).astype(np.float32)
+        ruta = os.path.join(self.directorio, f"arbol_{origen}.npy")
+        np.save(ruta, arbol)
+        self._arboles[origen] = np.load(ruta, mmap_mode="r")
+
+
+class RuteoLocal:
+    # Backend de distancias sobre el grafo local. Si un punto queda fuera del
+    # grafo o no hay camino, consulta el respaldo (p. ej. ClienteORS) o estima.
+    def __init__(self, grafo, respaldo=None, max_distancia_nodo=MAX_DISTANCIA_NODO_KM):
+        self.grafo = grafo
+        self.respaldo = respaldo
+        self.max_distancia_nodo = max_distancia_nodo
+
+        self._lock = threading.Lock()
+        self._contadores = {"consultas": 0, "fuera_de_grafo": 0, "segundos": 0.0}
+
+    def _contar(self, nombre, valor=1):
+        with self._lock:
+            self._contadores[nombre] += valor
+
+    def distancia(self, origen_lat, origen_lon, destino_lat, destino_lon):
+        inicio = time.perf_counter()
+        self._contar("consultas")
+        origen, km_origen = self.grafo.nodo_mas_cercano(origen_lat, origen_lon)
+        destino, km_destino = self.grafo.nodo_mas_cercano(destino_lat, destino_lon)
+        km = None
+        if max(km_origen, km_destino) <= self.max_distancia_nodo:
+            km = self.grafo.distancia_nodos(origen, destino)
+        self._contar("segundos", time.perf_counter() - inicio)
+
+        if km is None:
+            self._contar("fuera_de_grafo")
+            if self.respaldo is not None:
+                return self.respaldo.distancia(origen_lat, origen_lon, destino_lat, destino_lon)
+            return ResultadoDistancia(estimar_distancia(origen_lat, origen_lon, destino_lat, destino_lon), True)
+
+        # Se suma el tramo en línea recta hasta la red (entrada y salida del depósito/localidad)
+        return ResultadoDistancia(round(km + km_origen + km_destino, 2), False)
+
+    def estadisticas(self):
+        with self._lock:
+            contadores = dict(self._contadores)
+        contadores["ms_promedio"] = 1000 * contadores.pop("segundos") / max(contadores["consultas"], 1)
+        contadores["nodos"] = self.grafo.cantidad_nodos
+        contadores["arboles"] = len(self.grafo._arboles)
+        if self.respaldo is not None:
+            contadores["respaldo"] = self.respaldo.estadisticas()
+        return contadores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construye el grafo vial local desde un extracto de OpenStreetMap")
+    parser.add_argument("extracto", help="Extracto OSM (.osm, .osm.bz2, .osm.gz o .osm.pbf)")
+    parser.add_argument("-o", "--salida", default=RUTA_GRAFO, help="Directorio del grafo")
+    parser.add_argument("--depositos", help="Depositos.json: precalcula el árbol de distancias de cada depósito")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    inicio = time.perf_counter()
+    if args.extracto.endswith(".pbf"):
+        vias, coordenadas = _leer_osm_pbf(args.extracto)
+    else:
+        vias, coordenadas = _leer_osm_xml(args.extracto)
+    leido = time.perf_counter()
+
+    nodos, aristas = guardar_grafo(
+        args.salida, *armar_aristas(vias, coordenadas), metadatos={"fuente": os.path.basename(args.extracto)}
+    )
+    print(f"{len(vias)} vías -> {nodos} nodos, {aristas} aristas en {args.salida} "
+          f"(lectura {leido - inicio:.1f} s, armado {time.perf_counter() - leido:.1f} s)")
+
+    if args.depositos:
+        grafo = GrafoVial(args.salida)
+        with open(args.depositos, 'r') as f:
+            depositos = json.load(f)["Lista_de_Depositos"]
+        for deposito in depositos:
+            nodo, km = grafo.nodo_mas_cercano(deposito["Latitud"], deposito["Longitud"])
+            if km > MAX_DISTANCIA_NODO_KM:
+                print(f"  {deposito['Nombre']}: fuera del grafo ({km:.1f} km del nodo más cercano)")
+                continue
+            t = time.perf_counter()
+            grafo.guardar_arbol(nodo)
+            print(f"  {deposito['Nombre']}: árbol de distancias en {time.perf_counter() - t:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
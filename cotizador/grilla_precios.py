@@ -0,0 +1,371 @@
+import argparse
+import csv
+import json
+import os
+import time
+
+import numpy as np
+
+from cotizador.cache_distancias import obtener_cache_distancias
+from cotizador.precios import BULTO_MINIMO, FACTOR_IVA, calcular_seguro
+from cotizador.ruteo import estimar_distancia
+from cotizador.tarifas import compilar_snapshot, normalizar_localidad
+
+# Grilla materializada de precios: depósito × localidad × tipo de carga.
+#
+# Se guarda en columnas, un .npy por columna (precio unitario sin IVA, con IVA,
+# distancia depósito-localidad y si es aproximada), más grilla.json con los ejes
+# y las huellas de lo que se usó para calcularla. Los .npy se abren con mmap:
+# una consulta es una lectura de memoria y varios procesos comparten las páginas.
+#
+# La actualización es incremental: se compara contra las huellas guardadas y se
+# recalculan solo las celdas afectadas (una fila de tarifa cambia las celdas de
+# su zona y tipo de carga en todos los depósitos; un cambio en Parametros.json
+# cambia los precios pero no las distancias; un depósito o una localidad nuevos
+# o movidos, solo sus filas). Si los ejes no cambian, se escribe sobre los
+# mismos archivos solo en las celdas recalculadas.
+#
+#   python -m cotizador.grilla_precios actualizar
+#   python -m cotizador.grilla_precios exportar precios.csv   (.csv, .json o .parquet)
+
+RUTA_GRILLA = os.environ.get("COTIZADOR_GRILLA_PRECIOS", "grilla_precios")
+ARCHIVO_MANIFIESTO = "grilla.json"
+
+# Columnas: nombre -> (dtype, ejes)
+COLUMNAS = {
+    "precio": (np.float64, "dlt"),
+    "precio_iva": (np.float64, "dlt"),
+    "distancia_km": (np.float64, "dl"),
+    "distancia_aproximada": (np.bool_, "dl"),
+}
+
+COLUMNAS_EXPORTACION = [
+    "deposito", "localidad", "id_zona", "nombre_zona", "tipo_carga",
+    "precio", "precio_iva", "distancia_km", "distancia_aproximada",
+]
+
+
+def _ruta(directorio, nombre):
+    return os.path.join(directorio, f"{nombre}.npy")
+
+
+# Clave de una localidad en el eje de la grilla: la zona va en la clave porque
+# hay localidades homónimas en distintas zonas (METAN está en la 1 y en la 3)
+def _clave_localidad(id_zona, nombre):
+    return f"{id_zona}|{normalizar_localidad(nombre)}"
+
+
+# Función para leer el manifiesto de una grilla existente (None si no hay)
+def leer_manifiesto(directorio=RUTA_GRILLA):
+    try:
+        with open(os.path.join(directorio, ARCHIVO_MANIFIESTO), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Función para armar ejes y huellas a partir del snapshot y los depósitos
+def _describir(tarifas, depositos):
+    depositos_por_nombre = {}
+    for dep in depositos:
+        depositos_por_nombre.setdefault(dep["Nombre"], dep)
+    # Localidades por (zona, nombre) desde la lista de Zonas_Localidades.json
+    localidades = {}
+    for item in tarifas.zonas_localidades:
+        localidades.setdefault((normalizar_localidad(item['Localidad']), str(item['ID_Zona'])), item)
+    filas_localidad = [localidades[clave] for clave in sorted(localidades)]
+    tipos = sorted({item['Descripcion'] for item in tarifas.tarifas_base})
+
+    return {
+        "depositos": list(depositos_por_nombre),
+        "localidades": [item['Localidad'] for item in filas_localidad],
+        "tipos_carga": tipos,
+        "huellas": {
+            "parametros": tarifas.parametros,
+            "tarifas": {f"{zona}|{descripcion}": item['Tarifa_Base']
+                        for (zona, descripcion), item in tarifas.tarifas.items()},
+            "zonas": [str(item['ID_Zona']) for item in filas_localidad],
+            "coordenadas_localidades": [[item['Latitud'], item['Longitud']] for item in filas_localidad],
+            "coordenadas_depositos": [[dep["Latitud"], dep["Longitud"]] for dep in depositos_por_nombre.values()],
+        },
+    }
+
+
+def _posiciones(anteriores, nuevos):
+    # Índice en el eje anterior de cada elemento del eje nuevo (-1 si es nuevo)
+    indice = {valor: i for i, valor in enumerate(anteriores)}
+    return np.asarray([indice.get(valor, -1) for valor in nuevos], dtype=np.int64)
+
+
+# Función para crear o actualizar la grilla; devuelve un resumen de lo recalculado
+def actualizar_grilla(tarifas, depositos, directorio=RUTA_GRILLA, cache_distancias=None, forzar=False):
+    inicio = time.perf_counter()
+    descripcion = _describir(tarifas, depositos)
+    huellas = descripcion["huellas"]
+    claves_localidad = [
+        _clave_localidad(zona, nombre) for zona, nombre in zip(huellas["zonas"], descripcion["localidades"])
+    ]
+    ejes = (descripcion["depositos"], claves_localidad, descripcion["tipos_carga"])
+    forma = {"d": len(ejes[0]), "l": len(ejes[1]), "t": len(ejes[2])}
+
+    anterior = None if forzar else leer_manifiesto(directorio)
+    if anterior is not None and not all(os.path.exists(_ruta(directorio, nombre)) for nombre in COLUMNAS):
+        anterior = None
+
+    if anterior is None:
+        pos_d = np.full(forma["d"], -1)
+        pos_l = np.full(forma["l"], -1)
+        pos_t = np.full(forma["t"], -1)
+    else:
+        pos_d = _posiciones(anterior["depositos"], ejes[0])
+        pos_l = _posiciones([
+            _clave_localidad(zona, nombre)
+            for zona, nombre in zip(anterior["huellas"]["zonas"], anterior["localidades"])
+        ], ejes[1])
+        pos_t = _posiciones(anterior["tipos_carga"], ejes[2])
+    en_lugar = anterior is not None and (
+        pos_d.tolist() == list(range(len(anterior["depositos"])))
+        and pos_l.tolist() == list(range(len(anterior["localidades"])))
+        and pos_t.tolist() == list(range(len(anterior["tipos_carga"])))
+    )
+
+    # Columnas: sobre los mismos archivos (mmap r+) si los ejes no cambiaron;
+    # si no, arrays nuevos con las celdas que se conservan copiadas de la grilla anterior
+    columnas = {}
+    for nombre, (dtype, dims) in COLUMNAS.items():
+        if en_lugar:
+            columnas[nombre] = np.load(_ruta(directorio, nombre), mmap_mode="r+")
+            continue
+        columna = np.full(tuple(forma[d] for d in dims), np.nan if dtype is np.float64 else False, dtype=dtype)
+        if anterior is not None:
+            vieja = np.load(_ruta(directorio, nombre), mmap_mode="r")
+            posiciones = {"d": pos_d, "l": pos_l, "t": pos_t}
+            destino = tuple(np.flatnonzero(posiciones[d] >= 0) for d in dims)
+            origen = tuple(posiciones[d][indices] for d, indices in zip(dims, destino))
+            columna[np.ix_(*destino)] = vieja[np.ix_(*origen)]
+        columnas[nombre] = columna
+
+    # Celdas de precio afectadas (localidad × tipo, para todos los depósitos) y depósitos nuevos
+    deposito_nuevo = pos_d < 0
+    huellas_previas = anterior["huellas"] if anterior is not None else None
+    if huellas_previas is None or huellas_previas["parametros"] != huellas["parametros"]:
+        precio_sucio = np.ones((forma["l"], forma["t"]), dtype=bool)
+    else:
+        zonas_previas = huellas_previas["zonas"]
+        tarifas_previas = huellas_previas["tarifas"]
+        precio_sucio = np.zeros((forma["l"], forma["t"]), dtype=bool)
+        precio_sucio[pos_l < 0, :] = True
+        precio_sucio[:, pos_t < 0] = True
+        for i, zona in enumerate(huellas["zonas"]):
+            if pos_l[i] >= 0 and zonas_previas[pos_l[i]] != zona:
+                precio_sucio[i, :] = True
+        tipo_por_nombre = {tipo: j for j, tipo in enumerate(ejes[2])}
+        zonas = np.asarray(huellas["zonas"])
+        for clave in set(tarifas_previas) | set(huellas["tarifas"]):
+            if tarifas_previas.get(clave) != huellas["tarifas"].get(clave):
+                zona, tipo = clave.split("|", 1)
+                if tipo in tipo_por_nombre:
+                    precio_sucio[zonas == zona, tipo_por_nombre[tipo]] = True
+
+    sucio = deposito_nuevo[:, None, None] | precio_sucio[None, :, :]
+    celdas_precio = int(sucio.sum())
+    if celdas_precio:
+        tarifa_base = np.full((forma["l"], forma["t"]), np.nan)
+        filas, tipos_sucios = np.nonzero(precio_sucio | deposito_nuevo.any())
+        for i, j in zip(filas.tolist(), tipos_sucios.tolist()):
+            valor = tarifas.tarifa_base(huellas["zonas"][i], ejes[2][j])
+            if valor is not None:
+                tarifa_base[i, j] = valor
+        # Mismas operaciones que calcular_costo para cantidad 1 y sin seguro
+        precio = tarifa_base * (1 + tarifas.parametros['Margen_Ganancia'])
+        precio_iva = precio * FACTOR_IVA
+        grilla_precio = np.broadcast_to(precio, sucio.shape)
+        grilla_precio_iva = np.broadcast_to(precio_iva, sucio.shape)
+        columnas["precio"][sucio] = grilla_precio[sucio]
+        columnas["precio_iva"][sucio] = grilla_precio_iva[sucio]
+
+    # Distancias: pares nuevos, movidos o que eran aproximados (por si la caché ya los tiene)
+    distancia_sucia = deposito_nuevo[:, None] | (pos_l < 0)[None, :]
+    if huellas_previas is not None:
+        for i, coordenadas in enumerate(huellas["coordenadas_depositos"]):
+            if pos_d[i] >= 0 and huellas_previas["coordenadas_depositos"][pos_d[i]] != coordenadas:
+                distancia_sucia[i, :] = True
+        for i, coordenadas in enumerate(huellas["coordenadas_localidades"]):
+            if pos_l[i] >= 0 and huellas_previas["coordenadas_localidades"][pos_l[i]] != coordenadas:
+                distancia_sucia[:, i] = True
+    distancia_sucia |= np.asarray(columnas["distancia_aproximada"], dtype=bool)
+    distancia_sucia |= np.isnan(columnas["distancia_km"])
+
+    celdas_distancia = 0
+    for d, l in zip(*np.nonzero(distancia_sucia)):
+        puntos = (*huellas["coordenadas_depositos"][d], *huellas["coordenadas_localidades"][l])
+        km = cache_distancias.obtener(*puntos, contar=False) if cache_distancias else None
+        aproximada = km is None
+        if aproximada:
+            km = estimar_distancia(*puntos)
+        if columnas["distancia_km"][d, l] != km or columnas["distancia_aproximada"][d, l] != aproximada:
+            columnas["distancia_km"][d, l] = km
+            columnas["distancia_aproximada"][d, l] = aproximada
+            celdas_distancia += 1
+
+    os.makedirs(directorio, exist_ok=True)
+    for nombre, columna in columnas.items():
+        if en_lugar:
+            columna.flush()
+        else:
+            # Se escribe aparte y se reemplaza: un lector con la grilla abierta conserva la versión anterior
+            temporal = _ruta(directorio, nombre) + ".tmp"
+            with open(temporal, "wb") as f:
+                np.save(f, columna)
+            os.replace(temporal, _ruta(directorio, nombre))
+
+    manifiesto = dict(
+        descripcion,
+        nombres_zona={zona: tarifas.nombre_zona(zona) for zona in set(huellas["zonas"])},
+        version_tarifas=tarifas.version,
+        actualizado=time.time(),
+    )
+    temporal = os.path.join(directorio, ARCHIVO_MANIFIESTO + ".tmp")
+    with open(temporal, "w") as f:
+        json.dump(manifiesto, f, ensure_ascii=False)
+    os.replace(temporal, os.path.join(directorio, ARCHIVO_MANIFIESTO))
+
+    return {
+        "celdas": forma["d"] * forma["l"] * forma["t"],
+        "precios_recalculados": celdas_precio,
+        "distancias_actualizadas": celdas_distancia,
+        "en_lugar": en_lugar,
+        "segundos": time.perf_counter() - inicio,
+    }
+
+
+class GrillaPrecios:
+    def __init__(self, directorio=RUTA_GRILLA):
+        self.directorio = directorio
+        manifiesto = leer_manifiesto(directorio)
+        if manifiesto is None:
+            raise FileNotFoundError(f"No hay grilla de precios en {directorio}")
+        self.version_tarifas = manifiesto["version_tarifas"]
+        self.depositos = manifiesto["depositos"]
+        self.localidades = manifiesto["localidades"]
+        self.tipos_carga = manifiesto["tipos_carga"]
+        self.zonas = manifiesto["huellas"]["zonas"]
+        self.nombres_zona = manifiesto["nombres_zona"]
+
+        self._indice_deposito = {nombre: i for i, nombre in enumerate(self.depositos)}
+        self._indice_localidad = {
+            _clave_localidad(zona, nombre): i for i, (zona, nombre) in enumerate(zip(self.zonas, self.localidades))
+        }
+        self._indice_tipo = {tipo: i for i, tipo in enumerate(self.tipos_carga)}
+        self.columnas = {nombre: np.load(_ruta(directorio, nombre), mmap_mode="r") for nombre in COLUMNAS}
+
+    # La grilla corresponde a estas tarifas (mismo contenido de los tres JSON)
+    def vigente(self, tarifas):
+        return tarifas.version == self.version_tarifas
+
+    def _indices(self, deposito, id_zona, localidad, tipo_carga):
+        d = self._indice_deposito.get(deposito)
+        l = self._indice_localidad.get(_clave_localidad(id_zona, localidad))
+        t = self._indice_tipo.get(tipo_carga)
+        return None if d is None or l is None or t is None else (d, l, t)
+
+    # Precio unitario (cantidad 1, sin seguro) o None si no hay tarifa
+    def precio(self, deposito, id_zona, localidad, tipo_carga, incluir_iva=False):
+        indices = self._indices(deposito, id_zona, localidad, tipo_carga)
+        if indices is None:
+            return None
+        valor = float(self.columnas["precio_iva" if incluir_iva else "precio"][indices])
+        return None if np.isnan(valor) else valor
+
+    # Igual que calcular_costo, leyendo el precio unitario de la grilla
+    def costo(self, deposito, id_zona, localidad, tipo_carga, cantidad, incluir_iva, valor_mercaderia=None):
+        costo = self.precio(deposito, id_zona, localidad, tipo_carga, incluir_iva)
+        if costo is None:
+            return None
+        if tipo_carga != BULTO_MINIMO:
+            costo *= cantidad
+        return costo + calcular_seguro(valor_mercaderia)
+
+    def distancia(self, deposito, id_zona, localidad):
+        d = self._indice_deposito.get(deposito)
+        l = self._indice_localidad.get(_clave_localidad(id_zona, localidad))
+        if d is None or l is None:
+            return None
+        return float(self.columnas["distancia_km"][d, l]), bool(self.columnas["distancia_aproximada"][d, l])
+
+    # Filas de la grilla (sin las celdas sin tarifa), como dict de columnas
+    def filas(self):
+        precio, precio_iva = self.columnas["precio"], self.columnas["precio_iva"]
+        distancia_km, distancia_aproximada = self.columnas["distancia_km"], self.columnas["distancia_aproximada"]
+        d, l, t = np.nonzero(~np.isnan(precio))
+        zonas = np.asarray(self.zonas, dtype=object)[l]
+        return {
+            "deposito": np.asarray(self.depositos, dtype=object)[d],
+            "localidad": np.asarray(self.localidades, dtype=object)[l],
+            "id_zona": zonas,
+            "nombre_zona": np.asarray([self.nombres_zona.get(zona, "") for zona in zonas], dtype=object),
+            "tipo_carga": np.asarray(self.tipos_carga, dtype=object)[t],
+            "precio": np.round(precio[d, l, t], 2),
+            "precio_iva": np.round(precio_iva[d, l, t], 2),
+            "distancia_km": np.round(distancia_km[d, l], 2),
+            "distancia_aproximada": distancia_aproximada[d, l],
+        }
+
+    # Función para exportar la grilla como tabla estática (.csv, .json o .parquet)
+    def exportar(self, ruta):
+        filas = self.filas()
+        columnas = [filas[nombre].tolist() for nombre in COLUMNAS_EXPORTACION]
+        if ruta.endswith(".parquet"):
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError as e:
+                raise SystemExit("Para escribir Parquet instale pyarrow: pip install pyarrow") from e
+            pq.write_table(pa.table(dict(zip(COLUMNAS_EXPORTACION, columnas))), ruta)
+        elif ruta.endswith(".json"):
+            with open(ruta, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "version_tarifas": self.version_tarifas,
+                    "precios": [dict(zip(COLUMNAS_EXPORTACION, fila)) for fila in zip(*columnas)],
+                }, f, ensure_ascii=False)
+        else:
+            with open(ruta, 'w', newline='', encoding='utf-8') as f:
+                escritor = csv.writer(f)
+                escritor.writerow(COLUMNAS_EXPORTACION)
+                escritor.writerows(zip(*columnas))
+        return len(filas["precio"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grilla materializada de precios depósito × localidad × tipo de carga")
+    parser.add_argument("--grilla", default=RUTA_GRILLA, help="Directorio de la grilla")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+    actualizar = subparsers.add_parser("actualizar", help="Crea la grilla o recalcula las celdas afectadas")
+    actualizar.add_argument("--depositos", default="Depositos.json")
+    actualizar.add_argument("--sin-cache", action="store_true", help="No consultar la caché de distancias")
+    actualizar.add_argument("--forzar", action="store_true", help="Recalcular todas las celdas")
+    exportar = subparsers.add_parser("exportar", help="Exporta la grilla para las tablas de precios del sitio")
+    exportar.add_argument("salida", help="Archivo de salida (.csv, .json o .parquet)")
+    args = parser.parse_args()
+
+    if args.comando == "actualizar":
+        with open(args.depositos, 'r') as f:
+            depositos = json.load(f)["Lista_de_Depositos"]
+        tarifas = compilar_snapshot()
+        resumen = actualizar_grilla(
+            tarifas, depositos, args.grilla,
+            cache_distancias=None if args.sin_cache else obtener_cache_distancias(), forzar=args.forzar,
+        )
+        print(
+            f"Grilla {args.grilla} | tarifas {tarifas.version} | {resumen['celdas']} celdas | "
+            f"precios recalculados: {resumen['precios_recalculados']} | "
+            f"distancias actualizadas: {resumen['distancias_actualizadas']} | "
+            f"{'en el lugar' if resumen['en_lugar'] else 'reescrita'} en {resumen['segundos']:.2f} s"
+        )
+    else:
+        filas = GrillaPrecios(args.grilla).exportar(args.salida)
+        print(f"{filas} precios exportados -> {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
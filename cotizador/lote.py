@@ -0,0 +1,240 @@
+import argparse
+import csv
+import json
+import time
+
+import numpy as np
+
+from cotizador.cache_distancias import obtener_cache_distancias
+from cotizador.precios import BULTO_MINIMO, FACTOR_IVA, TASA_SEGURO, rango_carga
+from cotizador.ruteo import estimar_distancia
+from cotizador.tarifas import compilar_snapshot
+
+# Cotizador por lotes: precia un CSV/Parquet de envíos con búsquedas y
+# aritmética vectorizadas en NumPy. Aplica exactamente las mismas operaciones
+# (y en el mismo orden) que cotizador.precios.calcular_costo, así que los
+# montos coinciden con los de la cotización individual.
+#
+#   python -m cotizador.lote envios.csv -o cotizados.csv
+#
+# Columnas de entrada: deposito, localidad, tipo_carga, cantidad, incluir_iva,
+# valor_declarado e id_zona (las tres últimas son opcionales). id_zona solo hace
+# falta para localidades que se repiten en varias zonas (p. ej. METAN).
+# Las filas con datos inválidos no cortan el lote: quedan marcadas en 'error'.
+
+COLUMNAS_SALIDA = [
+    "deposito", "localidad", "tipo_carga", "cantidad", "incluir_iva", "valor_declarado",
+    "id_zona", "nombre_zona", "distancia_km", "distancia_aproximada", "seguro_carga", "costo_final", "error",
+]
+
+VALORES_VERDADEROS = {"1", "true", "si", "sí", "s", "x", "yes", "y"}
+
+
+# Función para leer el archivo de envíos como un dict de columnas
+def leer_envios(ruta):
+    if ruta.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise SystemExit("Para leer Parquet instale pyarrow: pip install pyarrow") from e
+        return {nombre: [str(v) if v is not None else "" for v in valores]
+                for nombre, valores in pq.read_table(ruta).to_pydict().items()}
+
+    with open(ruta, newline='', encoding='utf-8-sig') as f:
+        lector = csv.reader(f)
+        encabezado = [nombre.strip().lower() for nombre in next(lector)]
+        columnas = list(zip(*lector)) or [()] * len(encabezado)
+    return {nombre: list(valores) for nombre, valores in zip(encabezado, columnas)}
+
+
+# Función para escribir el resultado como CSV o Parquet
+def escribir_resultado(resultado, ruta):
+    if ruta.endswith(".parquet"):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise SystemExit("Para escribir Parquet instale pyarrow: pip install pyarrow") from e
+        pq.write_table(pa.table({nombre: list(resultado[nombre]) for nombre in COLUMNAS_SALIDA}), ruta)
+        return
+
+    with open(ruta, 'w', newline='', encoding='utf-8') as f:
+        escritor = csv.writer(f)
+        escritor.writerow(COLUMNAS_SALIDA)
+        escritor.writerows(zip(*(
+            resultado[nombre].tolist() if isinstance(resultado[nombre], np.ndarray) else resultado[nombre]
+            for nombre in COLUMNAS_SALIDA
+        )))
+
+
+def _codificar(valores):
+    unicos, indices = np.unique(np.asarray(valores, dtype=object).astype(str), return_inverse=True)
+    return unicos, indices
+
+
+# Función para convertir un valor a entero; None si no es un número entero ("2.7", "abc")
+def _entero(valor):
+    try:
+        numero = float(str(valor).strip())
+    except ValueError:
+        return None
+    if not numero.is_integer() or abs(numero) > np.iinfo(np.int64).max:
+        return None
+    return int(numero)
+
+
+# Función para convertir un valor a float; None si no es un número finito
+def _decimal(valor):
+    try:
+        numero = float(str(valor).strip())
+    except ValueError:
+        return None
+    return numero if np.isfinite(numero) else None
+
+
+# Función para resolver una localidad (y su zona, si vino); devuelve (fila, motivo del error)
+def _resolver_destino(tarifas, zona_pedida, nombre):
+    if zona_pedida:
+        zona = _entero(zona_pedida)
+        item = tarifas.localidad(zona if zona is not None else zona_pedida, nombre)
+        return item, "" if item else "localidad desconocida en la zona indicada"
+    item = tarifas.buscar_localidad(nombre)
+    if item is None and len(tarifas.localidades_con_nombre(nombre)) > 1:
+        return None, "localidad repetida en varias zonas: indique id_zona"
+    return item, "" if item else "localidad desconocida"
+
+
+# Función para preciar un lote de envíos; devuelve un dict de columnas (arrays)
+def cotizar_lote(envios, tarifas, depositos, cache_distancias=None):
+    cantidad_filas = len(envios["localidad"])
+    vacio = [""] * cantidad_filas
+    error = np.full(cantidad_filas, "", dtype=object)
+
+    # (zona pedida, localidad) -> zona (búsqueda por valor único, no por fila)
+    destinos, idx_destino = _codificar([
+        f"{str(zona).strip()}|{nombre}" for zona, nombre in zip(envios.get("id_zona", vacio), envios["localidad"])
+    ])
+    zona_por_destino = []
+    coordenadas_destino = []
+    motivos = []
+    for clave in destinos:
+        item, motivo = _resolver_destino(tarifas, *clave.split("|", 1))
+        zona_por_destino.append(str(item['ID_Zona']) if item else "")
+        coordenadas_destino.append((item["Latitud"], item["Longitud"]) if item else None)
+        motivos.append(motivo)
+    id_zona = np.asarray(zona_por_destino, dtype=object)[idx_destino]
+    error[:] = np.asarray(motivos, dtype=object)[idx_destino]
+
+    # Depósitos por nombre único
+    depositos_por_nombre = {dep["Nombre"]: dep for dep in depositos}
+    nombres_deposito, idx_deposito = _codificar(envios.get("deposito", vacio))
+    deposito_valido = np.asarray([nombre in depositos_por_nombre for nombre in nombres_deposito])[idx_deposito]
+    error[(error == "") & ~deposito_valido] = "depósito desconocido"
+
+    # (zona, tipo de carga) -> tarifa con una tabla 2D
+    tipos, idx_tipo = _codificar(envios["tipo_carga"])
+    zonas, idx_zona = np.unique(id_zona.astype(str), return_inverse=True)
+    tabla_tarifas = np.full((len(zonas), len(tipos)), np.nan)
+    for i, zona in enumerate(zonas):
+        for j, tipo in enumerate(tipos):
+            valor = tarifas.tarifa_base(zona, tipo)
+            if valor is not None:
+                tabla_tarifas[i, j] = valor
+    tarifa_base = tabla_tarifas[idx_zona, idx_tipo]
+    error[(error == "") & np.isnan(tarifa_base)] = "sin tarifa para la zona y el tipo de carga"
+
+    # Cantidades (fila por fila: una celda inválida marca solo su fila) y rangos por tipo de carga
+    cantidades = [_entero(v) if str(v).strip() else 0 for v in envios["cantidad"]]
+    cantidad_valida = np.asarray([v is not None for v in cantidades], dtype=bool)
+    cantidad = np.asarray([v if v is not None else 0 for v in cantidades], dtype=np.int64)
+    error[(error == "") & ~cantidad_valida] = "cantidad inválida (se espera un número entero)"
+    rango_min = np.asarray([rango_carga(tipo)["min"] for tipo in tipos])[idx_tipo]
+    rango_max = np.asarray([rango_carga(tipo)["max"] or np.iinfo(np.int64).max for tipo in tipos])[idx_tipo]
+    error[(error == "") & ((cantidad < rango_min) | (cantidad > rango_max))] = "cantidad fuera de rango"
+
+    incluir_iva = np.asarray(
+        [str(v).strip().lower() in VALORES_VERDADEROS for v in envios.get("incluir_iva", vacio)], dtype=bool
+    )
+    valores = [_decimal(v) if str(v).strip() else 0.0 for v in envios.get("valor_declarado", vacio)]
+    # Como en la app y en POST /quote: el valor declarado no puede ser negativo
+    valor_valido = np.asarray([v is not None and v >= 0 for v in valores], dtype=bool)
+    valor_declarado = np.asarray([v if v is not None else 0.0 for v in valores], dtype=np.float64)
+    error[(error == "") & ~valor_valido] = "valor declarado inválido"
+    es_bulto = np.asarray([tipo == BULTO_MINIMO for tipo in tipos])[idx_tipo]
+
+    # Misma secuencia de operaciones que calcular_costo
+    margen_ganancia = tarifas.parametros['Margen_Ganancia']
+    costo = tarifa_base * (1 + margen_ganancia)
+    costo = np.where(incluir_iva, costo * FACTOR_IVA, costo)
+    costo = np.where(es_bulto, costo, costo * cantidad)
+    seguro = np.where(valor_declarado != 0, valor_declarado * TASA_SEGURO, 0.0)
+    costo = costo + seguro
+    costo[error != ""] = np.nan
+
+    # Distancias por par único (depósito, destino): caché y, si falta, estimación
+    pares, idx_par = np.unique(idx_deposito * len(destinos) + idx_destino, return_inverse=True)
+    distancia_par = np.full(len(pares), np.nan)
+    aproximada_par = np.zeros(len(pares), dtype=bool)
+    for k, par in enumerate(pares):
+        deposito = depositos_por_nombre.get(nombres_deposito[par // len(destinos)])
+        destino = coordenadas_destino[par % len(destinos)]
+        if deposito is None or destino is None:
+            continue
+        origen = (deposito["Latitud"], deposito["Longitud"])
+        km = cache_distancias.obtener(*origen, *destino, contar=False) if cache_distancias else None
+        if km is None:
+            km = estimar_distancia(*origen, *destino)
+            aproximada_par[k] = True
+        distancia_par[k] = km
+    distancia = distancia_par[idx_par]
+
+    nombres_zona = np.asarray([tarifas.nombres_zona.get(z, "") for z in zonas], dtype=object)[idx_zona]
+    return {
+        "deposito": envios.get("deposito", vacio),
+        "localidad": envios["localidad"],
+        "tipo_carga": envios["tipo_carga"],
+        "cantidad": cantidad,
+        "incluir_iva": incluir_iva,
+        "valor_declarado": valor_declarado,
+        "id_zona": id_zona,
+        "nombre_zona": nombres_zona,
+        "distancia_km": distancia,
+        "distancia_aproximada": aproximada_par[idx_par],
+        "seguro_carga": np.where(error == "", seguro, np.nan),
+        "costo_final": costo,
+        "error": error,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cotiza un lote de envíos (CSV o Parquet)")
+    parser.add_argument("entrada", help="Archivo de envíos (.csv o .parquet)")
+    parser.add_argument("-o", "--salida", help="Archivo de salida (por defecto <entrada>_cotizado.csv)")
+    parser.add_argument("--depositos", default="Depositos.json")
+    parser.add_argument("--sin-cache", action="store_true", help="No consultar la caché de distancias")
+    args = parser.parse_args()
+
+    salida = args.salida or args.entrada.rsplit(".", 1)[0] + "_cotizado.csv"
+    inicio = time.perf_counter()
+    tarifas = compilar_snapshot()
+    with open(args.depositos, 'r') as f:
+        depositos = json.load(f)["Lista_de_Depositos"]
+    envios = leer_envios(args.entrada)
+    leido = time.perf_counter()
+
+    resultado = cotizar_lote(
+        envios, tarifas, depositos, cache_distancias=None if args.sin_cache else obtener_cache_distancias()
+    )
+    cotizado = time.perf_counter()
+    escribir_resultado(resultado, salida)
+
+    con_error = int((resultado["error"] != "").sum())
+    print(
+        f"{len(resultado['costo_final'])} envíos cotizados ({con_error} con error) | tarifas {tarifas.version} | "
+        f"lectura {leido - inicio:.2f} s, cálculo {cotizado - leido:.2f} s, "
+        f"escritura {time.perf_counter() - cotizado:.2f} s -> {salida}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+import bisect
+import contextvars
+import cProfile
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Instrumentación liviana: un span por etapa (distancia, QR, HTML, PDF,
+# Supabase) que alimenta histogramas de latencia por etapa y contadores de
+# errores, más métricas que se leen en el momento de la consulta (aciertos de
+# las cachés, estado del outbox y del renderizador de PDF).
+#
+# Cada span cuesta dos perf_counter, un lock y un bisect: se puede dejar
+# activo en producción. Las métricas se publican en formato de texto de
+# Prometheus desde un servidor HTTP en un hilo aparte (sidecar):
+#
+#   COTIZADOR_METRICAS_PUERTO=9100  ->  GET http://host:9100/metrics
+#
+# Perfilado opcional (COTIZADOR_PERFILADO_MS=umbral): se perfila con cProfile
+# una fracción de los reruns (COTIZADOR_PERFILADO_MUESTREO, por defecto 0.1) y
+# los que tardan más que el umbral se guardan como .prof en
+# COTIZADOR_PERFILADO_DIR, junto con los spans del rerun.
+
+logger = logging.getLogger(__name__)
+
+PREFIJO = "cotizador"
+
+# Límites de los buckets de latencia, en segundos
+LIMITES_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Spans de la traza en curso (rerun de Streamlit o solicitud), si hay una activa
+_traza_actual = contextvars.ContextVar("traza_actual", default=None)
+
+
+class Histograma:
+    def __init__(self, limites=LIMITES_LATENCIA):
+        self.limites = tuple(limites)
+        self.cuentas = [0] * (len(self.limites) + 1)
+        self.suma = 0.0
+        self.cantidad = 0
+
+    def observar(self, valor):
+        self.cuentas[bisect.bisect_left(self.limites, valor)] += 1
+        self.suma += valor
+        self.cantidad += 1
+
+
+class RegistroMetricas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histogramas = {}  # (nombre, etiquetas) -> Histograma
+        self._contadores = {}   # (nombre, etiquetas) -> valor
+        self._ayudas = {}
+        self._recolectores = []
+
+    def describir(self, nombre, ayuda):
+        self._ayudas[nombre] = ayuda
+
+    def observar(self, nombre, valor, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            histograma = self._histogramas.get(clave)
+            if histograma is None:
+                histograma = self._histogramas[clave] = Histograma()
+            histograma.observar(valor)
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+
+    # recolector() -> [(nombre, tipo, {etiquetas}, valor), ...]; se llama en cada exportación
+    def registrar_recolector(self, recolector):
+        with self._lock:
+            self._recolectores.append(recolector)
+
+    # Span de una etapa: mide la duración y cuenta el error si la etapa lanza una excepción
+    @contextmanager
+    def span(self, etapa):
+        inicio = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            duracion = time.perf_counter() - inicio
+            self.observar("etapa_segundos", duracion, etapa=etapa)
+            if error is not None:
+                self.incrementar("errores_total", etapa=etapa, tipo=error)
+            traza = _traza_actual.get()
+            if traza is not None:
+                traza.append({"etapa": etapa, "ms": round(duracion * 1000, 3), "error": error})
+
+    # Decorador: cada llamada a la función es un span de la etapa
+    def medir(self, etapa):
+        def decorador(funcion):
+            @functools.wraps(funcion)
+            def envoltura(*args, **kwargs):
+                with self.span(etapa):
+                    return funcion(*args, **kwargs)
+            return envoltura
+        return decorador
+
+    # Texto en formato de exposición de Prometheus (versión 0.0.4)
+    def exportar_prometheus(self):
+        with self._lock:
+            histogramas = {clave: (list(h.cuentas), h.suma, h.cantidad, h.limites)
+                           for clave, h in self._histogramas.items()}
+            contadores = dict(self._contadores)
+            recolectores = list(self._recolectores)
+
+        familias = {}  # nombre -> (tipo, [líneas])
+
+        def agregar(nombre, tipo, linea):
+            familias.setdefault(nombre, (tipo, []))[1].append(linea)
+
+        for (nombre, etiquetas), (cuentas, suma, cantidad, limites) in sorted(histogramas.items()):
+            completo = f"{PREFIJO}_{nombre}"
+            acumulado = 0
+            for limite, cuenta in zip(limites + (float("inf"),), cuentas):
+                acumulado += cuenta
+                le = "+Inf" if limite == float("inf") else repr(limite)
+                agregar(completo, "histogram", f"{completo}_bucket{_etiquetas(etiquetas + (('le', le),))} {acumulado}")
+            agregar(completo, "histogram", f"{completo}_sum{_etiquetas(etiquetas)} {suma!r}")
+            agregar(completo, "histogram", f"{completo}_count{_etiquetas(etiquetas)} {cantidad}")
+
+        for (nombre, etiquetas), valor in sorted(contadores.items()):
+            agregar(f"{PREFIJO}_{nombre}", "counter", f"{PREFIJO}_{nombre}{_etiquetas(etiquetas)} {valor}")
+
+        for recolector in recolectores:
+            try:
+                muestras = recolector()
+            except Exception:
+                logger.exception("Error en un recolector de métricas")
+                continue
+            for nombre, tipo, etiquetas, valor in muestras:
+                completo = f"{PREFIJO}_{nombre}"
+                agregar(completo, tipo, f"{completo}{_etiquetas(tuple(sorted(etiquetas.items())))} {float(valor)!r}")
+
+        lineas = []
+        for nombre, (tipo, muestras) in familias.items():
+            ayuda = self._ayudas.get(nombre[len(PREFIJO) + 1:])
+            if ayuda:
+                lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} {tipo}")
+            lineas.extend(muestras)
+        return "\n".join(lineas) + "\n"
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquetas(pares):
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{clave}="{_escapar(valor)}"' for clave, valor in pares) + "}"
+
+
+# Registro único del proceso, con las métricas que comparten la app, la API y el pipeline
+registro = RegistroMetricas()
+registro.describir("etapa_segundos", "Latencia por etapa de la cotización")
+registro.describir("errores_total", "Errores por etapa y tipo de excepción")
+registro.describir("rerun_segundos", "Tiempo de pared de cada rerun de la app")
+registro.describir("cache_aciertos_ratio", "Proporción de aciertos de la caché")
+registro.describir("api_segundos", "Latencia de la API por ruta")
+
+span = registro.span
+medir = registro.medir
+
+
+# Valores de estadisticas() del ruteo que no son contadores (promedios, tamaños,
+# configuración): se exportan como gauges con nombre propio, no en ruteo_total
+GAUGES_RUTEO = {
+    "ms_promedio": "ruteo_ms_promedio",
+    "nodos": "ruteo_grafo_nodos",
+    "arboles": "ruteo_grafo_arboles",
+    "factor": "ruteo_factor_estimacion",
+}
+
+
+# Función para registrar las cachés, el outbox y el renderizador de PDF del contexto
+def registrar_contexto(contexto):
+    from cotizador.pdf import obtener_renderizador
+
+    def recolectar():
+        muestras = []
+        for cache, stats in (("distancias", contexto.cache_distancias.estadisticas()),
+                             ("cotizaciones", contexto.cache_cotizaciones.estadisticas())):
+            muestras.append(("cache_aciertos_total", "counter", {"cache": cache, "nivel": "memoria"},
+                             stats["aciertos_memoria"]))
+            muestras.append(("cache_aciertos_total", "counter", {"cache": cache, "nivel": "disco"},
+                             stats["aciertos_disco"]))
+            muestras.append(("cache_fallos_total", "counter", {"cache": cache}, stats["fallos"]))
+            muestras.append(("cache_aciertos_ratio", "gauge", {"cache": cache}, stats["ratio_aciertos"]))
+
+        if hasattr(contexto.ruteo, "estadisticas"):
+            for nombre, valor in contexto.ruteo.estadisticas().items():
+                if not isinstance(valor, (int, float)) or isinstance(valor, bool):
+                    continue
+                if nombre in GAUGES_RUTEO:
+                    muestras.append((GAUGES_RUTEO[nombre], "gauge", {}, valor))
+                else:
+                    muestras.append(("ruteo_total", "counter", {"evento": nombre}, valor))
+
+        pdf = obtener_renderizador().estadisticas()
+        for nombre in ("renders", "errores", "rechazados", "timeouts"):
+            muestras.append(("pdf_total", "counter", {"evento": nombre}, pdf[nombre]))
+        muestras.append(("pdf_en_curso", "gauge", {}, pdf["en_curso"]))
+        muestras.append(("pdf_en_espera", "gauge", {}, pdf["en_espera"]))
+        if contexto.pipeline is not None:
+            muestras.append(("pipeline_en_cola", "gauge", {}, contexto.pipeline.en_cola()))
+
+        if contexto.outbox is not None:
+            muestras.append(("outbox_pendientes", "gauge", {}, contexto.outbox.pendientes()))
+            muestras.append(("outbox_descartadas", "gauge", {}, contexto.outbox.descartadas()))
+
+        verificacion = contexto.verificador.estadisticas()
+        for nombre in ("aciertos", "aciertos_negativos", "busquedas", "agrupadas", "errores"):
+            muestras.append(("verificacion_total", "counter", {"evento": nombre}, verificacion[nombre]))
+        return muestras
+
+    registro.registrar_recolector(recolectar)
+
+
+class _ManejadorMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        cuerpo = registro.exportar_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        logger.debug("metricas: " + formato, *args)
+
+
+_servidor_global = None
+_lock_global = threading.Lock()
+
+
+# Función para iniciar (una sola vez por proceso) el endpoint /metrics en un hilo aparte.
+# Sin puerto (ni COTIZADOR_METRICAS_PUERTO) no hace nada y devuelve None.
+def iniciar_servidor_metricas(puerto=None, host="0.0.0.0"):
+    global _servidor_global
+    puerto = puerto or int(os.environ.get("COTIZADOR_METRICAS_PUERTO", 0))
+    if not puerto:
+        return None
+    with _lock_global:
+        if _servidor_global is None:
+            try:
+                _servidor_global = ThreadingHTTPServer((host, puerto), _ManejadorMetricas)
+            except OSError as e:
+                logger.warning("No se pudo iniciar el endpoint de métricas en el puerto %d: %s", puerto, e)
+                return None
+            _servidor_global.daemon_threads = True
+            threading.Thread(target=_servidor_global.serve_forever, name="metricas", daemon=True).start()
+            logger.info("Métricas en http://%s:%d/metrics", host, puerto)
+    return _servidor_global
+
+
+class PerfiladorReruns:
+    def __init__(self, umbral_segundos, directorio="perfiles", muestreo=0.1):
+        self.umbral_segundos = umbral_segundos
+        self.directorio = directorio
+        self.muestreo = muestreo
+        self._local = threading.local()
+
+    # Empieza a registrar los spans del rerun y, si toca por muestreo, a perfilarlo.
+    # Un rerun cortado con st.stop() no llega a terminar(): se cierra al empezar
+    # el siguiente rerun del mismo hilo.
+    def iniciar(self):
+        anterior = getattr(self._local, "perfil", None)
+        if anterior is not None:
+            anterior.disable()
+        perfil = None
+        if random.random() < self.muestreo:
+            perfil = cProfile.Profile()
+            try:
+                perfil.enable()
+            except ValueError:
+                # Otro hilo ya está perfilando (un solo perfilador activo por proceso)
+                perfil = None
+        self._local.perfil = perfil
+        spans = []
+        _traza_actual.set(spans)
+        return spans
+
+    # Cierra el rerun; si tardó más que el umbral guarda el perfil (.prof) y los spans (.json)
+    def terminar(self, segundos, nombre="rerun"):
+        perfil = getattr(self._local, "perfil", None)
+        self._local.perfil = None
+        if perfil is not None:
+            perfil.disable()
+        spans = _traza_actual.get() or []
+        _traza_actual.set(None)
+        if segundos < self.umbral_segundos:
+            return None
+        logger.info("%s lento: %.0f ms %s", nombre, segundos * 1000, spans)
+        if perfil is None:
+            return None
+        os.makedirs(self.directorio, exist_ok=True)
+        base = os.path.join(self.directorio, f"{nombre}-{time.strftime('%Y%m%d-%H%M%S')}-{int(segundos * 1000)}ms")
+        perfil.dump_stats(base + ".prof")
+        with open(base + ".json", "w") as f:
+            json.dump({"segundos": segundos, "spans": spans}, f, indent=2)
+        return base + ".prof"
+
+
+# Función para crear el perfilador de reruns si está activado por entorno (None si no)
+def perfilador_desde_entorno():
+    umbral_ms = os.environ.get("COTIZADOR_PERFILADO_MS")
+    if not umbral_ms:
+        return None
+    return PerfiladorReruns(
+        float(umbral_ms) / 1000,
+        directorio=os.environ.get("COTIZADOR_PERFILADO_DIR", "perfiles"),
+        muestreo=float(os.environ.get("COTIZADOR_PERFILADO_MUESTREO", 0.1)),
+    )
@@ -0,0 +1,166 @@
+import argparse
+import json
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cotizador.geo import haversine_km
+
+# Servidor local que imita los endpoints de OpenRouteService usados por el
+# cotizador (directions y matrix). Devuelve la distancia haversine multiplicada
+# por un factor de ruta, sin necesidad de API key ni red.
+#
+#   python -m cotizador.ors_simulado --puerto 8089
+#
+# y en .streamlit/secrets.toml:  [openrouteservice] url_base = "http://127.0.0.1:8089"
+
+FACTOR_RUTA = 1.25
+
+
+class ManejadorORS(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Encabezados y cuerpo van en escrituras separadas: sin esto, Nagle + ACK
+    # retardado agregan ~40 ms a cada respuesta con keep-alive
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _responder(self, estado, cuerpo, encabezados=None):
+        datos = json.dumps(cuerpo).encode()
+        self.send_response(estado)
+        for nombre, valor in (encabezados or {}).items():
+            self.send_header(nombre, valor)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _simular_falla(self):
+        servidor = self.server
+        servidor.contar(self.path)
+        if servidor.latencia:
+            time.sleep(servidor.latencia)
+        falla = servidor.tomar_falla()
+        if falla is None:
+            return False
+        codigo, retry_after = falla
+        encabezados = {"Retry-After": str(retry_after)} if retry_after is not None else None
+        self._responder(codigo, {"error": "falla simulada"}, encabezados)
+        return True
+
+    def _distancia_m(self, origen, destino):
+        # Las coordenadas llegan en formato ORS: [lon, lat]
+        km = haversine_km(origen[1], origen[0], destino[1], destino[0]) * FACTOR_RUTA
+        return round(km * 1000, 1)
+
+    def do_GET(self):
+        partes = urllib.parse.urlsplit(self.path)
+        if not partes.path.startswith("/v2/directions/"):
+            self._responder(404, {"error": "no encontrado"})
+            return
+        if self._simular_falla():
+            return
+        params = urllib.parse.parse_qs(partes.query)
+        try:
+            origen = [float(v) for v in params["start"][0].split(",")]
+            destino = [float(v) for v in params["end"][0].split(",")]
+        except (KeyError, ValueError):
+            self._responder(400, {"error": "parámetros inválidos"})
+            return
+        distancia = self._distancia_m(origen, destino)
+        self._responder(200, {
+            "type": "FeatureCollection",
+            "features": [{"properties": {"segments": [{"distance": distancia}], "summary": {"distance": distancia}}}],
+        })
+
+    def do_POST(self):
+        if not self.path.startswith("/v2/matrix/"):
+            self._responder(404, {"error": "no encontrado"})
+            return
+        largo = int(self.headers.get("Content-Length", 0))
+        cuerpo = json.loads(self.rfile.read(largo) or b"{}")
+        if self._simular_falla():
+            return
+        ubicaciones = cuerpo.get("locations", [])
+        fuentes = cuerpo.get("sources") or list(range(len(ubicaciones)))
+        destinos = cuerpo.get("destinations") or list(range(len(ubicaciones)))
+        if len(fuentes) * len(destinos) > self.server.max_elementos:
+            self._responder(400, {"error": {"code": 6004, "message": "demasiados elementos"}})
+            return
+        divisor = 1000 if cuerpo.get("units") == "km" else 1
+        self._responder(200, {
+            "distances": [
+                [self._distancia_m(ubicaciones[i], ubicaciones[j]) / divisor for j in destinos]
+                for i in fuentes
+            ],
+        })
+
+
+class ServidorORSSimulado(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, direccion, latencia=0.0, max_elementos=3500):
+        super().__init__(direccion, ManejadorORS)
+        self.latencia = latencia
+        self.max_elementos = max_elementos
+        self.fallas_pendientes = 0
+        self.codigo_falla = 503
+        self.retry_after = None
+        self.solicitudes = {"directions": 0, "matrix": 0}
+        self._lock = threading.Lock()
+
+    def contar(self, ruta):
+        with self._lock:
+            tipo = "matrix" if "/matrix/" in ruta else "directions"
+            self.solicitudes[tipo] += 1
+
+    # Hace que las próximas `cantidad` solicitudes respondan con `codigo`
+    # (y el encabezado Retry-After, si se da)
+    def fallar(self, cantidad, codigo=503, retry_after=None):
+        with self._lock:
+            self.fallas_pendientes = cantidad
+            self.codigo_falla = codigo
+            self.retry_after = retry_after
+
+    # Consume una falla pendiente: (código, retry_after) o None si no quedan.
+    # Con el lock, solicitudes simultáneas no inyectan ni más ni menos fallas.
+    def tomar_falla(self):
+        with self._lock:
+            if self.fallas_pendientes <= 0:
+                return None
+            self.fallas_pendientes -= 1
+            return self.codigo_falla, self.retry_after
+
+    @property
+    def url_base(self):
+        host, puerto = self.server_address[:2]
+        return f"http://{host}:{puerto}"
+
+
+# Función para levantar el servidor simulado en un hilo (puerto 0 = puerto libre)
+def iniciar_servidor_simulado(host="127.0.0.1", puerto=0, latencia=0.0):
+    servidor = ServidorORSSimulado((host, puerto), latencia=latencia)
+    hilo = threading.Thread(target=servidor.serve_forever, daemon=True)
+    hilo.start()
+    return servidor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor OpenRouteService simulado")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8089)
+    parser.add_argument("--latencia", type=float, default=0.0, help="Segundos de demora por solicitud")
+    args = parser.parse_args()
+
+    servidor = ServidorORSSimulado((args.host, args.puerto), latencia=args.latencia)
+    print(f"ORS simulado escuchando en {servidor.url_base}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from cotizador.almacenamiento import filas_cotizacion, upsert_filas
+
+# Outbox local y durable para las escrituras en Supabase.
+# La cotización se guarda primero en SQLite (una transacción local, sin red) y
+# un hilo en segundo plano la envía a Supabase en lotes con upsert por id, de
+# modo que los reintentos y los envíos duplicados entre workers son inocuos.
+# Si Supabase no responde, las filas quedan en el outbox hasta que vuelva.
+#
+# Si un lote falla se parte en mitades para aislar las filas rechazadas: las
+# buenas del mismo lote se envían y solo se posterga (con backoff propio) la
+# fila que falla sola. Tras max_intentos una fila pasa a descartada (queda en
+# el outbox, fuera de los envíos, hasta reintentar_descartadas()).
+
+logger = logging.getLogger(__name__)
+
+RUTA_DB = os.environ.get("COTIZADOR_OUTBOX", "outbox_cotizaciones.db")
+
+# Orden de envío: primero la tabla principal, después las dependientes
+ORDEN_TABLAS = ('cotizaciones', 'cotizaciones_html')
+
+
+class OutboxCotizaciones:
+    def __init__(self, supabase, ruta_db=RUTA_DB, tamano_lote=50, edad_maxima=2.0,
+                 backoff_base=1.0, backoff_max=300.0, reserva=60.0, max_intentos=20):
+        self.supabase = supabase
+        self.tamano_lote = tamano_lote
+        # Con el backoff por defecto, 20 intentos son algo más de una hora de reintentos
+        self.max_intentos = max_intentos
+        self.edad_maxima = edad_maxima
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.reserva = reserva
+
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._hilo = None
+        self._contadores = {"encoladas": 0, "enviadas": 0, "lotes": 0, "fallas": 0, "descartes": 0}
+
+        self._conexion = sqlite3.connect(ruta_db, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        # FULL: una cotización confirmada en el outbox sobrevive a un corte de energía
+        self._conexion.execute("PRAGMA synchronous=FULL")
+        self._conexion.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " tabla TEXT NOT NULL,"
+            " clave TEXT NOT NULL,"
+            " fila TEXT NOT NULL,"
+            " creado REAL NOT NULL,"
+            " proximo_intento REAL NOT NULL,"
+            " intentos INTEGER NOT NULL DEFAULT 0,"
+            " ultimo_error TEXT,"
+            " descartada INTEGER NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (tabla, clave))"
+        )
+        # Outbox creado antes de la columna 'descartada'
+        columnas = [fila[1] for fila in self._conexion.execute("PRAGMA table_info(outbox)")]
+        if "descartada" not in columnas:
+            self._conexion.execute("ALTER TABLE outbox ADD COLUMN descartada INTEGER NOT NULL DEFAULT 0")
+
+    # Guarda localmente las filas de una cotización (mismo contrato que guardar_cotizacion)
+    def encolar_cotizacion(self, cotizacion_id, datos_cotizacion, html_cotizacion, documento=None):
+        self.encolar(filas_cotizacion(cotizacion_id, datos_cotizacion, html_cotizacion, documento), cotizacion_id)
+
+    # Encola {tabla: fila}; una fila repetida (misma tabla e id) reemplaza a la anterior
+    # (también a una descartada, que vuelve a enviarse)
+    def encolar(self, filas_por_tabla, clave):
+        ahora = time.time()
+        with self._lock:
+            self._conexion.execute("BEGIN IMMEDIATE")
+            try:
+                for tabla, fila in filas_por_tabla.items():
+                    self._conexion.execute(
+                        "INSERT OR REPLACE INTO outbox (tabla, clave, fila, creado, proximo_intento)"
+                        " VALUES (?, ?, ?, ?, ?)",
+                        (tabla, str(clave), json.dumps(fila), ahora, ahora),
+                    )
+                self._conexion.execute("COMMIT")
+            except Exception:
+                self._conexion.execute("ROLLBACK")
+                raise
+            self._contadores["encoladas"] += 1
+            pendientes = self._conexion.execute("SELECT COUNT(*) FROM outbox WHERE descartada = 0").fetchone()[0]
+        if pendientes >= self.tamano_lote:
+            self._despertar.set()
+
+    # Reserva hasta tamano_lote filas vencidas de una tabla para este proceso.
+    # Las filas cuya clave sigue pendiente en una tabla anterior esperan a que esa se envíe.
+    def _reservar(self, tabla):
+        ahora = time.time()
+        previas = ORDEN_TABLAS[:ORDEN_TABLAS.index(tabla)] if tabla in ORDEN_TABLAS else ()
+        filtro_previas = ""
+        if previas:
+            filtro_previas = (
+                " AND clave NOT IN (SELECT clave FROM outbox WHERE tabla IN (%s))" % ",".join("?" * len(previas))
+            )
+        with self._lock:
+            self._conexion.execute("BEGIN IMMEDIATE")
+            try:
+                filas = self._conexion.execute(
+                    "SELECT clave, fila, creado FROM outbox WHERE tabla = ? AND proximo_intento <= ? AND descartada = 0"
+                    + filtro_previas + " ORDER BY creado LIMIT ?",
+                    (tabla, ahora, *previas, self.tamano_lote),
+                ).fetchall()
+                # La reserva evita que otro worker envíe el mismo lote al mismo tiempo
+                self._conexion.executemany(
+                    "UPDATE outbox SET proximo_intento = ? WHERE tabla = ? AND clave = ?",
+                    [(ahora + self.reserva, tabla, clave) for clave, _, _ in filas],
+                )
+                self._conexion.execute("COMMIT")
+            except Exception:
+                self._conexion.execute("ROLLBACK")
+                raise
+        return filas
+
+    def _confirmar(self, tabla, filas):
+        with self._lock:
+            # Solo se borra si no fue reemplazada mientras se enviaba
+            self._conexion.executemany(
+                "DELETE FROM outbox WHERE tabla = ? AND clave = ? AND creado = ?",
+                [(tabla, clave, creado) for clave, _, creado in filas],
+            )
+            self._contadores["enviadas"] += len(filas)
+            self._contadores["lotes"] += 1
+
+    def _postergar(self, tabla, filas, error):
+        ahora = time.time()
+        with self._lock:
+            for clave, _, _ in filas:
+                intentos = self._conexion.execute(
+                    "SELECT intentos FROM outbox WHERE tabla = ? AND clave = ?", (tabla, clave)
+                ).fetchone()
+                if intentos is None:
+                    continue
+                if intentos[0] + 1 >= self.max_intentos:
+                    self._descartar(tabla, clave, error)
+                    continue
+                espera = min(self.backoff_max, self.backoff_base * 2 ** intentos[0])
+                self._conexion.execute(
+                    "UPDATE outbox SET intentos = intentos + 1, proximo_intento = ?, ultimo_error = ?"
+                    " WHERE tabla = ? AND clave = ?",
+                    (ahora + espera, str(error)[:500], tabla, clave),
+                )
+            self._contadores["fallas"] += 1
+
+    # Marca la fila como descartada, y con ella las de las tablas siguientes de la
+    # misma cotización (que esperan a esta y nunca se enviarían). Con self._lock tomado.
+    def _descartar(self, tabla, clave, error):
+        logger.error("Outbox: fila %s de %s descartada tras %d intentos: %s", clave, tabla, self.max_intentos, error)
+        self._conexion.execute(
+            "UPDATE outbox SET intentos = intentos + 1, descartada = 1, ultimo_error = ? WHERE tabla = ? AND clave = ?",
+            (str(error)[:500], tabla, clave),
+        )
+        siguientes = ORDEN_TABLAS[ORDEN_TABLAS.index(tabla) + 1:] if tabla in ORDEN_TABLAS else ()
+        for siguiente in siguientes:
+            self._conexion.execute(
+                "UPDATE outbox SET descartada = 1, ultimo_error = ? WHERE tabla = ? AND clave = ?",
+                (f"descartada la fila de {tabla}", siguiente, clave),
+            )
+        self._contadores["descartes"] += 1
+
+    # Envía las filas reservadas de una tabla. Un lote que falla se parte en mitades
+    # hasta aislar las filas que fallan solas; solo esas se postergan. Si fallan
+    # demasiados envíos seguidos sin ninguno bueno (Supabase caído, no una fila
+    # mala), se deja de partir y se posterga todo lo que queda.
+    # Devuelve (filas enviadas, si se cortó por fallas seguidas).
+    def _enviar(self, tabla, filas):
+        enviadas = 0
+        por_enviar = [filas]
+        fallas_seguidas = 0
+        limite_fallas = 2 * len(filas).bit_length()
+        while por_enviar:
+            lote = por_enviar.pop()
+            try:
+                upsert_filas(self.supabase, tabla, [json.loads(fila) for _, fila, _ in lote])
+            except Exception as e:
+                fallas_seguidas += 1
+                if fallas_seguidas >= limite_fallas:
+                    logger.warning("Outbox: Supabase rechaza todos los envíos a %s: %s", tabla, e)
+                    self._postergar(tabla, lote + [fila for resto in por_enviar for fila in resto], e)
+                    return enviadas, True
+                if len(lote) == 1:
+                    logger.warning("Outbox: no se pudo enviar la fila %s a %s: %s", lote[0][0], tabla, e)
+                    self._postergar(tabla, lote, e)
+                else:
+                    mitad = len(lote) // 2
+                    por_enviar.extend((lote[mitad:], lote[:mitad]))
+                continue
+            fallas_seguidas = 0
+            self._confirmar(tabla, lote)
+            enviadas += len(lote)
+        return enviadas, False
+
+    # Envía a Supabase todo lo que esté vencido; devuelve la cantidad de filas enviadas
+    def vaciar(self):
+        enviadas = 0
+        for tabla in ORDEN_TABLAS:
+            while True:
+                filas = self._reservar(tabla)
+                if not filas:
+                    break
+                enviadas_lote, cortado = self._enviar(tabla, filas)
+                enviadas += enviadas_lote
+                if cortado or len(filas) < self.tamano_lote:
+                    break
+        return enviadas
+
+    # Política de envío: un lote lleno o la fila pendiente más vieja supera edad_maxima
+    def _debe_vaciar(self):
+        with self._lock:
+            cantidad, mas_vieja = self._conexion.execute(
+                "SELECT COUNT(*), MIN(creado) FROM outbox WHERE proximo_intento <= ? AND descartada = 0",
+                (time.time(),),
+            ).fetchone()
+        if not cantidad:
+            return False
+        return cantidad >= self.tamano_lote or time.time() - mas_vieja >= self.edad_maxima
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            try:
+                if self._debe_vaciar():
+                    self.vaciar()
+            except Exception:
+                logger.exception("Error en el envío del outbox")
+            self._despertar.wait(timeout=min(self.edad_maxima, 1.0))
+            self._despertar.clear()
+
+    def iniciar(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle, name="outbox-cotizaciones", daemon=True)
+            self._hilo.start()
+        return self
+
+    def detener(self, vaciar=True):
+        self._detener.set()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=10)
+            self._hilo = None
+        if vaciar:
+            self.vaciar()
+
+    def pendientes(self):
+        with self._lock:
+            return self._conexion.execute("SELECT COUNT(*) FROM outbox WHERE descartada = 0").fetchone()[0]
+
+    def descartadas(self):
+        with self._lock:
+            return self._conexion.execute("SELECT COUNT(*) FROM outbox WHERE descartada = 1").fetchone()[0]
+
+    # Vuelve a poner en envío las filas descartadas (p. ej. después de corregir el esquema)
+    def reintentar_descartadas(self):
+        with self._lock:
+            cursor = self._conexion.execute(
+                "UPDATE outbox SET descartada = 0, intentos = 0, proximo_intento = ? WHERE descartada = 1",
+                (time.time(),),
+            )
+        self._despertar.set()
+        return cursor.rowcount
+
+    def estadisticas(self):
+        pendientes = self.pendientes()
+        descartadas = self.descartadas()
+        with self._lock:
+            return dict(self._contadores, pendientes=pendientes, descartadas=descartadas)
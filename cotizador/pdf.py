@@ -0,0 +1,161 @@
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+
+import pdfkit
+
+from cotizador.metricas import medir
+
+# Conversión de HTML a PDF con wkhtmltopdf (vía pdfkit).
+#
+# wkhtmltopdf es un ejecutable de un solo uso: no se puede mantener un proceso
+# vivo entre conversiones. Lo que sí se mantiene "caliente" es la configuración
+# (la búsqueda del binario se hace una vez) y un pool acotado de turnos de
+# render: como mucho `max_concurrencia` procesos a la vez y una cola limitada,
+# de modo que una ráfaga de cotizaciones no llene el contenedor de procesos.
+# El HTML entra por stdin y el PDF sale por stdout, sin archivos temporales.
+
+MAX_CONCURRENCIA = int(os.environ.get("COTIZADOR_PDF_CONCURRENCIA", 0)) or max(1, os.cpu_count() or 1)
+MAX_EN_ESPERA = int(os.environ.get("COTIZADOR_PDF_COLA", 16))
+
+# pdfkit ya agrega --quiet; el HTML se envía codificado en UTF-8
+OPCIONES_PDF = {
+    "encoding": "UTF-8",
+}
+
+
+class ErrorPDF(Exception):
+    pass
+
+
+class RenderizadorSaturado(ErrorPDF):
+    pass
+
+
+class RenderizadorPDF:
+    def __init__(self, max_concurrencia=MAX_CONCURRENCIA, max_en_espera=MAX_EN_ESPERA,
+                 timeout_espera=30.0, timeout_render=60.0, opciones=None, muestras=500):
+        self.max_concurrencia = max_concurrencia
+        self.max_en_espera = max_en_espera
+        self.timeout_espera = timeout_espera
+        self.timeout_render = timeout_render
+        self.opciones = dict(OPCIONES_PDF if opciones is None else opciones)
+
+        self._config = None
+        self._turnos = threading.BoundedSemaphore(max_concurrencia)
+        self._lock = threading.Lock()
+        self._en_espera = 0
+        self._en_curso = 0
+        self._contadores = {"renders": 0, "errores": 0, "rechazados": 0, "timeouts": 0}
+        self._tiempos_render = deque(maxlen=muestras)
+        self._tiempos_espera = deque(maxlen=muestras)
+
+    # Resuelve la ubicación de wkhtmltopdf una sola vez
+    def _configuracion(self):
+        if self._config is None:
+            try:
+                self._config = pdfkit.configuration()  # Sin argumentos, pdfkit buscará wkhtmltopdf en las rutas estándar
+            except OSError as e:
+                raise ErrorPDF(f"Error al convertir HTML a PDF: {e}") from e
+        return self._config
+
+    def _contar(self, nombre):
+        with self._lock:
+            self._contadores[nombre] += 1
+
+    # Función para convertir HTML a PDF; devuelve los bytes del PDF
+    def renderizar(self, html):
+        config = self._configuracion()
+
+        with self._lock:
+            if self._en_espera >= self.max_en_espera:
+                self._contadores["rechazados"] += 1
+                raise RenderizadorSaturado("Hay demasiadas cotizaciones generándose, intente nuevamente en unos segundos")
+            self._en_espera += 1
+
+        inicio_espera = time.perf_counter()
+        try:
+            obtuvo_turno = self._turnos.acquire(timeout=self.timeout_espera)
+        finally:
+            with self._lock:
+                self._en_espera -= 1
+        if not obtuvo_turno:
+            self._contar("rechazados")
+            raise RenderizadorSaturado("Tiempo de espera agotado para generar el PDF")
+
+        inicio_render = time.perf_counter()
+        with self._lock:
+            self._en_curso += 1
+            self._tiempos_espera.append(inicio_render - inicio_espera)
+        try:
+            return self._ejecutar(html, config)
+        finally:
+            with self._lock:
+                self._en_curso -= 1
+                self._tiempos_render.append(time.perf_counter() - inicio_render)
+            self._turnos.release()
+
+    def _ejecutar(self, html, config):
+        documento = pdfkit.PDFKit(html, 'string', configuration=config, options=self.opciones)
+        try:
+            resultado = subprocess.run(
+                documento.command(), input=html.encode('utf-8'),
+                capture_output=True, timeout=self.timeout_render, env=documento.environ,
+            )
+        except subprocess.TimeoutExpired as e:
+            # subprocess.run mata el proceso al vencer el timeout
+            self._contar("timeouts")
+            raise ErrorPDF(f"wkhtmltopdf no respondió en {self.timeout_render:.0f} s") from e
+        except OSError as e:
+            self._contar("errores")
+            raise ErrorPDF(f"Error al convertir HTML a PDF: {e}") from e
+
+        try:
+            documento.handle_error(resultado.returncode, (resultado.stderr or b"").decode('utf-8', errors='replace'))
+        except IOError as e:
+            self._contar("errores")
+            raise ErrorPDF(f"Error al convertir HTML a PDF: {e}") from e
+        if not resultado.stdout.startswith(b"%PDF"):
+            self._contar("errores")
+            raise ErrorPDF("Error al convertir HTML a PDF: salida vacía de wkhtmltopdf")
+
+        self._contar("renders")
+        return resultado.stdout
+
+    def estadisticas(self):
+        with self._lock:
+            render = sorted(self._tiempos_render)
+            espera = sorted(self._tiempos_espera)
+            datos = dict(self._contadores, en_curso=self._en_curso, en_espera=self._en_espera)
+
+        def percentil(muestras, p):
+            return muestras[min(len(muestras) - 1, int(len(muestras) * p))] * 1000 if muestras else 0.0
+
+        datos.update({
+            "render_p50_ms": percentil(render, 0.5),
+            "render_p95_ms": percentil(render, 0.95),
+            "espera_p95_ms": percentil(espera, 0.95),
+        })
+        return datos
+
+
+_renderizador_global = None
+_lock_global = threading.Lock()
+
+
+# Función para obtener el renderizador único del proceso
+def obtener_renderizador():
+    global _renderizador_global
+    if _renderizador_global is None:
+        with _lock_global:
+            if _renderizador_global is None:
+                _renderizador_global = RenderizadorPDF()
+    return _renderizador_global
+
+
+# Función para convertir HTML a PDF con el renderizador compartido
+@medir("pdf")
+def convertir_html_a_pdf(html):
+    return obtener_renderizador().renderizar(html)
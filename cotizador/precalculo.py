@@ -0,0 +1,144 @@
+import argparse
+import json
+from collections import defaultdict
+
+import requests
+
+from cotizador.cache_distancias import obtener_cache_distancias
+from cotizador.configuracion import configuracion_ors
+
+# Precalcula la matriz depósito × localidad con el endpoint matrix de
+# OpenRouteService y la guarda en la caché de distancias. Es incremental:
+# solo se piden los pares que todavía no están en la caché.
+#
+#   python -m cotizador.precalculo
+#   python -m cotizador.precalculo --url-base http://127.0.0.1:8089   (ORS simulado)
+
+# Límite de elementos (orígenes × destinos) por solicitud del plan público de ORS
+MAX_ELEMENTOS = 3500
+
+
+# Función para cargar depósitos y localidades desde los JSON
+def cargar_puntos(ruta_depositos='Depositos.json', ruta_localidades='Zonas_Localidades.json'):
+    with open(ruta_depositos, 'r') as f:
+        depositos = json.load(f)["Lista_de_Depositos"]
+    with open(ruta_localidades, 'r') as f:
+        localidades = json.load(f)
+
+    origenes = [(dep["Latitud"], dep["Longitud"]) for dep in depositos]
+    destinos = [(loc["Latitud"], loc["Longitud"]) for loc in localidades]
+    # Quitar duplicados conservando el orden
+    return list(dict.fromkeys(origenes)), list(dict.fromkeys(destinos))
+
+
+# Función para agrupar los pares faltantes en bloques rectangulares.
+# Los orígenes que comparten el mismo conjunto de destinos faltantes van juntos,
+# así al agregar una localidad solo se pide esa columna y al agregar un depósito
+# solo esa fila.
+def agrupar_faltantes(origenes, destinos, cache, forzar=False):
+    faltantes_por_origen = {}
+    for origen in origenes:
+        faltantes = tuple(
+            destino for destino in destinos
+            if forzar or cache.obtener(origen[0], origen[1], destino[0], destino[1], contar=False) is None
+        )
+        if faltantes:
+            faltantes_por_origen[origen] = faltantes
+
+    bloques = defaultdict(list)
+    for origen, faltantes in faltantes_por_origen.items():
+        bloques[faltantes].append(origen)
+    return [(fuentes, list(faltantes)) for faltantes, fuentes in bloques.items()]
+
+
+# Función para partir un bloque en solicitudes que respeten el límite de elementos
+def partir_bloque(fuentes, destinos, max_elementos=MAX_ELEMENTOS):
+    for i in range(0, len(fuentes), max_elementos):
+        fuentes_lote = fuentes[i:i + max_elementos]
+        por_solicitud = max(1, max_elementos // len(fuentes_lote))
+        for j in range(0, len(destinos), por_solicitud):
+            yield fuentes_lote, destinos[j:j + por_solicitud]
+
+
+# Función para pedir un bloque de la matriz a ORS; devuelve [((lat, lon, lat, lon), km), ...]
+def solicitar_matriz(sesion, url_base, api_key, fuentes, destinos, timeout=(5, 60)):
+    ubicaciones = [[lon, lat] for lat, lon in fuentes] + [[lon, lat] for lat, lon in destinos]
+    cuerpo = {
+        "locations": ubicaciones,
+        "sources": list(range(len(fuentes))),
+        "destinations": list(range(len(fuentes), len(ubicaciones))),
+        "metrics": ["distance"],
+        "units": "m",
+    }
+    headers = {
+        "Accept": "application/json",
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}",
+    }
+    response = sesion.post(f"{url_base}/v2/matrix/driving-car", json=cuerpo, headers=headers, timeout=timeout)
+    response.raise_for_status()
+    distancias = response.json()["distances"]
+
+    resultado = []
+    for fila, origen in zip(distancias, fuentes):
+        for metros, destino in zip(fila, destinos):
+            # ORS devuelve null cuando no encuentra ruta entre los puntos
+            if metros is not None:
+                resultado.append(((origen[0], origen[1], destino[0], destino[1]), round(metros / 1000, 2)))
+    return resultado
+
+
+# Función principal de precálculo; devuelve un resumen de lo realizado
+def precalcular(ruta_depositos='Depositos.json', ruta_localidades='Zonas_Localidades.json',
+                url_base=None, api_key=None, max_elementos=MAX_ELEMENTOS, forzar=False, cache=None):
+    if cache is None:
+        cache = obtener_cache_distancias()
+    config = configuracion_ors()
+    url_base = (url_base or config["url_base"]).rstrip("/")
+    api_key = api_key if api_key is not None else config["api_key"]
+
+    origenes, destinos = cargar_puntos(ruta_depositos, ruta_localidades)
+    bloques = agrupar_faltantes(origenes, destinos, cache, forzar=forzar)
+
+    solicitudes = 0
+    guardadas = 0
+    sin_ruta = 0
+    with requests.Session() as sesion:
+        for fuentes, faltantes in bloques:
+            for fuentes_lote, destinos_lote in partir_bloque(fuentes, faltantes, max_elementos):
+                distancias = solicitar_matriz(sesion, url_base, api_key, fuentes_lote, destinos_lote)
+                solicitudes += 1
+                cache.guardar_varios(distancias)
+                guardadas += len(distancias)
+                sin_ruta += len(fuentes_lote) * len(destinos_lote) - len(distancias)
+
+    return {
+        "pares_totales": len(origenes) * len(destinos),
+        "solicitudes": solicitudes,
+        "guardadas": guardadas,
+        "sin_ruta": sin_ruta,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precalcula la matriz de distancias depósito × localidad")
+    parser.add_argument("--depositos", default="Depositos.json")
+    parser.add_argument("--localidades", default="Zonas_Localidades.json")
+    parser.add_argument("--url-base", help="URL base de ORS (por defecto la de secrets.toml)")
+    parser.add_argument("--max-elementos", type=int, default=MAX_ELEMENTOS,
+                        help="Máximo de orígenes × destinos por solicitud")
+    parser.add_argument("--forzar", action="store_true", help="Volver a pedir también los pares ya cacheados")
+    args = parser.parse_args()
+
+    resumen = precalcular(
+        args.depositos, args.localidades,
+        url_base=args.url_base, max_elementos=args.max_elementos, forzar=args.forzar,
+    )
+    print(
+        f"Pares: {resumen['pares_totales']} | solicitudes: {resumen['solicitudes']} | "
+        f"guardadas: {resumen['guardadas']} | sin ruta: {resumen['sin_ruta']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
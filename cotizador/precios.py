@@ -0,0 +1,71 @@
+# Motor de precios sin dependencias de Streamlit: recibe todos los datos de
+# forma explícita (snapshot de tarifas, zona, tipo de carga, ...) para poder
+# usarse desde la app, la API o el cotizador por lotes.
+
+BULTO_MINIMO = "BULTO MINIMO (MAXIMO 20 KG)"
+FACTOR_IVA = 1.21
+TASA_SEGURO = 0.008
+
+# Rangos de cantidad por tipo de carga
+CARGA_RANGOS = {
+    "BULTO MINIMO (MAXIMO 20 KG)": {"min": 1, "max": 20},
+    "DE 21 KG A 100 KG": {"min": 21, "max": 100},
+    "DE 101 KG A 300 KG": {"min": 101, "max": 300},
+    "DE 301 KG A 500 KG": {"min": 301, "max": 500},
+    "DE 501 KG A 1000 KG": {"min": 501, "max": 1000},
+    "DE 1001 KG A 1500 KG": {"min": 1001, "max": 1500},
+    "DE 1501 KG A 2000 KG": {"min": 1501, "max": 2000},
+    "DE 2001 KG A 2500 KG": {"min": 2001, "max": 2500},
+    "DE 2501 KG A 3000 KG": {"min": 2501, "max": 3000},
+    "DE 3001 KG EN ADELANTE": {"min": 3001, "max": None},
+    "METROS CUBICOS": {"min": 1, "max": 20},
+    "METROS CUBICOS MUDANZA": {"min": 1, "max": 20},
+}
+CARGA_RANGOS_NORMALIZADO = {key.strip().upper(): value for key, value in CARGA_RANGOS.items()}
+RANGO_POR_DEFECTO = {"min": 1, "max": None}
+
+
+# Función para obtener el rango de cantidad de un tipo de carga
+def rango_carga(descripcion):
+    return CARGA_RANGOS_NORMALIZADO.get(descripcion.strip().upper(), RANGO_POR_DEFECTO)
+
+
+# Función para calcular el seguro de carga sobre el valor declarado
+def calcular_seguro(valor_mercaderia):
+    return (valor_mercaderia * TASA_SEGURO) if valor_mercaderia else 0
+
+
+# Función para calcular el costo final de un envío.
+# Devuelve None si no hay tarifa para la zona y el tipo de carga.
+def calcular_costo(tarifas, id_zona, peso, localidad, incluir_iva, cantidad, valor_mercaderia=None):
+    tarifa_base = tarifas.tarifa_base(id_zona, peso)
+    if tarifa_base is None:
+        return None
+
+    recargo_localidad = tarifas.recargo_localidad(id_zona, localidad)
+
+    parametros = tarifas.parametros
+    consumo_combustible = parametros['Consumo_Combustible_Litros_Km']
+    precio_combustible = parametros['Precio_Combustible']
+    costo_km = parametros['Costo_Km']
+    margen_ganancia = parametros['Margen_Ganancia']
+
+    costo_base = (
+        tarifa_base
+        # +
+        # (consumo_combustible * distancia * precio_combustible) +
+        # costo_km +
+        # recargo_localidad
+    ) * (1 +
+         margen_ganancia)
+
+    if incluir_iva:
+        costo_base *= FACTOR_IVA
+
+    # Aplicar cantidad solo si NO es Bulto Mínimo
+    if peso != BULTO_MINIMO:
+        costo_base *= cantidad
+
+    costo_base += calcular_seguro(valor_mercaderia)
+
+    return costo_base
@@ -0,0 +1,244 @@
+import logging
+import random
+import threading
+import time
+from typing import NamedTuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cotizador.configuracion import URL_BASE_ORS
+from cotizador.geo import haversine_km
+from cotizador.metricas import span
+
+# Cliente de OpenRouteService con pool de conexiones keep-alive, timeouts
+# estrictos, reintentos con backoff y circuit breaker. Mientras el circuito
+# está abierto (o si se agotan los reintentos) devuelve una estimación
+# haversine marcada como aproximada en lugar de bloquear la sesión.
+
+logger = logging.getLogger(__name__)
+
+# Relación típica entre distancia por ruta y distancia en línea recta
+FACTOR_RUTA = 1.25
+
+CODIGOS_REINTENTABLES = {429, 500, 502, 503, 504}
+# Clave rechazada: reintentar no sirve, pero es una falla del servicio (no del pedido)
+CODIGOS_CREDENCIALES = {401, 403}
+
+
+class ResultadoDistancia(NamedTuple):
+    km: float
+    aproximada: bool
+
+
+class ErrorRuteo(Exception):
+    def __init__(self, mensaje, reintentable=True):
+        super().__init__(mensaje)
+        self.reintentable = reintentable
+
+
+# Función para estimar la distancia por ruta a partir de la distancia haversine
+def estimar_distancia(origen_lat, origen_lon, destino_lat, destino_lon, factor=FACTOR_RUTA):
+    return round(haversine_km(origen_lat, origen_lon, destino_lat, destino_lon) * factor, 2)
+
+
+# Backend sin red: siempre estima a partir de la distancia en línea recta
+class RuteoHaversine:
+    def __init__(self, factor=FACTOR_RUTA):
+        self.factor = factor
+
+    def distancia(self, origen_lat, origen_lon, destino_lat, destino_lon):
+        return ResultadoDistancia(
+            estimar_distancia(origen_lat, origen_lon, destino_lat, destino_lon, factor=self.factor), True
+        )
+
+    def estadisticas(self):
+        return {"factor": self.factor}
+
+
+class CircuitBreaker:
+    CERRADO = "cerrado"
+    ABIERTO = "abierto"
+    SEMIABIERTO = "semiabierto"
+
+    def __init__(self, umbral_fallas=5, enfriamiento=30.0):
+        self.umbral_fallas = umbral_fallas
+        self.enfriamiento = enfriamiento
+        self._lock = threading.Lock()
+        self._fallas = 0
+        self._abierto_desde = None
+        self._prueba_en_curso = False
+
+    @property
+    def estado(self):
+        with self._lock:
+            return self._estado()
+
+    def _estado(self):
+        if self._abierto_desde is None:
+            return self.CERRADO
+        if time.monotonic() - self._abierto_desde >= self.enfriamiento:
+            return self.SEMIABIERTO
+        return self.ABIERTO
+
+    # Indica si se puede intentar una llamada; en semiabierto deja pasar una sola prueba
+    def permitir(self):
+        with self._lock:
+            estado = self._estado()
+            if estado == self.CERRADO:
+                return True
+            if estado == self.SEMIABIERTO and not self._prueba_en_curso:
+                self._prueba_en_curso = True
+                return True
+            return False
+
+    def registrar_exito(self):
+        with self._lock:
+            self._fallas = 0
+            self._abierto_desde = None
+            self._prueba_en_curso = False
+
+    def registrar_falla(self):
+        with self._lock:
+            self._fallas += 1
+            if self._prueba_en_curso or self._fallas >= self.umbral_fallas:
+                if self._abierto_desde is None:
+                    logger.warning("Circuito ORS abierto tras %d fallas", self._fallas)
+                self._abierto_desde = time.monotonic()
+            self._prueba_en_curso = False
+
+    # Libera la prueba del semiabierto sin contar éxito ni falla (p. ej. ante un error inesperado)
+    def liberar_prueba(self):
+        with self._lock:
+            self._prueba_en_curso = False
+
+
+class ClienteORS:
+    def __init__(self, api_key, url_base=URL_BASE_ORS, timeout_conexion=3.05, timeout_lectura=10.0,
+                 reintentos=2, backoff_base=0.25, backoff_max=2.0, tamano_pool=10,
+                 umbral_fallas=5, enfriamiento=30.0, plazo_total=8.0):
+        self.api_key = api_key
+        self.url_base = url_base.rstrip("/")
+        self.timeout = (timeout_conexion, timeout_lectura)
+        # Tope para toda la llamada (intentos + esperas): pasado el plazo se usa la
+        # estimación, así un fallo de caché no frena un rerun de Streamlit por minutos
+        self.plazo_total = plazo_total
+        self.reintentos = reintentos
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.circuito = CircuitBreaker(umbral_fallas=umbral_fallas, enfriamiento=enfriamiento)
+
+        self.sesion = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=tamano_pool, max_retries=0)
+        self.sesion.mount("https://", adaptador)
+        self.sesion.mount("http://", adaptador)
+        self.sesion.headers.update({
+            "Accept": "application/json, application/geo+json, application/gpx+xml, img/png; charset=utf-8",
+            "Authorization": f"Bearer {api_key}",
+        })
+
+        self._lock = threading.Lock()
+        self._contadores = {"solicitudes": 0, "reintentos": 0, "errores": 0, "estimaciones": 0}
+
+    def _contar(self, nombre):
+        with self._lock:
+            self._contadores[nombre] += 1
+
+    # Espera con backoff exponencial y jitter completo antes de reintentar.
+    # Devuelve False (sin esperar) si la espera no entra en el plazo restante.
+    def _esperar(self, intento, limite, retry_after=None):
+        espera = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** intento))
+        if retry_after:
+            try:
+                espera = max(espera, min(float(retry_after), self.backoff_max))
+            except ValueError:
+                pass
+        if time.monotonic() + espera >= limite:
+            return False
+        time.sleep(espera)
+        return True
+
+    # Pide la distancia por ruta a ORS; devuelve km o lanza ErrorRuteo
+    def _solicitar(self, origen_lat, origen_lon, destino_lat, destino_lon):
+        params = {
+            "start": f"{origen_lon},{origen_lat}",
+            "end": f"{destino_lon},{destino_lat}",
+        }
+        limite = time.monotonic() + self.plazo_total
+        ultimo_error = None
+        retry_after = None
+        for intento in range(self.reintentos + 1):
+            if intento:
+                # Sin lugar para esperar y reintentar dentro del plazo: se corta acá
+                if not self._esperar(intento - 1, limite, retry_after):
+                    break
+                self._contar("reintentos")
+            retry_after = None
+            restante = limite - time.monotonic()
+            self._contar("solicitudes")
+            try:
+                response = self.sesion.get(
+                    f"{self.url_base}/v2/directions/driving-car", params=params,
+                    timeout=(min(self.timeout[0], restante), min(self.timeout[1], restante)),
+                )
+            except requests.RequestException as e:
+                ultimo_error = ErrorRuteo(f"Error de conexión: {e}")
+                continue
+
+            if response.status_code == 200:
+                try:
+                    data = response.json()
+                    return round(data['features'][0]['properties']['segments'][0]['distance'] / 1000, 2)
+                except (ValueError, KeyError, IndexError, TypeError) as e:
+                    # Respuesta cortada o con otro formato: se trata como una falla del servicio
+                    ultimo_error = ErrorRuteo(f"Respuesta inválida de ORS: {e!r}")
+                    continue
+
+            mensaje = f"Error API: {response.status_code} - {response.text}"
+            if response.status_code in CODIGOS_CREDENCIALES:
+                raise ErrorRuteo(mensaje)
+            if response.status_code not in CODIGOS_REINTENTABLES:
+                # Error del pedido (p. ej. punto sin ruta): no es una falla del servicio
+                raise ErrorRuteo(mensaje, reintentable=False)
+            ultimo_error = ErrorRuteo(mensaje)
+            retry_after = response.headers.get("Retry-After")
+
+        raise ultimo_error
+
+    # Devuelve un ResultadoDistancia; si ORS no está disponible, una estimación aproximada
+    def distancia(self, origen_lat, origen_lon, destino_lat, destino_lon):
+        if not self.circuito.permitir():
+            self._contar("estimaciones")
+            return ResultadoDistancia(estimar_distancia(origen_lat, origen_lon, destino_lat, destino_lon), True)
+
+        try:
+            with span("ors"):
+                km = self._solicitar(origen_lat, origen_lon, destino_lat, destino_lon)
+        except ErrorRuteo as e:
+            # registrar_exito / registrar_falla liberan la prueba del semiabierto
+            # en el mismo paso en que cambian el estado del circuito
+            self._contar("errores")
+            if not e.reintentable:
+                # El servicio respondió bien a un pedido inválido
+                self.circuito.registrar_exito()
+                raise
+            self.circuito.registrar_falla()
+            logger.warning("ORS no disponible, usando estimación: %s", e)
+            self._contar("estimaciones")
+            return ResultadoDistancia(estimar_distancia(origen_lat, origen_lon, destino_lat, destino_lon), True)
+        except BaseException:
+            # Si algo inesperado escapa, la prueba del semiabierto no queda tomada para siempre
+            self.circuito.liberar_prueba()
+            raise
+
+        self.circuito.registrar_exito()
+        return ResultadoDistancia(km, False)
+
+    def estadisticas(self):
+        with self._lock:
+            contadores = dict(self._contadores)
+        contadores["circuito"] = self.circuito.estado
+        return contadores
+
+    def cerrar(self):
+        self.sesion.close()
@@ -0,0 +1,58 @@
+import math
+from typing import NamedTuple
+
+from cotizador.espacial import IndiceEspacial
+from cotizador.ruteo import ErrorRuteo, ResultadoDistancia, estimar_distancia
+
+# Selección automática del depósito de origen para un destino.
+# Los depósitos se recorren de más cercano a más lejano en línea recta (k-d
+# tree sobre la esfera). Como la distancia por ruta nunca es menor que la
+# línea recta, en cuanto un depósito tiene distancia por ruta conocida, los que
+# están más lejos en línea recta no pueden ganarle y no se consulta el ruteo
+# para ellos (se usa la caché si la hay o, si no, una estimación).
+#
+# El ranking es solo por distancia: la tarifa depende de la zona de destino y
+# no del depósito de origen (calcular_costo no usa la distancia), así que todos
+# los depósitos dan el mismo precio. Si el precio pasara a depender del
+# origen, la poda por línea recta dejaría de ser válida y habría que revisarla.
+
+
+class OpcionDeposito(NamedTuple):
+    deposito: dict
+    distancia_km: float
+    aproximada: bool
+    linea_recta_km: float
+
+
+class SelectorDepositos:
+    def __init__(self, depositos):
+        self.depositos = depositos
+        self.indice = IndiceEspacial(
+            [dep["Latitud"] for dep in depositos], [dep["Longitud"] for dep in depositos]
+        )
+
+    # Ordena todos los depósitos para el destino por distancia por ruta.
+    # distancia(origen_lat, origen_lon, destino_lat, destino_lon) -> ResultadoDistancia
+    def rankear(self, destino_lat, destino_lon, distancia, cache_distancias=None):
+        mejor_km = math.inf
+        opciones = []
+        for indice, linea_recta in self.indice.vecinos(destino_lat, destino_lon, k=len(self.depositos)):
+            deposito = self.depositos[indice]
+            puntos = (deposito["Latitud"], deposito["Longitud"], destino_lat, destino_lon)
+
+            if linea_recta >= mejor_km:
+                # Podado: no puede ser el más cercano
+                km = cache_distancias.obtener(*puntos, contar=False) if cache_distancias else None
+                resultado = ResultadoDistancia(km, False) if km is not None else (
+                    ResultadoDistancia(estimar_distancia(*puntos), True)
+                )
+            else:
+                try:
+                    resultado = distancia(*puntos)
+                except ErrorRuteo:
+                    resultado = ResultadoDistancia(estimar_distancia(*puntos), True)
+                mejor_km = min(mejor_km, resultado.km)
+
+            opciones.append(OpcionDeposito(deposito, resultado.km, resultado.aproximada, round(linea_recta, 2)))
+
+        return sorted(opciones, key=lambda opcion: opcion.distancia_km)
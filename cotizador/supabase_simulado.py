@@ -0,0 +1,208 @@
+import argparse
+import json
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Servidor local que imita la parte de la API REST de Supabase que usa el
+# cotizador: PostgREST (insert/upsert/select por id, con orden y paginado) y Storage (subida y
+# descarga pública de objetos). Guarda todo en memoria.
+#
+#   python -m cotizador.supabase_simulado --puerto 8090
+#
+# y en .streamlit/secrets.toml:  [supabase] url = "http://127.0.0.1:8090"
+
+
+class ManejadorSupabase(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Encabezados y cuerpo van en escrituras separadas: sin esto, Nagle + ACK
+    # retardado agregan ~40 ms a cada respuesta con keep-alive
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _responder(self, estado, cuerpo=None, tipo="application/json"):
+        if isinstance(cuerpo, (bytes, bytearray)):
+            datos = bytes(cuerpo)
+        else:
+            datos = json.dumps(cuerpo if cuerpo is not None else {}).encode()
+        self.send_response(estado)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _leer_cuerpo(self):
+        largo = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(largo) if largo else b""
+
+    def _simular_falla(self):
+        servidor = self.server
+        servidor.contar(self.command, urllib.parse.urlsplit(self.path).path)
+        if servidor.latencia:
+            time.sleep(servidor.latencia)
+        with servidor.lock:
+            if servidor.fallas_pendientes > 0:
+                servidor.fallas_pendientes -= 1
+                fallar = True
+            else:
+                fallar = False
+        if fallar:
+            self._responder(503, {"message": "falla simulada"})
+        return fallar
+
+    def do_GET(self):
+        partes = urllib.parse.urlsplit(self.path)
+        if self._simular_falla():
+            return
+        if partes.path.startswith("/rest/v1/"):
+            tabla = partes.path[len("/rest/v1/"):]
+            filtros = urllib.parse.parse_qs(partes.query)
+            filas = list(self.server.tablas.get(tabla, {}).values())
+            for columna, valores in filtros.items():
+                if columna in ("select", "limit", "order", "offset"):
+                    continue
+                operador, _, valor = valores[0].partition(".")
+                if operador == "eq":
+                    filas = [fila for fila in filas if str(fila.get(columna)) == valor]
+                elif operador == "gt":
+                    filas = [fila for fila in filas if fila.get(columna) is not None and str(fila[columna]) > valor]
+                elif operador == "in":
+                    permitidos = set(valor.strip("()").split(","))
+                    filas = [fila for fila in filas if str(fila.get(columna)) in permitidos]
+            if "order" in filtros:
+                columna, _, sentido = filtros["order"][0].partition(".")
+                filas.sort(key=lambda fila: str(fila.get(columna)), reverse=sentido.startswith("desc"))
+            if "limit" in filtros:
+                filas = filas[:int(filtros["limit"][0])]
+            self._responder(200, filas)
+            return
+        if partes.path.startswith("/storage/v1/object/public/"):
+            clave = partes.path[len("/storage/v1/object/public/"):]
+            objeto = self.server.objetos.get(urllib.parse.unquote(clave))
+            if objeto is None:
+                self._responder(404, {"statusCode": "404", "error": "not_found", "message": "Object not found"})
+            else:
+                self._responder(200, objeto[0], tipo=objeto[1])
+            return
+        self._responder(404, {"message": "no encontrado"})
+
+    def do_POST(self):
+        partes = urllib.parse.urlsplit(self.path)
+        cuerpo = self._leer_cuerpo()
+        if self._simular_falla():
+            return
+        if partes.path.startswith("/rest/v1/"):
+            tabla = self.server.tablas.setdefault(partes.path[len("/rest/v1/"):], {})
+            filas = json.loads(cuerpo or b"[]")
+            if isinstance(filas, dict):
+                filas = [filas]
+            upsert = "merge-duplicates" in self.headers.get("Prefer", "")
+            with self.server.lock:
+                if any(fila.get("id") in self.server.ids_rechazados for fila in filas):
+                    # Como una violación de restricción: PostgREST rechaza el lote entero
+                    self._responder(400, {"code": "23514", "message": "new row violates check constraint"})
+                    return
+                if not upsert and any(fila.get("id") in tabla for fila in filas):
+                    self._responder(409, {"code": "23505", "message": "duplicate key value violates unique constraint"})
+                    return
+                for fila in filas:
+                    # Como la columna created_at (default now()) de las tablas de Supabase
+                    anterior = tabla.get(fila.get("id")) or {"created_at": datetime.now(timezone.utc).isoformat()}
+                    tabla[fila.get("id")] = {**anterior, **fila}
+            self._responder(201, filas)
+            return
+        if partes.path.startswith("/storage/v1/object/"):
+            clave = urllib.parse.unquote(partes.path[len("/storage/v1/object/"):])
+            upsert = self.headers.get("x-upsert", "false") == "true"
+            with self.server.lock:
+                if clave in self.server.objetos and not upsert:
+                    self._responder(400, {"statusCode": "409", "error": "Duplicate", "message": "The resource already exists"})
+                    return
+                self.server.objetos[clave] = (cuerpo, self.headers.get("Content-Type", "application/octet-stream"))
+            self._responder(200, {"Key": clave})
+            return
+        self._responder(404, {"message": "no encontrado"})
+
+    def do_PATCH(self):
+        partes = urllib.parse.urlsplit(self.path)
+        cuerpo = json.loads(self._leer_cuerpo() or b"{}")
+        if self._simular_falla():
+            return
+        if not partes.path.startswith("/rest/v1/"):
+            self._responder(404, {"message": "no encontrado"})
+            return
+        tabla = self.server.tablas.setdefault(partes.path[len("/rest/v1/"):], {})
+        filtros = urllib.parse.parse_qs(partes.query)
+        id_filtro = filtros.get("id", [""])[0].partition(".")[2]
+        actualizadas = []
+        with self.server.lock:
+            if id_filtro in tabla:
+                tabla[id_filtro].update(cuerpo)
+                actualizadas.append(tabla[id_filtro])
+        self._responder(200, actualizadas)
+
+
+class ServidorSupabaseSimulado(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, direccion, latencia=0.0):
+        super().__init__(direccion, ManejadorSupabase)
+        self.latencia = latencia
+        self.lock = threading.Lock()
+        self.tablas = {}
+        self.objetos = {}
+        self.fallas_pendientes = 0
+        self.ids_rechazados = set()
+        self.solicitudes = {}
+
+    def contar(self, metodo, ruta):
+        recurso = "storage" if ruta.startswith("/storage/") else ruta.rsplit("/", 1)[-1]
+        with self.lock:
+            clave = f"{metodo} {recurso}"
+            self.solicitudes[clave] = self.solicitudes.get(clave, 0) + 1
+
+    # Hace que las próximas `cantidad` solicitudes respondan 503
+    def fallar(self, cantidad):
+        with self.lock:
+            self.fallas_pendientes = cantidad
+
+    # Hace que todo insert/upsert que incluya alguno de estos ids responda 400
+    def rechazar(self, *ids):
+        with self.lock:
+            self.ids_rechazados.update(ids)
+
+    @property
+    def url_base(self):
+        host, puerto = self.server_address[:2]
+        return f"http://{host}:{puerto}"
+
+
+# Función para levantar el servidor simulado en un hilo (puerto 0 = puerto libre)
+def iniciar_servidor_simulado(host="127.0.0.1", puerto=0, latencia=0.0):
+    servidor = ServidorSupabaseSimulado((host, puerto), latencia=latencia)
+    hilo = threading.Thread(target=servidor.serve_forever, daemon=True)
+    hilo.start()
+    return servidor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor Supabase (PostgREST + Storage) simulado")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8090)
+    parser.add_argument("--latencia", type=float, default=0.0, help="Segundos de demora por solicitud")
+    args = parser.parse_args()
+
+    servidor = ServidorSupabaseSimulado((args.host, args.puerto), latencia=args.latencia)
+    print(f"Supabase simulado escuchando en {servidor.url_base}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+# Snapshot compilado de precios: se arma una sola vez a partir de
+# Tarifas_Base.json, Zonas_Localidades.json y Parametros.json, con índices
+# dict para búsquedas O(1). El gestor lo recarga de forma atómica cuando
+# cambia el mtime de alguno de los archivos.
+
+logger = logging.getLogger(__name__)
+
+RUTA_TARIFAS = 'Tarifas_Base.json'
+RUTA_LOCALIDADES = 'Zonas_Localidades.json'
+RUTA_PARAMETROS = 'Parametros.json'
+
+
+# Función para normalizar nombres de localidad en los índices
+def normalizar_localidad(nombre):
+    return nombre.strip().upper()
+
+
+class SnapshotTarifas:
+    def __init__(self, tarifas_base, zonas_localidades, parametros, version, mtimes=None):
+        self.tarifas_base = tarifas_base
+        self.zonas_localidades = zonas_localidades
+        self.parametros = parametros[0]
+        self.version = version
+        self.mtimes = mtimes or {}
+
+        # (ID_Zona, Descripcion) -> fila de tarifa. ID_Zona se indexa como str
+        # para aceptar tanto el int del JSON como el valor de la sesión.
+        self.tarifas = {}
+        for item in tarifas_base:
+            self.tarifas.setdefault((str(item['ID_Zona']), item['Descripcion']), item)
+
+        # (ID_Zona, nombre normalizado) -> fila de localidad. El nombre solo no
+        # alcanza: hay localidades homónimas en distintas zonas (METAN está en la
+        # zona 1 y en la 3), así que también se indexan todas las filas por nombre.
+        self.localidades = {}
+        self.localidades_por_nombre = {}
+        self.nombres_zona = {}
+        for item in zonas_localidades:
+            nombre = normalizar_localidad(item['Localidad'])
+            self.localidades.setdefault((str(item['ID_Zona']), nombre), item)
+            self.localidades_por_nombre.setdefault(nombre, []).append(item)
+            self.nombres_zona.setdefault(str(item['ID_Zona']), item['Nombre_Zona'])
+
+        # Listas de opciones por zona para los selectbox, armadas una vez por snapshot
+        self.zonas = sorted(set(item['ID_Zona'] for item in zonas_localidades))
+        self.localidades_por_zona = {}
+        for item in zonas_localidades:
+            self.localidades_por_zona.setdefault(item['ID_Zona'], []).append(item['Localidad'])
+        self.descripciones_por_zona = {}
+        for item in tarifas_base:
+            self.descripciones_por_zona.setdefault(item['ID_Zona'], []).append(item['Descripcion'])
+
+    # Índice de búsqueda de localidades (prefijos, aproximada y por coordenadas);
+    # se arma la primera vez que se usa, una vez por snapshot
+    @functools.cached_property
+    def buscador(self):
+        from cotizador.busqueda_localidades import IndiceLocalidades
+        return IndiceLocalidades(self.zonas_localidades)
+
+    # Devuelve la fila de tarifa para la zona y el tipo de carga, o None
+    def tarifa(self, id_zona, descripcion):
+        return self.tarifas.get((str(id_zona), descripcion))
+
+    def tarifa_base(self, id_zona, descripcion):
+        item = self.tarifa(id_zona, descripcion)
+        return item['Tarifa_Base'] if item else None
+
+    # Devuelve la fila de la localidad dentro de la zona, o None
+    def localidad(self, id_zona, nombre):
+        return self.localidades.get((str(id_zona), normalizar_localidad(nombre)))
+
+    # Devuelve las filas de todas las zonas con ese nombre (lista vacía si no existe)
+    def localidades_con_nombre(self, nombre):
+        return self.localidades_por_nombre.get(normalizar_localidad(nombre), [])
+
+    # Devuelve la fila de la localidad; sin zona, solo si el nombre no se repite en otra zona
+    def buscar_localidad(self, nombre, id_zona=None):
+        if id_zona not in (None, ""):
+            return self.localidad(id_zona, nombre)
+        candidatas = self.localidades_con_nombre(nombre)
+        return candidatas[0] if len(candidatas) == 1 else None
+
+    def recargo_localidad(self, id_zona, nombre):
+        item = self.localidad(id_zona, nombre)
+        return item['Recargo_Localidad'] if item else 0
+
+    def nombre_zona(self, id_zona):
+        return self.nombres_zona.get(str(id_zona), "Zona desconocida")
+
+
+# Función para compilar un snapshot leyendo los tres archivos
+def compilar_snapshot(ruta_tarifas=RUTA_TARIFAS, ruta_localidades=RUTA_LOCALIDADES, ruta_parametros=RUTA_PARAMETROS):
+    rutas = (ruta_tarifas, ruta_localidades, ruta_parametros)
+    mtimes = {ruta: os.stat(ruta).st_mtime_ns for ruta in rutas}
+
+    hash_contenido = hashlib.sha256()
+    contenidos = []
+    for ruta in rutas:
+        with open(ruta, 'rb') as f:
+            datos = f.read()
+        hash_contenido.update(datos)
+        contenidos.append(json.loads(datos))
+
+    tarifas_base, zonas_localidades, parametros = contenidos
+    return SnapshotTarifas(
+        tarifas_base, zonas_localidades, parametros,
+        version=hash_contenido.hexdigest()[:12],
+        mtimes=mtimes,
+    )
+
+
+class GestorTarifas:
+    def __init__(self, ruta_tarifas=RUTA_TARIFAS, ruta_localidades=RUTA_LOCALIDADES,
+                 ruta_parametros=RUTA_PARAMETROS, intervalo_verificacion=2.0):
+        self.rutas = (ruta_tarifas, ruta_localidades, ruta_parametros)
+        self.intervalo_verificacion = intervalo_verificacion
+        self._lock = threading.Lock()
+        self._snapshot = compilar_snapshot(*self.rutas)
+        self._ultima_verificacion = time.monotonic()
+
+    def _modificado(self):
+        try:
+            return any(os.stat(ruta).st_mtime_ns != self._snapshot.mtimes.get(ruta) for ruta in self.rutas)
+        except FileNotFoundError:
+            return False
+
+    # Devuelve el snapshot vigente, recargándolo si algún archivo cambió
+    def actual(self):
+        ahora = time.monotonic()
+        if ahora - self._ultima_verificacion < self.intervalo_verificacion:
+            return self._snapshot
+
+        with self._lock:
+            if ahora - self._ultima_verificacion >= self.intervalo_verificacion:
+                self._ultima_verificacion = ahora
+                if self._modificado():
+                    self.recargar()
+        return self._snapshot
+
+    def recargar(self):
+        try:
+            nuevo = compilar_snapshot(*self.rutas)
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            # Archivo a medio escribir o inválido: se sigue usando el snapshot anterior
+            logger.warning("No se pudo recargar las tarifas: %s", e)
+            return self._snapshot
+        if nuevo.version != self._snapshot.version:
+            logger.info("Tarifas recargadas: %s -> %s", self._snapshot.version, nuevo.version)
+        # La asignación de la referencia es atómica: los lectores ven el snapshot
+        # viejo o el nuevo completo, nunca uno a medio armar.
+        self._snapshot = nuevo
+        return nuevo
+
+
+_gestor_global = None
+_lock_global = threading.Lock()
+
+
+# Función para obtener el gestor de tarifas único del proceso
+def obtener_gestor_tarifas():
+    global _gestor_global
+    if _gestor_global is None:
+        with _lock_global:
+            if _gestor_global is None:
+                _gestor_global = GestorTarifas()
+    return _gestor_global
@@ -0,0 +1,217 @@
+import functools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from cotizador.almacenamiento import guardar_cotizacion, subir_pdf
+from cotizador.pdf import convertir_html_a_pdf
+
+# Pipeline asíncrono de generación de cotizaciones. Después de armar el HTML,
+# el guardado en Supabase, la conversión a PDF y la subida al Storage corren
+# como trabajos independientes en un pool de hilos; la UI consulta el estado
+# con el handle TrabajoCotizacion. La cola de etapas es acotada: con
+# max_en_cola etapas esperando, enviar() rechaza la cotización en vez de
+# acumular renders de PDF sin límite.
+
+logger = logging.getLogger(__name__)
+
+MAX_EN_COLA = int(os.environ.get("COTIZADOR_PIPELINE_COLA", 64))
+
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+OK = "ok"
+ERROR = "error"
+
+ETAPAS = ("guardado", "pdf", "subida")
+
+
+class PipelineSaturado(Exception):
+    pass
+
+
+class TrabajoCotizacion:
+    def __init__(self, cotizacion_id, datos_cotizacion, html_cotizacion, documento=None):
+        self.cotizacion_id = cotizacion_id
+        self.datos_cotizacion = datos_cotizacion
+        self.html_cotizacion = html_cotizacion
+        self.documento = documento
+        self.pdf_bytes = None
+        self.url_publica = None
+        self.creado = time.time()
+
+        self._lock = threading.Lock()
+        self._etapas = {etapa: PENDIENTE for etapa in ETAPAS}
+        self._errores = {}
+
+    def _marcar(self, etapa, estado, error=None):
+        with self._lock:
+            self._etapas[etapa] = estado
+            if error is not None:
+                self._errores[etapa] = str(error)
+            elif estado != ERROR:
+                self._errores.pop(etapa, None)
+
+    # Estado de cada etapa: {"guardado": "ok", "pdf": "en_curso", ...}
+    def estado(self):
+        with self._lock:
+            return dict(self._etapas)
+
+    def errores(self):
+        with self._lock:
+            return dict(self._errores)
+
+    @property
+    def terminado(self):
+        return all(estado in (OK, ERROR) for estado in self.estado().values())
+
+    @property
+    def exitoso(self):
+        return all(estado == OK for estado in self.estado().values())
+
+    # Espera (bloqueando) a que terminen todas las etapas; útil fuera de la UI
+    def esperar(self, timeout=None, intervalo=0.05):
+        limite = None if timeout is None else time.monotonic() + timeout
+        while not self.terminado:
+            if limite is not None and time.monotonic() >= limite:
+                return False
+            time.sleep(intervalo)
+        return True
+
+
+class PipelineCotizacion:
+    # guardar(cotizacion_id, datos, html, documento): por defecto escribe directo en Supabase;
+    # puede reemplazarse por el outbox local (ver cotizador.outbox).
+    # al_subir(cotizacion_id, url_publica): se llama cuando el PDF quedó subido.
+    def __init__(self, supabase, url_supabase, max_workers=4, reintentos=2, backoff_base=0.5,
+                 max_trabajos=1000, guardar=None, renderizar=convertir_html_a_pdf, subir=subir_pdf,
+                 al_subir=None, max_en_cola=MAX_EN_COLA):
+        self.supabase = supabase
+        self.url_supabase = url_supabase
+        self.reintentos = reintentos
+        self.backoff_base = backoff_base
+        self.max_trabajos = max_trabajos
+        self.guardar = guardar or functools.partial(guardar_cotizacion, supabase)
+        self.renderizar = renderizar
+        self.subir = subir
+        self.al_subir = al_subir
+        self.max_en_cola = max_en_cola
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cotizacion")
+        self._lock = threading.Lock()
+        self._trabajos = OrderedDict()
+        # Etapas enviadas al pool que todavía no terminaron (en espera o en curso)
+        self._en_cola = 0
+
+    # Encola las etapas de una cotización y devuelve el handle inmediatamente.
+    # Lanza PipelineSaturado si la cola de etapas está llena.
+    def enviar(self, cotizacion_id, datos_cotizacion, html_cotizacion, documento=None):
+        with self._lock:
+            if self._en_cola + 2 > self.max_en_cola:
+                raise PipelineSaturado("Hay demasiadas cotizaciones generándose, intente nuevamente en unos segundos")
+            self._en_cola += 2
+        trabajo = TrabajoCotizacion(cotizacion_id, datos_cotizacion, html_cotizacion, documento)
+        self._registrar(trabajo)
+        self._executor.submit(self._correr, self._etapa_guardado, trabajo)
+        self._executor.submit(self._correr, self._etapa_pdf, trabajo)
+        return trabajo
+
+    # Encola una etapa de un trabajo ya aceptado (subida, reintentos): no se rechaza
+    def _encolar(self, etapa, trabajo):
+        with self._lock:
+            self._en_cola += 1
+        self._executor.submit(self._correr, etapa, trabajo)
+
+    def _correr(self, etapa, trabajo):
+        try:
+            etapa(trabajo)
+        finally:
+            with self._lock:
+                self._en_cola -= 1
+
+    def en_cola(self):
+        with self._lock:
+            return self._en_cola
+
+    # Devuelve el handle de una cotización ya guardada y subida (p. ej. tras un
+    # reinicio) sin volver a ejecutar ninguna etapa. El PDF queda en url_publica.
+    def restaurar(self, cotizacion_id, datos_cotizacion, html_cotizacion, url_publica, creado=None):
+        trabajo = TrabajoCotizacion(cotizacion_id, datos_cotizacion, html_cotizacion)
+        trabajo.url_publica = url_publica
+        if creado is not None:
+            trabajo.creado = creado
+        for etapa in ETAPAS:
+            trabajo._marcar(etapa, OK)
+        self._registrar(trabajo)
+        return trabajo
+
+    def _registrar(self, trabajo):
+        with self._lock:
+            self._trabajos[trabajo.cotizacion_id] = trabajo
+            while len(self._trabajos) > self.max_trabajos:
+                self._trabajos.popitem(last=False)
+
+    def obtener(self, cotizacion_id):
+        with self._lock:
+            return self._trabajos.get(cotizacion_id)
+
+    # Vuelve a encolar las etapas que fallaron, sin regenerar la cotización
+    def reintentar(self, trabajo):
+        estado = trabajo.estado()
+        if estado["guardado"] == ERROR:
+            trabajo._marcar("guardado", PENDIENTE)
+            self._encolar(self._etapa_guardado, trabajo)
+        if estado["pdf"] == ERROR:
+            trabajo._marcar("pdf", PENDIENTE)
+            trabajo._marcar("subida", PENDIENTE)
+            self._encolar(self._etapa_pdf, trabajo)
+        elif estado["subida"] == ERROR:
+            trabajo._marcar("subida", PENDIENTE)
+            self._encolar(self._etapa_subida, trabajo)
+
+    # Ejecuta una etapa con reintentos y backoff exponencial; devuelve True si terminó bien
+    def _ejecutar(self, trabajo, etapa, funcion):
+        trabajo._marcar(etapa, EN_CURSO)
+        for intento in range(self.reintentos + 1):
+            try:
+                funcion()
+            except Exception as e:
+                logger.warning("Cotización %s, etapa %s, intento %d: %s", trabajo.cotizacion_id, etapa, intento + 1, e)
+                if intento < self.reintentos:
+                    time.sleep(self.backoff_base * 2 ** intento)
+                    continue
+                trabajo._marcar(etapa, ERROR, e)
+                return False
+            trabajo._marcar(etapa, OK)
+            return True
+
+    def _etapa_guardado(self, trabajo):
+        self._ejecutar(trabajo, "guardado", lambda: self.guardar(
+            trabajo.cotizacion_id, trabajo.datos_cotizacion, trabajo.html_cotizacion, trabajo.documento
+        ))
+
+    def _etapa_pdf(self, trabajo):
+        def renderizar():
+            trabajo.pdf_bytes = self.renderizar(trabajo.html_cotizacion)
+
+        if self._ejecutar(trabajo, "pdf", renderizar):
+            self._encolar(self._etapa_subida, trabajo)
+        else:
+            trabajo._marcar("subida", ERROR, "PDF no disponible")
+
+    def _etapa_subida(self, trabajo):
+        def subir():
+            trabajo.url_publica = self.subir(
+                self.supabase, self.url_supabase, f"{trabajo.cotizacion_id}.pdf", trabajo.pdf_bytes
+            )
+
+        if self._ejecutar(trabajo, "subida", subir) and self.al_subir is not None:
+            try:
+                self.al_subir(trabajo.cotizacion_id, trabajo.url_publica)
+            except Exception:
+                logger.exception("Cotización %s: error al registrar la URL del PDF", trabajo.cotizacion_id)
+
+    def cerrar(self, esperar=True):
+        self._executor.shutdown(wait=esperar)
@@ -0,0 +1,170 @@
+import base64
+import hashlib
+import hmac
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
+
+from cotizador.cache_cotizaciones import VALIDEZ_SEGUNDOS
+
+# Verificación de cotizaciones desde el QR impreso.
+# El QR lleva una URL corta firmada, <url_base><token>, donde el token es el id
+# (uuid en base64url, 22 caracteres) seguido de un HMAC-SHA256 truncado (12
+# caracteres): la firma se valida sin red y la verificación hace una sola
+# búsqueda por id. Las búsquedas pasan por una caché LRU en memoria con caché
+# negativa (ids inexistentes) y las consultas simultáneas por el mismo id se
+# agrupan en una sola, así una ráfaga de escaneos en un depósito no llega a
+# Supabase una vez por escaneo.
+
+LARGO_ID = 22
+BYTES_FIRMA = 9  # 12 caracteres en base64url
+LARGO_FIRMA = 12
+
+# Una cotización guardada no cambia: se recuerda por una hora. Un id inexistente
+# se recuerda poco, porque la cotización puede estar todavía en el outbox.
+TTL_ENCONTRADA = 3600.0
+TTL_NO_ENCONTRADA = 30.0
+MAX_ENTRADAS = 10_000
+
+# Token válido: solo caracteres base64url ASCII, id y firma completos
+_PATRON_TOKEN = re.compile(r"[A-Za-z0-9_-]{%d}" % (LARGO_ID + LARGO_FIRMA))
+
+ESTADO_VIGENTE = "vigente"
+ESTADO_VENCIDA = "vencida"
+ESTADO_REGISTRADA = "registrada"
+
+
+def _b64(datos):
+    return base64.urlsafe_b64encode(datos).rstrip(b"=").decode("ascii")
+
+
+def _firma(id_compacto, clave):
+    digest = hmac.new(clave.encode("utf-8"), id_compacto.encode("ascii"), hashlib.sha256).digest()
+    return _b64(digest[:BYTES_FIRMA])
+
+
+# Función para armar el token firmado de una cotización (lanza ValueError si el id no es un uuid)
+def firmar(cotizacion_id, clave):
+    id_compacto = _b64(uuid.UUID(cotizacion_id).bytes)
+    return id_compacto + _firma(id_compacto, clave)
+
+
+# Función para validar un token; devuelve el id de la cotización o None si la firma no es válida
+def leer_token(token, clave):
+    if not isinstance(token, str) or not _PATRON_TOKEN.fullmatch(token):
+        return None
+    id_compacto, firma = token[:LARGO_ID], token[LARGO_ID:]
+    if not hmac.compare_digest(firma, _firma(id_compacto, clave)):
+        return None
+    try:
+        return str(uuid.UUID(bytes=base64.urlsafe_b64decode(id_compacto + "==")))
+    except ValueError:
+        return None
+
+
+# Función para armar la URL de verificación que va en el QR
+def url_verificacion(cotizacion_id, url_base, clave):
+    return f"{url_base}{firmar(cotizacion_id, clave)}"
+
+
+# Función para consultar en Supabase lo que muestra la verificación (bloqueante).
+# created_at es la columna por defecto de las tablas de Supabase; puede faltar.
+def buscar_en_supabase(supabase, cotizacion_id):
+    response = supabase.table('cotizaciones').select('*').eq('id', cotizacion_id).limit(1).execute()
+    if not response.data:
+        return None
+    fila = dict(response.data[0])
+    creado = fila.pop("created_at", None)
+    try:
+        fila["creado"] = datetime.fromisoformat(creado).timestamp() if creado else None
+    except ValueError:
+        fila["creado"] = None
+    return fila
+
+
+# Función para armar la respuesta pública de la verificación (estado calculado al momento)
+def resultado_verificacion(fila, ahora=None):
+    ahora = time.time() if ahora is None else ahora
+    creado = fila.get("creado")
+    if creado is None:
+        estado = ESTADO_REGISTRADA
+    else:
+        estado = ESTADO_VIGENTE if ahora - creado < VALIDEZ_SEGUNDOS else ESTADO_VENCIDA
+    return {
+        "id": fila["id"],
+        "estado": estado,
+        "costo_final": fila.get("costo_final"),
+        "deposito": fila.get("deposito"),
+        "localidad": fila.get("localidad"),
+        "cantidad": fila.get("cantidad"),
+        "emitida": datetime.fromtimestamp(creado).isoformat(timespec="minutes") if creado else None,
+        "valida_hasta": datetime.fromtimestamp(creado + VALIDEZ_SEGUNDOS).isoformat(timespec="minutes")
+        if creado else None,
+    }
+
+
+class VerificadorCotizaciones:
+    # buscar(cotizacion_id) -> dict con id, costo_final, ... y "creado" (epoch o None), o None
+    def __init__(self, buscar, max_entradas=MAX_ENTRADAS, ttl_encontrada=TTL_ENCONTRADA,
+                 ttl_no_encontrada=TTL_NO_ENCONTRADA, timeout=10.0):
+        self.buscar = buscar
+        self.max_entradas = max_entradas
+        self.ttl_encontrada = ttl_encontrada
+        self.ttl_no_encontrada = ttl_no_encontrada
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._memoria = OrderedDict()  # cotizacion_id -> (fila o None, vence)
+        self._en_curso = {}            # cotizacion_id -> Future de la búsqueda
+        self._contadores = {"aciertos": 0, "aciertos_negativos": 0, "busquedas": 0, "agrupadas": 0, "errores": 0}
+
+    # Resultado de la verificación (ver resultado_verificacion) o None si la cotización no existe.
+    # Los errores de búsqueda se propagan y no se guardan en la caché.
+    def consultar(self, cotizacion_id):
+        fila = self._fila(cotizacion_id)
+        return resultado_verificacion(fila) if fila is not None else None
+
+    def _fila(self, cotizacion_id):
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._memoria.get(cotizacion_id)
+            if entrada is not None and entrada[1] > ahora:
+                self._memoria.move_to_end(cotizacion_id)
+                self._contadores["aciertos" if entrada[0] is not None else "aciertos_negativos"] += 1
+                return entrada[0]
+            # Si ya hay una búsqueda en curso para este id, se espera su resultado
+            busqueda = self._en_curso.get(cotizacion_id)
+            agrupada = busqueda is not None
+            if agrupada:
+                self._contadores["agrupadas"] += 1
+            else:
+                busqueda = self._en_curso[cotizacion_id] = Future()
+                self._contadores["busquedas"] += 1
+        if agrupada:
+            return busqueda.result(timeout=self.timeout)
+
+        try:
+            fila = self.buscar(cotizacion_id)
+        except Exception as e:
+            with self._lock:
+                self._en_curso.pop(cotizacion_id, None)
+                self._contadores["errores"] += 1
+            busqueda.set_exception(e)
+            raise
+        ttl = self.ttl_encontrada if fila is not None else self.ttl_no_encontrada
+        with self._lock:
+            self._memoria[cotizacion_id] = (fila, time.monotonic() + ttl)
+            self._memoria.move_to_end(cotizacion_id)
+            while len(self._memoria) > self.max_entradas:
+                self._memoria.popitem(last=False)
+            self._en_curso.pop(cotizacion_id, None)
+        busqueda.set_result(fila)
+        return fila
+
+    def estadisticas(self):
+        with self._lock:
+            return {**self._contadores, "entradas": len(self._memoria), "en_curso": len(self._en_curso)}
@@ -0,0 +1,91 @@
+import pytest
+
+from cotizador import supabase_simulado
+from cotizador.outbox import OutboxCotizaciones
+
+supabase = pytest.importorskip("supabase")
+
+# Outbox de cotizaciones contra el Supabase simulado: caída total, recuperación
+# y filas rechazadas para siempre (que no deben frenar al resto del lote)
+
+
+@pytest.fixture
+def servidor():
+    servidor = supabase_simulado.iniciar_servidor_simulado()
+    yield servidor
+    servidor.shutdown()
+
+
+def outbox(servidor, tmp_path, **opciones):
+    opciones = {"tamano_lote": 10, "backoff_base": 0.0, "backoff_max": 0.0, **opciones}
+    cliente = supabase.create_client(servidor.url_base, "prueba")
+    return OutboxCotizaciones(cliente, ruta_db=str(tmp_path / "outbox.db"), **opciones)
+
+
+def encolar(caja, cantidad):
+    for numero in range(cantidad):
+        clave = f"cot-{numero}"
+        caja.encolar({
+            "cotizaciones": {"id": clave, "costo_final": 100 + numero},
+            "cotizaciones_html": {"id": clave, "html_cotizacion": f"<p>{clave}</p>"},
+        }, clave)
+
+
+def test_caida_total_y_recuperacion(servidor, tmp_path):
+    caja = outbox(servidor, tmp_path)
+    encolar(caja, 10)
+    servidor.fallar(1000)
+    assert caja.vaciar() == 0
+    # Caída total: se corta tras unos pocos envíos en vez de partir el lote fila por fila
+    assert servidor.solicitudes["POST cotizaciones"] <= 2 * (10).bit_length()
+    assert caja.pendientes() == 20
+    assert caja.descartadas() == 0
+
+    servidor.fallar(0)
+    assert caja.vaciar() == 20
+    assert caja.pendientes() == 0
+    assert len(servidor.tablas["cotizaciones"]) == 10
+    assert len(servidor.tablas["cotizaciones_html"]) == 10
+
+
+def test_fila_rechazada_no_frena_el_lote(servidor, tmp_path):
+    # Con backoff largo la fila rechazada queda postergada y no se reintenta en este vaciado
+    caja = outbox(servidor, tmp_path, backoff_base=60.0, backoff_max=60.0)
+    encolar(caja, 10)
+    servidor.rechazar("cot-3")
+
+    assert caja.vaciar() == 18
+    assert "cot-3" not in servidor.tablas["cotizaciones"]
+    assert len(servidor.tablas["cotizaciones"]) == 9
+    # El html de la cotización rechazada espera a su fila principal
+    assert "cot-3" not in servidor.tablas["cotizaciones_html"]
+    assert caja.pendientes() == 2
+    estadisticas = caja.estadisticas()
+    assert estadisticas["enviadas"] == 18
+    assert estadisticas["fallas"] == 1
+
+
+def test_fila_rechazada_se_descarta_tras_max_intentos(servidor, tmp_path):
+    caja = outbox(servidor, tmp_path, max_intentos=3)
+    encolar(caja, 4)
+    servidor.rechazar("cot-1")
+
+    for _ in range(3):
+        caja.vaciar()
+    estadisticas = caja.estadisticas()
+    assert estadisticas["pendientes"] == 0
+    assert estadisticas["descartadas"] == 2
+    assert estadisticas["descartes"] == 1
+    assert len(servidor.tablas["cotizaciones"]) == 3
+
+    # Descartada: no se vuelve a intentar
+    enviadas_antes = servidor.solicitudes["POST cotizaciones"]
+    assert caja.vaciar() == 0
+    assert servidor.solicitudes["POST cotizaciones"] == enviadas_antes
+
+    # Corregido el problema, se puede volver a poner en envío
+    servidor.ids_rechazados.clear()
+    assert caja.reintentar_descartadas() == 2
+    assert caja.vaciar() == 2
+    assert caja.estadisticas()["descartadas"] == 0
+    assert "cot-1" in servidor.tablas["cotizaciones_html"]
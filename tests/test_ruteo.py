@@ -0,0 +1,117 @@
+import time
+
+import pytest
+
+from cotizador import ors_simulado
+from cotizador.ruteo import CircuitBreaker, ClienteORS, ErrorRuteo
+
+# Cliente ORS y circuit breaker contra el ORS simulado (sin red ni API key)
+
+ORIGEN = (-24.19, -65.30)
+DESTINO = (-23.58, -65.39)
+
+
+@pytest.fixture
+def ors():
+    servidor = ors_simulado.iniciar_servidor_simulado()
+    yield servidor
+    servidor.shutdown()
+
+
+def cliente(ors, **opciones):
+    opciones = {"reintentos": 0, "backoff_base": 0.001, "umbral_fallas": 2, "enfriamiento": 0.2, **opciones}
+    return ClienteORS("prueba", url_base=ors.url_base, **opciones)
+
+
+def test_distancia_por_ruta(ors):
+    resultado = cliente(ors).distancia(*ORIGEN, *DESTINO)
+    assert not resultado.aproximada
+    assert ors.solicitudes["directions"] == 1
+
+
+def test_circuito_abierto_semiabierto_cerrado(ors):
+    c = cliente(ors)
+    ors.fallar(2)
+    assert c.distancia(*ORIGEN, *DESTINO).aproximada
+    assert c.circuito.estado == CircuitBreaker.CERRADO
+    assert c.distancia(*ORIGEN, *DESTINO).aproximada
+    assert c.circuito.estado == CircuitBreaker.ABIERTO
+
+    # Abierto: estima sin llamar a ORS
+    assert c.distancia(*ORIGEN, *DESTINO).aproximada
+    assert ors.solicitudes["directions"] == 2
+
+    time.sleep(0.25)
+    assert c.circuito.estado == CircuitBreaker.SEMIABIERTO
+    resultado = c.distancia(*ORIGEN, *DESTINO)
+    assert not resultado.aproximada
+    assert c.circuito.estado == CircuitBreaker.CERRADO
+    assert ors.solicitudes["directions"] == 3
+
+
+def test_prueba_fallida_reabre_el_circuito(ors):
+    c = cliente(ors)
+    ors.fallar(3)
+    c.distancia(*ORIGEN, *DESTINO)
+    c.distancia(*ORIGEN, *DESTINO)
+    time.sleep(0.25)
+    assert c.distancia(*ORIGEN, *DESTINO).aproximada
+    assert c.circuito.estado == CircuitBreaker.ABIERTO
+
+
+def test_semiabierto_deja_pasar_una_sola_prueba():
+    circuito = CircuitBreaker(umbral_fallas=1, enfriamiento=0.0)
+    circuito.registrar_falla()
+    assert circuito.permitir()
+    assert not circuito.permitir()
+    circuito.registrar_exito()
+    assert circuito.permitir()
+    assert circuito.permitir()
+
+
+def test_reintento_respeta_retry_after(ors):
+    c = cliente(ors, reintentos=1, backoff_max=1.0)
+    ors.fallar(1, 503, retry_after=0.3)
+    inicio = time.monotonic()
+    resultado = c.distancia(*ORIGEN, *DESTINO)
+    assert time.monotonic() - inicio >= 0.3
+    assert not resultado.aproximada
+    assert c.estadisticas()["reintentos"] == 1
+    assert c.circuito.estado == CircuitBreaker.CERRADO
+
+
+def test_plazo_total_corta_los_reintentos(ors):
+    c = cliente(ors, reintentos=5, backoff_max=5.0, plazo_total=0.5)
+    ors.fallar(10, 503, retry_after=2)
+    inicio = time.monotonic()
+    assert c.distancia(*ORIGEN, *DESTINO).aproximada
+    assert time.monotonic() - inicio < 0.5
+    assert ors.solicitudes["directions"] == 1
+
+
+def test_credenciales_rechazadas_cuentan_como_falla(ors):
+    c = cliente(ors, umbral_fallas=1)
+    ors.fallar(1, 401)
+    assert c.distancia(*ORIGEN, *DESTINO).aproximada
+    assert c.circuito.estado == CircuitBreaker.ABIERTO
+
+
+def test_pedido_invalido_no_abre_el_circuito(ors):
+    c = cliente(ors, umbral_fallas=1)
+    ors.fallar(1, 404)
+    with pytest.raises(ErrorRuteo):
+        c.distancia(*ORIGEN, *DESTINO)
+    assert c.circuito.estado == CircuitBreaker.CERRADO
+
+
+def test_error_inesperado_libera_la_prueba(ors, monkeypatch):
+    c = cliente(ors, umbral_fallas=1, enfriamiento=0.0)
+    c.circuito.registrar_falla()
+
+    def romper(*args):
+        raise ZeroDivisionError
+
+    monkeypatch.setattr(c, "_solicitar", romper)
+    with pytest.raises(ZeroDivisionError):
+        c.distancia(*ORIGEN, *DESTINO)
+    assert c.circuito.permitir()
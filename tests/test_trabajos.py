@@ -0,0 +1,30 @@
+import threading
+
+import pytest
+
+from cotizador.trabajos import PipelineCotizacion, PipelineSaturado
+
+# Cola acotada del pipeline: con las etapas trabadas, enviar() rechaza en vez de acumular
+
+
+def test_pipeline_rechaza_con_la_cola_llena():
+    liberar = threading.Event()
+
+    def renderizar(html):
+        liberar.wait(timeout=10)
+        return b"%PDF"
+
+    pipeline = PipelineCotizacion(
+        None, "http://supabase", max_workers=1, max_en_cola=4,
+        guardar=lambda *args: None, renderizar=renderizar, subir=lambda *args: "http://pdf",
+    )
+    trabajos = [pipeline.enviar(f"cot-{i}", {}, "<p></p>") for i in range(2)]
+    with pytest.raises(PipelineSaturado):
+        pipeline.enviar("cot-2", {}, "<p></p>")
+    assert pipeline.obtener("cot-2") is None
+
+    liberar.set()
+    assert all(trabajo.esperar(timeout=10) and trabajo.exitoso for trabajo in trabajos)
+    assert pipeline.enviar("cot-2", {}, "<p></p>").esperar(timeout=10)
+    pipeline.cerrar()
+    assert pipeline.en_cola() == 0